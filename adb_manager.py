@@ -1,110 +1,265 @@
 """
 ADB Manager module for detecting and managing Android devices
 """
+import json
+import os
+import shutil
 import subprocess
 import re
+import threading
 import time
 
+import tracing
+from metrics import ADB_COMMAND_ERRORS, ADB_COMMAND_SECONDS, ROTATION_PHASE_SECONDS
+from tracing import span, traced
+
+
+# Local state file for results worth keeping between CLI runs
+STATE_FILE = os.environ.get('MOBILE_PROXY_STATE', 'mobile_proxy_state.json')
+
+# How long a successful adb lookup in STATE_FILE is trusted
+ADB_CHECK_TTL = 300
+
+
+def _read_state(state_path):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(state_path, state):
+    """Replace the state file atomically so concurrent CLI runs never see half a file"""
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _command_type(args):
+    """Metric label for an adb invocation, e.g. 'getprop' or 'forward_remove'"""
+    words = args[1:]
+    if words[:1] == ['-s']:
+        words = words[2:]
+    if not words:
+        return 'adb'
+    if words[0] == 'shell' and len(words) > 1:
+        return words[1]
+    if words[0] == 'forward' and len(words) > 1 and words[1].startswith('--'):
+        return f'forward_{words[1][2:]}'
+    return words[0]
+
+
+def _run_adb(args, timeout):
+    """subprocess.run for adb, recording its latency and failures by command type
+    (and a span with the full command line when tracing)"""
+    command = _command_type(args)
+    started = time.perf_counter_ns()
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+    except (subprocess.TimeoutExpired, OSError):
+        ADB_COMMAND_ERRORS.labels(command=command).inc()
+        raise
+    finally:
+        finished = time.perf_counter_ns()
+        ADB_COMMAND_SECONDS.labels(command=command).observe((finished - started) / 1e9)
+        tracer = tracing.current()
+        if tracer is not None:
+            tracer.complete(f'adb {command}', 'adb', started, finished, {'argv': ' '.join(args[1:])})
+    if result.returncode != 0:
+        ADB_COMMAND_ERRORS.labels(command=command).inc()
+    return result
+
+
+def resolve_adb(adb='adb', state_path=STATE_FILE, ttl=ADB_CHECK_TTL):
+    """Find the adb binary and its version; returns (path, version) or (None, None)
+    
+    A successful check is stored in state_path and reused for ttl seconds as
+    long as it was made for the same name and PATH and the binary has not
+    been modified since, so repeated CLI invocations skip the `adb version`
+    subprocess. Failures are not cached, so installing adb takes effect
+    immediately.
+    """
+    search_path = os.environ.get('PATH', '')
+    state = _read_state(state_path) if state_path else {}
+    cached = state.get('adb')
+    
+    if isinstance(cached, dict) and cached.get('name') == adb and cached.get('search_path') == search_path \
+            and time.time() - cached.get('checked_at', 0) < ttl:
+        try:
+            if os.stat(cached['path']).st_mtime == cached.get('mtime'):
+                return cached['path'], cached.get('version')
+        except (OSError, KeyError, TypeError):
+            pass
+    
+    path = shutil.which(adb)
+    if not path:
+        return None, None
+    
+    try:
+        result = subprocess.run([path, 'version'],
+                              capture_output=True,
+                              text=True,
+                              timeout=5)
+    except (subprocess.TimeoutExpired, OSError):
+        return None, None
+    if result.returncode != 0:
+        return None, None
+    
+    version = result.stdout.strip().split('\n')[0]
+    if state_path:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        state['adb'] = {'name': adb, 'search_path': search_path, 'path': path, 'mtime': mtime,
+                        'version': version, 'checked_at': time.time()}
+        _write_state(state_path, state)
+    return path, version
+
 
 class ADBManager:
-    def __init__(self):
+    def __init__(self, adb_path='adb'):
+        # Name or full path of the adb executable
+        self.adb_path = adb_path
+        # Model/Android version per connected serial, so long-running
+        # processes only run getprop for newly attached devices. The daemon
+        # shares one ADBManager between threads, so access holds devices_lock
         self.devices = {}
+        self.devices_lock = threading.Lock()
     
+    @traced('adb.check_adb_available', 'adb')
     def check_adb_available(self):
         """Check if ADB is available in the system"""
         try:
-            result = subprocess.run(['adb', 'version'], 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=5)
+            result = _run_adb([self.adb_path, 'version'], 5)
             return result.returncode == 0
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return False
     
+    @traced('adb.get_connected_devices', 'adb')
     def get_connected_devices(self):
         """Get list of connected Android devices"""
+        return list(self.iter_connected_devices())
+    
+    def iter_connected_devices(self):
+        """Yield connected Android devices one by one as their properties are read"""
         try:
-            result = subprocess.run(['adb', 'devices', '-l'], 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=10)
-            
-            if result.returncode != 0:
-                return []
-            
-            devices = []
-            lines = result.stdout.strip().split('\n')[1:]  # Skip first line "List of devices attached"
-            
-            for line in lines:
-                if line.strip():
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[1] == 'device':
-                        serial = parts[0]
-                        
+            result = _run_adb([self.adb_path, 'devices', '-l'], 10)
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            return
+        
+        if result.returncode != 0:
+            return
+        
+        present = set()
+        lines = result.stdout.strip().split('\n')[1:]  # Skip first line "List of devices attached"
+        
+        for line in lines:
+            if line.strip():
+                parts = line.split()
+                if len(parts) >= 2 and parts[1] == 'device':
+                    serial = parts[0]
+                    present.add(serial)
+                    
+                    with self.devices_lock:
+                        info = self.devices.get(serial)
+                    if info is None:
                         # Get device model and Android version
-                        model = self.get_device_property(serial, 'ro.product.model')
-                        android_version = self.get_device_property(serial, 'ro.build.version.release')
-                        
-                        devices.append({
+                        info = {
                             'serial': serial,
-                            'model': model,
-                            'android_version': android_version
-                        })
+                            'model': self.get_device_property(serial, 'ro.product.model'),
+                            'android_version': self.get_device_property(serial, 'ro.build.version.release')
+                        }
+                        with self.devices_lock:
+                            self.devices[serial] = info
+                    
+                    yield dict(info)
+        
+        # Forget unplugged devices so a reconnect re-reads their properties
+        with self.devices_lock:
+            for serial in [s for s in list(self.devices) if s not in present]:
+                self.devices.pop(serial, None)
+    
+    @traced('adb.get_device_info', 'adb')
+    def get_device_info(self, serial):
+        """Get model and Android version of a single connected device, or None"""
+        try:
+            result = _run_adb([self.adb_path, '-s', serial, 'get-state'], 5)
+            
+            if result.returncode != 0 or result.stdout.strip() != 'device':
+                return None
             
-            return devices
+            return {
+                'serial': serial,
+                'model': self.get_device_property(serial, 'ro.product.model'),
+                'android_version': self.get_device_property(serial, 'ro.build.version.release')
+            }
         except (subprocess.TimeoutExpired, FileNotFoundError):
-            return []
+            return None
     
     def get_device_property(self, serial, prop_name):
         """Get a property from a device"""
         try:
-            result = subprocess.run(['adb', '-s', serial, 'shell', 'getprop', prop_name],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'shell', 'getprop', prop_name], 5)
             if result.returncode == 0:
                 return result.stdout.strip()
             return ''
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return ''
     
+    @traced('adb.create_port_forward', 'adb')
     def create_port_forward(self, serial, local_port, remote_port):
         """Create ADB port forwarding"""
         try:
             # First, remove any existing forwarding on this local port
-            subprocess.run(['adb', '-s', serial, 'forward', '--remove', f'tcp:{local_port}'],
-                         capture_output=True,
-                         timeout=5)
+            _run_adb([self.adb_path, '-s', serial, 'forward', '--remove', f'tcp:{local_port}'], 5)
             
             # Create new port forwarding
-            result = subprocess.run(['adb', '-s', serial, 'forward', 
-                                   f'tcp:{local_port}', f'tcp:{remote_port}'],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'forward', 
+                             f'tcp:{local_port}', f'tcp:{remote_port}'], 5)
             
             return result.returncode == 0
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return False
     
+    @traced('adb.create_dynamic_forward', 'adb')
+    def create_dynamic_forward(self, serial, remote_port):
+        """Forward a free local port (chosen by adb) to remote_port; returns the port or None"""
+        try:
+            result = _run_adb([self.adb_path, '-s', serial, 'forward', 'tcp:0', f'tcp:{remote_port}'], 5)
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            return None
+        if result.returncode != 0:
+            return None
+        try:
+            # adb prints the port it allocated
+            return int(result.stdout.strip().split('\n')[-1])
+        except ValueError:
+            return None
+
+    @traced('adb.remove_port_forward', 'adb')
     def remove_port_forward(self, serial, local_port):
         """Remove ADB port forwarding"""
         try:
-            result = subprocess.run(['adb', '-s', serial, 'forward', '--remove', f'tcp:{local_port}'],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'forward', '--remove', f'tcp:{local_port}'], 5)
             return result.returncode == 0
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return False
     
+    @traced('adb.list_port_forwards', 'adb')
     def list_port_forwards(self, serial):
         """List all port forwards for a device"""
         try:
-            result = subprocess.run(['adb', '-s', serial, 'forward', '--list'],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'forward', '--list'], 5)
             
             if result.returncode == 0:
                 forwards = []
@@ -120,64 +275,89 @@ class ADBManager:
             return []
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return []
-    
+
+    @traced('adb.list_all_forwards', 'adb')
+    def list_all_forwards(self):
+        """List the TCP forwards of every device in one call
+
+        Returns a list of (serial, local_port, remote_port), or None when adb
+        could not be queried (as opposed to an empty list: no forwards).
+        """
+        try:
+            result = _run_adb([self.adb_path, 'forward', '--list'], 5)
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            return None
+        if result.returncode != 0:
+            return None
+
+        forwards = []
+        for line in result.stdout.splitlines():
+            # "<serial> tcp:<local> tcp:<remote>"
+            parts = line.split()
+            if len(parts) < 3 or not parts[1].startswith('tcp:') or not parts[2].startswith('tcp:'):
+                continue
+            try:
+                forwards.append((parts[0], int(parts[1][4:]), int(parts[2][4:])))
+            except ValueError:
+                continue
+        return forwards
+
+    @traced('adb.enable_airplane_mode', 'adb')
     def enable_airplane_mode(self, serial):
         """Enable airplane mode on device"""
         try:
             # Enable airplane mode
-            subprocess.run(['adb', '-s', serial, 'shell', 'settings', 'put', 'global', 
-                          'airplane_mode_on', '1'],
-                         capture_output=True,
-                         timeout=5)
+            _run_adb([self.adb_path, '-s', serial, 'shell', 'settings', 'put', 'global', 
+                    'airplane_mode_on', '1'], 5)
             
             # Broadcast the change
-            subprocess.run(['adb', '-s', serial, 'shell', 'am', 'broadcast', 
-                          '-a', 'android.intent.action.AIRPLANE_MODE', 
-                          '--ez', 'state', 'true'],
-                         capture_output=True,
-                         timeout=5)
+            _run_adb([self.adb_path, '-s', serial, 'shell', 'am', 'broadcast', 
+                    '-a', 'android.intent.action.AIRPLANE_MODE', 
+                    '--ez', 'state', 'true'], 5)
             
             return True
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return False
     
+    @traced('adb.disable_airplane_mode', 'adb')
     def disable_airplane_mode(self, serial):
         """Disable airplane mode on device"""
         try:
             # Disable airplane mode
-            subprocess.run(['adb', '-s', serial, 'shell', 'settings', 'put', 'global', 
-                          'airplane_mode_on', '0'],
-                         capture_output=True,
-                         timeout=5)
+            _run_adb([self.adb_path, '-s', serial, 'shell', 'settings', 'put', 'global', 
+                    'airplane_mode_on', '0'], 5)
             
             # Broadcast the change
-            subprocess.run(['adb', '-s', serial, 'shell', 'am', 'broadcast', 
-                          '-a', 'android.intent.action.AIRPLANE_MODE', 
-                          '--ez', 'state', 'false'],
-                         capture_output=True,
-                         timeout=5)
+            _run_adb([self.adb_path, '-s', serial, 'shell', 'am', 'broadcast', 
+                    '-a', 'android.intent.action.AIRPLANE_MODE', 
+                    '--ez', 'state', 'false'], 5)
             
             return True
         except (subprocess.TimeoutExpired, FileNotFoundError):
             return False
     
+    @traced('adb.toggle_airplane_mode', 'adb')
     def toggle_airplane_mode(self, serial, wait_time=5):
         """Toggle airplane mode to change IP"""
-        if self.enable_airplane_mode(serial):
-            time.sleep(wait_time)
-            if self.disable_airplane_mode(serial):
-                time.sleep(wait_time)  # Wait for connection to restore
+        with ROTATION_PHASE_SECONDS.labels(phase='airplane_on').time():
+            enabled = self.enable_airplane_mode(serial)
+        if enabled:
+            with ROTATION_PHASE_SECONDS.labels(phase='airplane_wait').time(), span('sleep', 'adb'):
+                time.sleep(wait_time)
+            with ROTATION_PHASE_SECONDS.labels(phase='airplane_off').time():
+                disabled = self.disable_airplane_mode(serial)
+            if disabled:
+                with ROTATION_PHASE_SECONDS.labels(phase='reconnect_wait').time(), span('sleep', 'adb'):
+                    time.sleep(wait_time)  # Wait for connection to restore
                 return True
         return False
     
+    @traced('adb.get_device_ip', 'adb')
     def get_device_ip(self, serial):
         """Get device's IP address"""
         try:
             # Try to get IP from wlan0
-            result = subprocess.run(['adb', '-s', serial, 'shell', 'ip', 'addr', 'show', 'wlan0'],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'shell', 'ip', 'addr', 'show', 'wlan0'], 5)
             
             if result.returncode == 0:
                 # Parse IP address from output
@@ -186,10 +366,7 @@ class ADBManager:
                     return match.group(1)
             
             # Fallback: try getprop
-            result = subprocess.run(['adb', '-s', serial, 'shell', 'getprop', 'dhcp.wlan0.ipaddress'],
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=5)
+            result = _run_adb([self.adb_path, '-s', serial, 'shell', 'getprop', 'dhcp.wlan0.ipaddress'], 5)
             
             if result.returncode == 0 and result.stdout.strip():
                 return result.stdout.strip()
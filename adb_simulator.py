@@ -0,0 +1,514 @@
+"""
+Simulated adb server and virtual devices, for load testing and regression
+tests without phones
+
+AdbSimulator speaks enough of the adb server's smart-socket protocol for
+what ADBManager does: listing devices, getprop, airplane mode, wlan0
+address, and port forwards that really carry TCP traffic to a per-device
+echo server. fake_adb.py is the matching `adb` executable, so ADBManager
+runs unchanged in subprocess mode:
+
+    python adb_simulator.py --devices 500 --write-adb /tmp/simadb
+    PATH=/tmp/simadb:$PATH python cli.py list-devices
+
+Latency, random failures and hangs can be injected to see how the manager
+copes with slow or flaky phones.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import shlex
+import stat
+import sys
+import threading
+from collections import Counter
+
+
+DEFAULT_PORT = 15037
+ADB_VERSION = 41
+
+MODELS = ('Pixel 6', 'Pixel 7', 'Pixel 8', 'Galaxy S21', 'Galaxy A52', 'Moto G Power')
+RELEASES = ('11', '12', '13', '14')
+
+# host-serial:<serial>:<request>; serials may contain ':' (e.g. 10.0.0.5:5555)
+_HOST_SERIAL = re.compile(r'host-serial:(.+?):(forward:.*|killforward:.*|killforward-all|list-forward|get-state)$')
+
+
+class SimulatedDevice:
+    """One virtual phone"""
+
+    def __init__(self, index, serial, props, ip):
+        self.index = index
+        self.serial = serial
+        self.props = props
+        self.ip = ip
+        # 'device', 'offline' or 'unauthorized', as in `adb devices`
+        self.state = 'device'
+        self.airplane = False
+        self.rotations = 0
+        self.upstream = None
+        self.upstream_port = None
+
+
+class _Forward:
+    __slots__ = ('serial', 'local', 'remote', 'server')
+
+    def __init__(self, serial, local, remote, server):
+        self.serial = serial
+        self.local = local
+        self.remote = remote
+        self.server = server
+
+
+class AdbSimulator:
+    """adb server for `devices` simulated phones, on an asyncio loop
+
+    command_latency: seconds added to every device request (USB round trip)
+    airplane_latency: seconds each airplane-mode switch takes
+    failure_rate: probability a device request fails with "device offline"
+    hang_rate: probability a device request stalls for hang_time seconds
+    props: getprop overrides for every device; a value may be a function
+    of the device index
+
+    start() runs the loop in a background thread; serve_forever() runs it
+    in the caller's.
+    """
+
+    def __init__(self, devices=10, host='127.0.0.1', port=0, serial_prefix='sim', props=None,
+                 command_latency=0.0, airplane_latency=0.5, failure_rate=0.0, hang_rate=0.0,
+                 hang_time=30.0, seed=None):
+        self.host = host
+        self.port = port
+        self.command_latency = command_latency
+        self.airplane_latency = airplane_latency
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.random = random.Random(seed)
+        self.devices = {}
+        for index in range(devices):
+            serial = f'{serial_prefix}{index:05d}'
+            self.devices[serial] = SimulatedDevice(index, serial, self._props(index, serial, props),
+                                                   self._new_ip())
+        self.forwards = {}
+        # Requests served, by kind (e.g. 'getprop', 'forward'), for benchmarks
+        self.requests = Counter()
+        self.loop = None
+        self.server = None
+        self._thread = None
+        self._stop = None
+
+    @staticmethod
+    def _props(index, serial, overrides):
+        props = {
+            'ro.product.model': MODELS[index % len(MODELS)],
+            'ro.product.manufacturer': 'Simulated',
+            'ro.build.version.release': RELEASES[index % len(RELEASES)],
+            'ro.serialno': serial,
+        }
+        for name, value in (overrides or {}).items():
+            props[name] = value(index) if callable(value) else str(value)
+        return props
+
+    def _new_ip(self):
+        return f'10.{self.random.randrange(256)}.{self.random.randrange(256)}.{self.random.randrange(1, 255)}'
+
+    # Lifecycle
+    async def start_server(self):
+        """Listen on the running loop; returns the port"""
+        self.loop = asyncio.get_running_loop()
+        _raise_file_limit()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close_server(self):
+        """Close the server, every forward and every upstream"""
+        servers = [self.server] + [f.server for f in self.forwards.values()]
+        servers += [d.upstream for d in self.devices.values() if d.upstream]
+        self.forwards.clear()
+        for server in servers:
+            if server is not None:
+                server.close()
+
+    def start(self):
+        """Serve from a background thread; returns the port"""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='adb-simulator', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.port
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._stop = loop.create_future()
+        loop.run_until_complete(self.start_server())
+        ready.set()
+        try:
+            loop.run_until_complete(self._stop)
+            loop.run_until_complete(self.close_server())
+            tasks = [t for t in asyncio.all_tasks(loop)]
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            loop.close()
+
+    def stop(self):
+        """Stop a simulator started with start()"""
+        if self.loop is not None and self._stop is not None:
+            self.loop.call_soon_threadsafe(lambda: self._stop.done() or self._stop.set_result(None))
+            self._thread.join()
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted"""
+        async def main():
+            self._stop = asyncio.get_running_loop().create_future()
+            await self.start_server()
+            try:
+                await self._stop
+            finally:
+                await self.close_server()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+
+    def make_adb_executable(self, directory):
+        """Write an `adb` wrapper in directory that talks to this simulator; returns its path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'adb')
+        fake_adb = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb.py')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    f'exec {shlex.quote(sys.executable)} {shlex.quote(fake_adb)} '
+                    f'-H {shlex.quote(self.host)} -P {self.port} "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        return path
+
+    # Protocol
+    async def _handle(self, reader, writer):
+        """One client connection: a host request, or host:transport then a device request"""
+        device = None
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(4)
+                    request = (await reader.readexactly(int(header, 16))).decode()
+                except (asyncio.IncompleteReadError, ValueError):
+                    return
+
+                if request.startswith('host:transport:') or request == 'host:transport-any':
+                    device = self._find_device(request[len('host:transport:'):] or None)
+                    if isinstance(device, str):
+                        writer.write(_fail(device))
+                        return
+                    writer.write(b'OKAY')
+                    continue
+
+                if request.startswith('shell:'):
+                    if device is None:
+                        writer.write(_fail('no device selected'))
+                        return
+                    command = request[len('shell:'):]
+                    error = await self._device_request(device, command.split(' ', 1)[0] or 'shell')
+                    if error:
+                        writer.write(_fail(error))
+                        return
+                    output = await self._shell(device, command)
+                    writer.write(b'OKAY' + output.encode())
+                    return
+
+                writer.write(await self._host_request(request))
+                return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except (ConnectionError, OSError):
+                pass
+            writer.close()
+
+    def _find_device(self, serial):
+        """The device with this serial (or the only one, for None); an error string if none"""
+        if serial is None:
+            if len(self.devices) != 1:
+                return 'more than one device/emulator' if self.devices else 'no devices/emulators found'
+            return next(iter(self.devices.values()))
+        device = self.devices.get(serial)
+        if device is None:
+            return f"device '{serial}' not found"
+        if device.state != 'device':
+            return f"device {device.state}"
+        return device
+
+    async def _device_request(self, device, kind):
+        """Count the request and apply latency, failures and hangs; returns an error or None"""
+        self.requests[kind] += 1
+        if self.command_latency:
+            await asyncio.sleep(self.command_latency)
+        roll = self.random.random()
+        if roll < self.hang_rate:
+            await asyncio.sleep(self.hang_time)
+        elif roll < self.hang_rate + self.failure_rate:
+            return 'device offline'
+        return None
+
+    async def _host_request(self, request):
+        if request == 'host:version':
+            self.requests['version'] += 1
+            return b'OKAY' + _prefixed(f'{ADB_VERSION:04x}')
+        if request in ('host:features', 'host:host-features'):
+            return b'OKAY' + _prefixed('')
+        if request in ('host:devices', 'host:devices-l'):
+            self.requests['devices'] += 1
+            return b'OKAY' + _prefixed(self._device_list(request.endswith('-l')))
+        if request == 'host:list-forward':
+            self.requests['forward_list'] += 1
+            return b'OKAY' + _prefixed(self._forward_list())
+        if request == 'host:kill':
+            self.loop.call_soon(lambda: self._stop.done() or self._stop.set_result(None))
+            return b'OKAY'
+
+        match = _HOST_SERIAL.match(request)
+        if match:
+            serial, command = match.groups()
+        elif request.startswith('host:'):
+            serial, command = None, request[len('host:'):]
+        else:
+            return _fail(f'unknown host service: {request}')
+
+        device = self._find_device(serial)
+        if isinstance(device, str):
+            return _fail(device)
+        if command == 'get-state':
+            error = await self._device_request(device, 'get-state')
+            return _fail(error) if error else b'OKAY' + _prefixed(device.state)
+        if command == 'list-forward':
+            self.requests['forward_list'] += 1
+            return b'OKAY' + _prefixed(self._forward_list(device.serial))
+        if command.startswith('forward:'):
+            error = await self._device_request(device, 'forward')
+            return _fail(error) if error else await self._forward(device, command[len('forward:'):])
+        if command.startswith('killforward'):
+            error = await self._device_request(device, 'forward_remove')
+            return _fail(error) if error else self._kill_forward(device, command)
+        return _fail(f'unknown host service: {request}')
+
+    def _device_list(self, long):
+        lines = []
+        for device in self.devices.values():
+            line = f'{device.serial:<22} {device.state}'
+            if long:
+                model = device.props['ro.product.model'].replace(' ', '_')
+                line += f' product:sim model:{model} device:sim transport_id:{device.index + 1}'
+            lines.append(line + '\n')
+        return ''.join(lines)
+
+    def _forward_list(self, serial=None):
+        return ''.join(f'{f.serial} tcp:{f.local} {f.remote}\n' for f in self.forwards.values()
+                       if serial is None or f.serial == serial)
+
+    # Forwards
+    async def _forward(self, device, spec):
+        """forward:[norebind:]tcp:LOCAL;tcp:REMOTE"""
+        norebind = spec.startswith('norebind:')
+        if norebind:
+            spec = spec[len('norebind:'):]
+        local, _, remote = spec.partition(';')
+        if not local.startswith('tcp:') or not remote.startswith('tcp:'):
+            return _fail(f'cannot parse forward spec: {spec}')
+        try:
+            local_port = int(local[4:])
+        except ValueError:
+            return _fail(f'bad local port: {local}')
+
+        existing = self.forwards.get(local_port) if local_port else None
+        if existing is not None:
+            if norebind:
+                return _fail(f'cannot rebind existing socket')
+            existing.server.close()
+            del self.forwards[local_port]
+
+        try:
+            server = await asyncio.start_server(lambda r, w: self._forward_client(device, r, w),
+                                                self.host, local_port, backlog=128)
+        except OSError as e:
+            return _fail(f'cannot bind listener: {e.strerror}')
+        port = server.sockets[0].getsockname()[1]
+        self.forwards[port] = _Forward(device.serial, port, remote, server)
+        # Like adb: OKAY for the host, OKAY for the forward, then the port if it was chosen
+        return b'OKAY' + b'OKAY' + (_prefixed(str(port)) if local_port == 0 else b'')
+
+    def _kill_forward(self, device, command):
+        if command == 'killforward-all':
+            ports = [p for p, f in self.forwards.items() if f.serial == device.serial]
+        else:
+            spec = command[len('killforward:'):]
+            try:
+                port = int(spec[4:]) if spec.startswith('tcp:') else None
+            except ValueError:
+                port = None
+            forward = self.forwards.get(port)
+            if forward is None or forward.serial != device.serial:
+                return _fail(f"listener '{spec}' not found")
+            ports = [port]
+        for port in ports:
+            self.forwards.pop(port).server.close()
+        return b'OKAY' + b'OKAY'
+
+    async def _forward_client(self, device, reader, writer):
+        """Carry one forwarded connection to the device's upstream (none in airplane mode)"""
+        if device.airplane or device.state != 'device':
+            writer.close()
+            return
+        if device.upstream is None:
+            device.upstream = await asyncio.start_server(_echo, self.host, 0, backlog=128)
+            device.upstream_port = device.upstream.sockets[0].getsockname()[1]
+        try:
+            up_reader, up_writer = await asyncio.open_connection(self.host, device.upstream_port)
+        except OSError:
+            writer.close()
+            return
+        await asyncio.gather(_pipe(reader, up_writer), _pipe(up_reader, writer))
+
+    # Shell
+    async def _shell(self, device, command):
+        """Output of a shell command on a device"""
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = command.split()
+        name = argv[0] if argv else ''
+        if name == 'getprop':
+            if len(argv) == 1:
+                return ''.join(f'[{k}]: [{v}]\n' for k, v in sorted(self._getprops(device).items()))
+            return self._getprops(device).get(argv[1], '') + '\n'
+        if name == 'settings' and argv[1:4] == ['put', 'global', 'airplane_mode_on'] and len(argv) > 4:
+            await self._set_airplane(device, argv[4] == '1')
+            return ''
+        if name == 'settings' and argv[1:4] == ['get', 'global', 'airplane_mode_on']:
+            return f"{int(device.airplane)}\n"
+        if name == 'am' and argv[1:2] == ['broadcast']:
+            action = argv[argv.index('-a') + 1] if '-a' in argv[:-1] else ''
+            return (f'Broadcasting: Intent {{ act={action} flg=0x400000 (has extras) }}\n'
+                    'Broadcast completed: result=0\n')
+        if name == 'ip' and argv[1:3] == ['addr', 'show']:
+            return self._ip_addr(device, argv[3] if len(argv) > 3 else 'wlan0')
+        if name == 'echo':
+            return ' '.join(argv[1:]) + '\n'
+        return f'/system/bin/sh: {name}: not found\n'
+
+    def _getprops(self, device):
+        props = dict(device.props)
+        props['dhcp.wlan0.ipaddress'] = '' if device.airplane else device.ip
+        return props
+
+    async def _set_airplane(self, device, enabled):
+        if enabled == device.airplane:
+            return
+        if self.airplane_latency:
+            await asyncio.sleep(self.airplane_latency)
+        device.airplane = enabled
+        if not enabled:
+            # Reconnecting to the network hands out a new address
+            device.ip = self._new_ip()
+            device.rotations += 1
+
+    def _ip_addr(self, device, interface):
+        if interface != 'wlan0':
+            return f'Device "{interface}" does not exist.\n'
+        mac = ':'.join(f'{(device.index >> shift) & 0xff:02x}' for shift in (16, 8, 0))
+        if device.airplane:
+            return ('3: wlan0: <BROADCAST,MULTICAST> mtu 1500 qdisc mq state DOWN group default qlen 3000\n'
+                    f'    link/ether 02:00:00:{mac} brd ff:ff:ff:ff:ff:ff\n')
+        return ('3: wlan0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP group default qlen 3000\n'
+                f'    link/ether 02:00:00:{mac} brd ff:ff:ff:ff:ff:ff\n'
+                f'    inet {device.ip}/24 brd {device.ip.rsplit(".", 1)[0]}.255 scope global wlan0\n'
+                '       valid_lft forever preferred_lft forever\n')
+
+
+def _prefixed(text):
+    data = text.encode()
+    return f'{len(data):04x}'.encode() + data
+
+
+def _fail(message):
+    return b'FAIL' + _prefixed(message)
+
+
+async def _echo(reader, writer):
+    await _pipe(reader, writer)
+
+
+async def _pipe(reader, writer):
+    """Copy reader to writer until EOF, then half-close"""
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        writer.close()
+
+
+def _raise_file_limit():
+    """Allow as many sockets as the hard limit permits (500 devices need ~1000)"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated adb server with virtual devices')
+    parser.add_argument('--devices', type=int, default=10, help='Number of simulated devices')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='adb server port')
+    parser.add_argument('--serial-prefix', default='sim', help='Serials are <prefix>00000, <prefix>00001...')
+    parser.add_argument('--command-latency', type=float, default=0.0, help='Seconds added to each device request')
+    parser.add_argument('--airplane-latency', type=float, default=0.5,
+                        help='Seconds each airplane-mode switch takes')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Probability a device request fails')
+    parser.add_argument('--hang-rate', type=float, default=0.0,
+                        help='Probability a device request hangs for --hang-time')
+    parser.add_argument('--hang-time', type=float, default=30.0, help='Seconds a hung request stalls')
+    parser.add_argument('--prop', action='append', default=[], metavar='NAME=VALUE',
+                        help='getprop value for every device (repeatable)')
+    parser.add_argument('--seed', type=int, help='Random seed for IPs, failures and hangs')
+    parser.add_argument('--write-adb', metavar='DIR', help='Write an adb executable for this simulator into DIR')
+    args = parser.parse_args(argv)
+
+    props = dict(prop.split('=', 1) for prop in args.prop if '=' in prop)
+    simulator = AdbSimulator(args.devices, args.host, args.port, args.serial_prefix, props,
+                             args.command_latency, args.airplane_latency, args.failure_rate,
+                             args.hang_rate, args.hang_time, args.seed)
+    if args.write_adb:
+        # The wrapper needs the port, which is fixed here unless --port 0
+        if not args.port:
+            parser.error("--write-adb needs a fixed --port")
+        print(f"adb executable: {simulator.make_adb_executable(args.write_adb)}")
+    print(f"Simulating {args.devices} devices on {args.host}:{args.port} "
+          f"(ANDROID_ADB_SERVER_PORT={args.port}); Ctrl+C to stop")
+    simulator.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
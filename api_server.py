@@ -0,0 +1,664 @@
+"""
+Local REST/JSON control API served with asyncio (standard library only)
+"""
+import asyncio
+import hmac
+import json
+import math
+import os
+import re
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from database import connection_record, parse_selector
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1024 * 1024
+
+# Fleet events queued per /api/events client; one that falls further behind is
+# disconnected and reloads everything when it reconnects
+FLEET_EVENT_BACKLOG = 1000
+
+# Single-page dashboard served at /; it holds no data, so it needs no token
+DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.html')
+PUBLIC_PATHS = ('/',)
+
+STATUS_TEXT = {
+    200: 'OK', 201: 'Created', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request',
+    401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    """Error answered with the given HTTP status and a JSON {"error": message} body"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_number(value, name, cast=int):
+    """Convert a query parameter or header to a number, or answer 400"""
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{name} must be a number, not {value!r}")
+
+
+class Request:
+    """A parsed HTTP request"""
+
+    def __init__(self, method, path, query, headers, body, writer=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.writer = writer
+        self.params = {}
+
+    def arg(self, name, default=None):
+        """First value of a query string parameter"""
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def selector(self):
+        """The ?select= tag selector, or None; 400 when it is malformed"""
+        text = self.arg('select')
+        if not text:
+            return None
+        try:
+            return parse_selector(text)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    def number(self, name, default=0, cast=int):
+        """A query string parameter as a number; 400 when it is not one"""
+        return parse_number(self.arg(name, default), name, cast)
+
+    def json(self):
+        """Request body parsed as a JSON object"""
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, 'Body is not valid JSON')
+        if not isinstance(data, dict):
+            raise HttpError(400, 'Body must be a JSON object')
+        return data
+
+
+class Response:
+    """A non-JSON response body (e.g. the dashboard page)"""
+
+    def __init__(self, body, content_type, status=200, headers=None):
+        self.body = body
+        self.content_type = content_type
+        self.status = status
+        self.headers = headers or {}
+
+
+class EventStream:
+    """Server-sent events written to one client"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def send(self, event, data, event_id=None):
+        """Send one event; data is serialized as JSON"""
+        message = ''
+        if event_id is not None:
+            message += f'id: {event_id}\n'
+        message += f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+        self.writer.write(message.encode())
+        await self.writer.drain()
+
+
+def device_record(row, tags=None):
+    """Fields of a device row for API output"""
+    device_id, serial, model, android_version, status, last_seen = row
+    return {
+        'id': device_id,
+        'serial': serial,
+        'model': model,
+        'android_version': android_version,
+        'status': status,
+        'last_seen': last_seen,
+        'tags': tags or {},
+    }
+
+
+class ApiServer:
+    """HTTP API over the daemon's FleetState, ADBManager, ProxyManager and JobManager
+
+    Every client connection is a coroutine on one event loop, so many
+    concurrent callers cost no threads. Reads come from the in-memory fleet
+    state; calls that block (adb subprocesses, SQLite writes) run on a
+    small shared thread pool, and long actions become jobs whose progress
+    is streamed as server-sent events.
+
+    Endpoints (JSON unless noted):
+        GET    /                                 web dashboard (HTML)
+        GET    /api/status
+        POST   /api/refresh                      reload fleet state from the database
+        GET    /api/devices                      ?select=rack=3
+        POST   /api/devices/refresh              discover connected devices
+        GET    /api/devices/<serial>/ip          check the device IP
+        POST   /api/devices/<serial>/rotate      change the IP (a job; ?stream=1 for SSE)
+        PUT    /api/devices/<serial>/tags        {"rack": "3"} sets tags
+        GET    /api/connections                  ?select=..., ?status=active
+        POST   /api/connections                  {"serial", "local_port", "remote_port"}
+        GET    /api/connections/<id>
+        DELETE /api/connections/<id>
+        POST   /api/connections/<id>/start
+        POST   /api/connections/<id>/stop
+        POST   /api/connections/<id>/check-ip    check and store the device IP
+        GET    /api/jobs
+        POST   /api/jobs                         {"action", "params"} (?stream=1 for SSE)
+        GET    /api/jobs/<id>
+        GET    /api/jobs/<id>/results            ?after=N
+        GET    /api/jobs/<id>/events             SSE: results, then the final job
+        GET    /api/monitor                      ?since=version
+        GET    /api/monitor/events               SSE: monitor deltas (?since=, ?interval=)
+        GET    /api/events                       SSE: fleet changes ('overflow' if too slow)
+        GET    /metrics                          Prometheus text format
+
+    With a token, requests need "Authorization: Bearer TOKEN"; EventSource
+    cannot send headers, so ?access_token=TOKEN is accepted as well.
+    """
+
+    def __init__(self, daemon, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None, workers=16):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.daemon = daemon
+        self.fleet = daemon.fleet
+        self.host = host
+        self.port = port
+        self.token = token
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+        self.loop = None
+        self.server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._dashboard = None
+
+        route = lambda method, pattern, handler: (method, re.compile(f'^{pattern}$'), handler)
+        self.routes = [
+            route('GET', '/', self.get_dashboard),
+            route('GET', '/api/status', self.get_status),
+            route('POST', '/api/refresh', self.refresh),
+            route('GET', '/api/devices', self.get_devices),
+            route('POST', '/api/devices/refresh', self.refresh_devices),
+            route('GET', r'/api/devices/(?P<serial>[^/]+)/ip', self.check_device_ip),
+            route('POST', r'/api/devices/(?P<serial>[^/]+)/rotate', self.rotate_device),
+            route('PUT', r'/api/devices/(?P<serial>[^/]+)/tags', self.set_device_tags),
+            route('GET', '/api/connections', self.get_connections),
+            route('POST', '/api/connections', self.add_connection),
+            route('GET', r'/api/connections/(?P<id>\d+)', self.get_connection),
+            route('DELETE', r'/api/connections/(?P<id>\d+)', self.delete_connection),
+            route('POST', r'/api/connections/(?P<id>\d+)/start', self.start_connection),
+            route('POST', r'/api/connections/(?P<id>\d+)/stop', self.stop_connection),
+            route('POST', r'/api/connections/(?P<id>\d+)/check-ip', self.check_connection_ip),
+            route('GET', '/api/jobs', self.list_jobs),
+            route('POST', '/api/jobs', self.submit_job),
+            route('GET', r'/api/jobs/(?P<id>\w+)', self.get_job),
+            route('GET', r'/api/jobs/(?P<id>\w+)/results', self.get_job_results),
+            route('GET', r'/api/jobs/(?P<id>\w+)/events', self.job_events),
+            route('GET', '/api/monitor', self.get_monitor),
+            route('GET', '/api/monitor/events', self.monitor_events),
+            route('GET', '/api/events', self.fleet_events),
+            route('GET', '/metrics', self.get_metrics),
+        ]
+
+    # Lifecycle
+    async def start(self):
+        """Start listening on the running event loop"""
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        # Report the real port when 0 asked for any free one
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    def start_in_thread(self):
+        """Run the event loop in a daemon thread; returns once listening"""
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            finally:
+                self._ready.set()
+            try:
+                loop.run_forever()
+            finally:
+                loop.close()
+
+        self._thread = threading.Thread(target=run, name='api-server', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self.server is None:
+            raise RuntimeError(f"Could not listen on {self.host}:{self.port}")
+
+    async def close(self):
+        """Stop listening and end open requests and event streams"""
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        """Stop listening and end the event loop thread"""
+        if self.loop and self.server and self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self.close(), self.loop).result(timeout=5)
+            except Exception as e:
+                print(f"Error stopping API server: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.executor.shutdown(wait=False)
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call on the shared pool"""
+        return await self.loop.run_in_executor(self.executor, lambda: func(*args))
+
+    # HTTP plumbing
+    async def handle_client(self, reader, writer):
+        """Serve requests on one connection until it is closed"""
+        try:
+            while True:
+                request = await self.read_request(reader, writer)
+                if request is None:
+                    break
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                streamed = await self.dispatch(request, writer, keep_alive)
+                if streamed or not keep_alive:
+                    break
+        except HttpError as e:
+            await self.send_json(writer, e.status, {'error': str(e)}, keep_alive=False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown; ending normally keeps asyncio from logging the task
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader, writer):
+        """Parse one request from the stream, or None at end of stream"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(400, 'Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = parse_number(headers.get('content-length') or 0, 'Content-Length')
+        if length < 0:
+            raise HttpError(400, 'Content-Length must not be negative')
+        if length > MAX_BODY:
+            raise HttpError(413, 'Request body too large')
+        body = await reader.readexactly(length) if length else b''
+
+        url = urlsplit(target)
+        return Request(method.upper(), url.path.rstrip('/') or '/', parse_qs(url.query), headers, body,
+                       writer)
+
+    async def dispatch(self, request, writer, keep_alive=True):
+        """Route a request; returns True when the response was a stream"""
+        try:
+            if self.token and request.path not in PUBLIC_PATHS:
+                supplied = request.headers.get('authorization', '')
+                if not supplied and request.arg('access_token'):
+                    supplied = f"Bearer {request.arg('access_token')}"
+                # Compare bytes: compare_digest rejects non-ASCII str with a TypeError
+                if not hmac.compare_digest(supplied.encode(), f'Bearer {self.token}'.encode()):
+                    raise HttpError(401, 'Missing or invalid API token')
+
+            handler = None
+            allowed = False
+            for method, pattern, route_handler in self.routes:
+                match = pattern.match(request.path)
+                if match:
+                    allowed = True
+                    if method == request.method:
+                        handler = route_handler
+                        request.params = match.groupdict()
+                        break
+            if handler is None:
+                raise HttpError(405 if allowed else 404,
+                                'Method not allowed' if allowed else 'Not found')
+
+            result = await handler(request)
+            if isinstance(result, EventStream):
+                return True
+            if isinstance(result, Response):
+                await self.send_response(writer, result.status, result.body, result.content_type,
+                                         keep_alive, result.headers)
+                return False
+            status, body = result if isinstance(result, tuple) else (200, result)
+            await self.send_json(writer, status, body, keep_alive)
+        except HttpError as e:
+            await self.send_json(writer, e.status, {'error': str(e)}, keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            await self.send_json(writer, 500, {'error': str(e)}, keep_alive)
+        return False
+
+    async def send_json(self, writer, status, body, keep_alive=True):
+        """Write a complete JSON response"""
+        payload = json.dumps(body, default=str).encode() if status != 204 else b''
+        await self.send_response(writer, status, payload, 'application/json', keep_alive)
+
+    async def send_response(self, writer, status, payload, content_type, keep_alive=True, headers=None):
+        """Write a complete response with a bytes body"""
+        head = (f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(payload)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n')
+        for name, value in (headers or {}).items():
+            head += f'{name}: {value}\r\n'
+        writer.write(head.encode() + b'\r\n' + payload)
+        await writer.drain()
+
+    async def open_stream(self, writer):
+        """Send the headers of a server-sent event stream"""
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        await writer.drain()
+        return EventStream(writer)
+
+    def wants_stream(self, request):
+        return request.arg('stream') in ('1', 'true') or \
+            'text/event-stream' in request.headers.get('accept', '')
+
+    # Dashboard
+    async def get_dashboard(self, request):
+        if self._dashboard is None:
+            with open(DASHBOARD_PATH, 'rb') as f:
+                self._dashboard = f.read()
+        return Response(self._dashboard, 'text/html; charset=utf-8',
+                        headers={'Cache-Control': 'no-cache'})
+
+    # Status and devices
+    async def get_status(self, request):
+        return await self.run_blocking(self.daemon.status)
+
+    async def refresh(self, request):
+        return await self.run_blocking(self.daemon.refresh)
+
+    async def refresh_devices(self, request):
+        def discover():
+            devices = self.daemon.adb.get_connected_devices()
+            self.fleet.upsert_devices(devices)
+            return len(devices)
+
+        return {'devices': await self.run_blocking(discover)}
+
+    async def get_devices(self, request):
+        selector = request.selector()
+        if selector:
+            rows = await self.run_blocking(self.fleet.get_devices_by_tags, selector)
+        else:
+            rows = self.fleet.get_devices()
+        tags = await self.run_blocking(self.fleet.get_device_tags)
+        return [device_record(row, tags.get(row[0])) for row in rows]
+
+    async def check_device_ip(self, request):
+        serial = request.params['serial']
+        ip = await self.run_blocking(self.daemon.adb.get_device_ip, serial)
+        return {'serial': serial, 'ok': bool(ip), 'ip': ip}
+
+    async def rotate_device(self, request):
+        data = request.json()
+        params = {'serials': [request.params['serial']]}
+        if 'wait_time' in data:
+            params['wait_time'] = data['wait_time']
+        return await self._submit(request, 'change_all_ips', params)
+
+    async def set_device_tags(self, request):
+        serial = request.params['serial']
+        tags = request.json()
+        if not isinstance(tags, dict):
+            raise HttpError(400, "Tags must be a JSON object")
+        for key, value in tags.items():
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+                raise HttpError(400, f"Tag {key!r} must be a string, a number or null")
+        device = self.fleet.get_device_by_serial(serial)
+        if not device:
+            raise HttpError(404, f"Device {serial} not found")
+        remove = [key for key, value in tags.items() if value is None]
+        await self.run_blocking(self.fleet.set_device_tags, device[0],
+                                {k: v for k, v in tags.items() if v is not None})
+        if remove:
+            await self.run_blocking(self.fleet.remove_device_tags, device[0], remove)
+        return {'serial': serial, 'tags': await self.run_blocking(self.fleet.get_device_tags, device[0])}
+
+    # Connections
+    async def get_connections(self, request):
+        selector = request.selector()
+        status = request.arg('status')
+        if selector:
+            rows = await self.run_blocking(self.fleet.get_connections_by_tags, selector)
+        else:
+            rows = self.fleet.get_connections()
+        return [connection_record(row) for row in rows if not status or row[5] == status]
+
+    def _connection(self, request):
+        row = self.fleet.get_connection(int(request.params['id']))
+        if not row:
+            raise HttpError(404, f"Connection {request.params['id']} not found")
+        return row
+
+    async def get_connection(self, request):
+        return connection_record(self._connection(request))
+
+    async def add_connection(self, request):
+        data = request.json()
+        try:
+            serial = str(data['serial'])
+            local_port = int(data['local_port'])
+            remote_port = int(data['remote_port'])
+        except (KeyError, TypeError, ValueError):
+            raise HttpError(400, 'serial, local_port and remote_port are required')
+
+        device = await self.run_blocking(self.daemon.adb.get_device_info, serial)
+        if not device:
+            raise HttpError(404, f"Device {serial} not found")
+        device_id = await self.run_blocking(self.fleet.add_device, device['serial'],
+                                            device['model'], device['android_version'])
+        conn_id = await self.run_blocking(self.fleet.add_connection, device_id, local_port, remote_port)
+        if not conn_id:
+            raise HttpError(409, f"Local port {local_port} is already in use")
+        return 201, connection_record(self.fleet.get_connection(conn_id))
+
+    async def delete_connection(self, request):
+        row = self._connection(request)
+        if row[5] == 'active':
+            await self.run_blocking(self.daemon.proxy.stop_proxy, row[2], row[3])
+        await self.run_blocking(self.fleet.delete_connection, row[0])
+        return 204, None
+
+    async def start_connection(self, request):
+        row = self._connection(request)
+        ok = await self.run_blocking(self.daemon.proxy.start_proxy, row[2], row[3], row[4])
+        if ok:
+            await self.run_blocking(self.fleet.update_connection_status, row[0], 'active')
+        return {'ok': ok, 'connection': connection_record(self.fleet.get_connection(row[0]))}
+
+    async def stop_connection(self, request):
+        row = self._connection(request)
+        ok = await self.run_blocking(self.daemon.proxy.stop_proxy, row[2], row[3])
+        if ok:
+            await self.run_blocking(self.fleet.update_connection_status, row[0], 'stopped')
+        return {'ok': ok, 'connection': connection_record(self.fleet.get_connection(row[0]))}
+
+    async def check_connection_ip(self, request):
+        row = self._connection(request)
+        ip = await self.run_blocking(self.daemon.adb.get_device_ip, row[2])
+        if ip:
+            await self.run_blocking(self.fleet.update_connection_status, row[0], row[5], ip)
+        return {'ok': bool(ip), 'ip': ip, 'connection': connection_record(self.fleet.get_connection(row[0]))}
+
+    # Jobs
+    async def list_jobs(self, request):
+        return await self.run_blocking(self.daemon.jobs.list_jobs, request.number('limit', 20))
+
+    async def submit_job(self, request):
+        data = request.json()
+        if 'action' not in data:
+            raise HttpError(400, 'action is required')
+        return await self._submit(request, data['action'], data.get('params'))
+
+    async def _submit(self, request, action, params):
+        try:
+            job_id = await self.run_blocking(self.daemon.jobs.submit, action, params)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        if self.wants_stream(request):
+            return await self._stream_job(request, job_id)
+        return 202, self.daemon.jobs.get_job(job_id)
+
+    async def get_job(self, request):
+        job = await self.run_blocking(self.daemon.jobs.get_job, request.params['id'])
+        if not job:
+            raise HttpError(404, f"Job {request.params['id']} not found")
+        return job
+
+    async def get_job_results(self, request):
+        return await self.run_blocking(self.daemon.jobs.get_results, request.params['id'],
+                                       request.number('after'))
+
+    async def job_events(self, request):
+        return await self._stream_job(request, request.params['id'])
+
+    async def _stream_job(self, request, job_id):
+        """Stream a job as SSE: 'result' events (id = result index), then 'job'"""
+        jobs = self.daemon.jobs
+        after = parse_number(request.headers.get('last-event-id') or request.arg('after', 0), 'after')
+        queue = asyncio.Queue()
+
+        def listener(event_job_id, kind, data):
+            if event_job_id == job_id:
+                self.loop.call_soon_threadsafe(queue.put_nowait, (kind, data))
+
+        # Subscribe before reading stored results so nothing falls in between
+        jobs.add_listener(listener)
+        try:
+            job = await self.run_blocking(jobs.get_job, job_id)
+            if not job:
+                raise HttpError(404, f"Job {job_id} not found")
+            stream = await self.open_stream(request.writer)
+            for result in await self.run_blocking(jobs.get_results, job_id, after):
+                await stream.send('result', result, result['index'])
+                after = result['index']
+
+            while job['state'] not in ('finished', 'failed') or after < job['done']:
+                try:
+                    kind, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    stream.writer.write(b': keep-alive\n\n')
+                    await stream.writer.drain()
+                    continue
+                if kind == 'result' and data['index'] > after:
+                    await stream.send('result', data, data['index'])
+                    after = data['index']
+                elif kind == 'job':
+                    job = data
+            await stream.send('job', job)
+            return stream
+        finally:
+            jobs.remove_listener(listener)
+
+    # Monitoring
+    async def get_monitor(self, request):
+        return self.daemon.monitor.snapshot(request.number('since'))
+
+    async def monitor_events(self, request):
+        """Stream monitor deltas as SSE: a 'snapshot' event (id = version) whenever rows changed"""
+        since = parse_number(request.headers.get('last-event-id') or request.arg('since', 0), 'since')
+        interval = request.number('interval', 2, float)
+        if not math.isfinite(interval):
+            raise HttpError(400, 'interval must be a finite number')
+        interval = min(max(interval, 0.5), 60)
+        monitor = self.daemon.monitor
+        stream = await self.open_stream(request.writer)
+        quiet = 0
+        while True:
+            delta = monitor.snapshot(since)
+            since = delta['version']
+            if delta['rows'] or delta['removed'] or delta['full']:
+                await stream.send('snapshot', delta, since)
+                quiet = 0
+            else:
+                quiet += interval
+                if quiet >= 15:
+                    stream.writer.write(b': keep-alive\n\n')
+                    await stream.writer.drain()
+                    quiet = 0
+            await asyncio.sleep(interval)
+
+    async def get_metrics(self, request):
+        from metrics import CONTENT_TYPE, REGISTRY
+
+        text = await self.run_blocking(REGISTRY.render)
+        return Response(text.encode(), CONTENT_TYPE)
+
+    async def fleet_events(self, request):
+        """Stream FleetEvents as SSE until the client disconnects or falls
+        FLEET_EVENT_BACKLOG events behind ('overflow', then the stream closes)"""
+        queue = asyncio.Queue(FLEET_EVENT_BACKLOG)
+        overflowed = asyncio.Event()
+
+        def enqueue(event):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                overflowed.set()
+
+        def on_event(event):
+            self.loop.call_soon_threadsafe(enqueue, event)
+
+        self.fleet.subscribe(on_event)
+        try:
+            stream = await self.open_stream(request.writer)
+            while True:
+                if overflowed.is_set():
+                    await stream.send('overflow', {'backlog': FLEET_EVENT_BACKLOG})
+                    return stream
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    stream.writer.write(b': keep-alive\n\n')
+                    await stream.writer.drain()
+                    continue
+                is_connection = event.type.startswith('connection_')
+                record = connection_record if is_connection else device_record
+                await stream.send(event.type, {
+                    'key': event.key,
+                    'old': record(event.old) if event.old else None,
+                    'new': record(event.new) if event.new else None,
+                })
+        finally:
+            self.fleet.unsubscribe(on_event)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Benchmark database.Database on large fleets
+
+Fills a fresh database with --devices devices (tagged rack=0..19) and
+--connections connections, then times the public methods the CLI, daemon
+and bulk operations call:
+
+    get-all             get_connections()
+    get-by-device       get_connections(device_id)
+    get-by-status       get_connections_by_status('active')
+    get-by-serial       get_connections_by_serial(serial)
+    get-by-port         get_connection_by_port(port)
+    get-by-tags         get_connections_by_tags({'rack': n})
+    update-status       update_connection_status(id, status, ip)
+    update-batch        update_connection_statuses() with --batch rows
+    add-device          add_device() of new serials, then delete_device()
+    refresh-device      add_device() of existing serials (rediscovery)
+    concurrent          --readers and --writers threads for --duration s
+
+Every operation reports ops/s and p50/p95/p99 latency; `concurrent` also
+counts "database is locked" errors. Devices are added with upsert_devices
+and connections with plain INSERTs, since filling tens of thousands of
+rows one add_connection() at a time would dominate the run.
+
+Usage:
+    python benchmarks/bench_database.py
+    python benchmarks/bench_database.py --devices 5000 --connections 50000 --json > db.json
+    python benchmarks/bench_database.py --ops concurrent --readers 8 --writers 4 --dir /var/lib/proxy
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import Database
+
+OPERATIONS = ('get-all', 'get-by-device', 'get-by-status', 'get-by-serial', 'get-by-port', 'get-by-tags',
+              'update-status', 'update-batch', 'add-device', 'refresh-device', 'concurrent')
+RACKS = 20
+FIRST_PORT = 10000
+STATUSES = ('active', 'stopped')
+
+
+def percentiles(values):
+    """p50/p95/p99/max in milliseconds (nearest rank)"""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(round(p * len(values))) - 1))] * 1000
+
+    return {'p50_ms': rank(0.50), 'p95_ms': rank(0.95), 'p99_ms': rank(0.99), 'max_ms': values[-1] * 1000}
+
+
+def populate(db, devices, connections):
+    """Fill db; returns (device ids, serials, connection ids, local ports)"""
+    if connections > 65535 - FIRST_PORT:
+        raise ValueError(f"At most {65535 - FIRST_PORT} connections fit in the local port range")
+    started = time.perf_counter()
+    serials = [f'BENCH{index:06d}' for index in range(devices)]
+    ids = db.upsert_devices({'serial': serial, 'model': 'Pixel 8', 'android_version': '14'}
+                            for serial in serials)
+    device_ids = [ids[serial] for serial in serials]
+
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany("INSERT INTO device_tags (device_id, key, value) VALUES (?, 'rack', ?)",
+                     [(device_id, str(index % RACKS)) for index, device_id in enumerate(device_ids)])
+    conn.executemany('INSERT INTO connections (device_id, local_port, remote_port, status) VALUES (?, ?, 8080, ?)',
+                     [(device_ids[index % devices], FIRST_PORT + index, STATUSES[index % 2])
+                      for index in range(connections)])
+    conn.commit()
+    connection_ids = [row[0] for row in conn.execute('SELECT id FROM connections')]
+    conn.close()
+    print(f"Populated {devices} devices and {connections} connections in "
+          f"{time.perf_counter() - started:.1f} s", file=sys.stderr)
+    return device_ids, serials, connection_ids, [FIRST_PORT + index for index in range(connections)]
+
+
+class Fixture:
+    """Populated database plus the ids the operations pick from"""
+
+    def __init__(self, path, devices, connections):
+        self.db = Database(path)
+        self.device_ids, self.serials, self.connection_ids, self.ports = populate(self.db, devices, connections)
+        self.new_serials = (f'CHURN{index:08d}' for index in range(10 ** 8))
+
+
+def time_calls(func, count, duration):
+    """Call func() up to count times (or until duration s pass); returns (latencies, wall)"""
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + duration
+    for _ in range(count):
+        call_started = time.perf_counter()
+        func()
+        now = time.perf_counter()
+        latencies.append(now - call_started)
+        if now > deadline:
+            break
+    return latencies, time.perf_counter() - started
+
+
+def operation(fixture, name, args):
+    """The callable timed for an operation, and how many rows one call covers"""
+    db, rng = fixture.db, random.Random(args.seed)
+    if name == 'get-all':
+        return db.get_connections, 1
+    if name == 'get-by-device':
+        return lambda: db.get_connections(rng.choice(fixture.device_ids)), 1
+    if name == 'get-by-status':
+        return lambda: db.get_connections_by_status('active'), 1
+    if name == 'get-by-serial':
+        return lambda: db.get_connections_by_serial(rng.choice(fixture.serials)), 1
+    if name == 'get-by-port':
+        return lambda: db.get_connection_by_port(rng.choice(fixture.ports)), 1
+    if name == 'get-by-tags':
+        return lambda: db.get_connections_by_tags({'rack': rng.randrange(RACKS)}), 1
+    if name == 'update-status':
+        return lambda: db.update_connection_status(rng.choice(fixture.connection_ids), rng.choice(STATUSES),
+                                                   f'10.0.{rng.randrange(256)}.{rng.randrange(256)}'), 1
+    if name == 'update-batch':
+        def update_batch():
+            db.update_connection_statuses(
+                [(connection_id, rng.choice(STATUSES), f'10.1.{rng.randrange(256)}.{rng.randrange(256)}')
+                 for connection_id in rng.sample(fixture.connection_ids, min(args.batch, len(fixture.connection_ids)))])
+        return update_batch, args.batch
+    if name == 'add-device':
+        def churn():
+            db.delete_device(db.add_device(next(fixture.new_serials), 'Pixel 8', '14'))
+        return churn, 1
+    if name == 'refresh-device':
+        return lambda: db.add_device(rng.choice(fixture.serials), 'Pixel 8', '14'), 1
+    raise ValueError(f"Unknown operation: {name}")
+
+
+def benchmark_operation(fixture, name, args):
+    func, rows_per_call = operation(fixture, name, args)
+    # These touch thousands of rows per call, so fewer calls are enough
+    count = max(5, args.calls // 20) if name in ('get-all', 'get-by-status', 'update-batch') else args.calls
+    latencies, wall = time_calls(func, count, args.duration)
+    return {
+        'operation': name,
+        'calls': len(latencies),
+        'ops_per_s': len(latencies) / wall,
+        'rows_per_s': len(latencies) * rows_per_call / wall,
+        'latency': percentiles(latencies),
+    }
+
+
+def benchmark_concurrent(fixture, args):
+    """Readers and writers hammering the database from threads at once"""
+    db = fixture.db
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+
+    def worker(kind, seed):
+        rng = random.Random(seed)
+        latencies, failed = [], 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                if kind == 'read':
+                    if rng.random() < 0.5:
+                        db.get_connections(rng.choice(fixture.device_ids))
+                    else:
+                        db.get_connections_by_serial(rng.choice(fixture.serials))
+                else:
+                    db.update_connection_status(rng.choice(fixture.connection_ids), rng.choice(STATUSES),
+                                                f'10.2.{rng.randrange(256)}.{rng.randrange(256)}')
+            except sqlite3.OperationalError:
+                failed += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+        with lock:
+            stats[kind].extend(latencies)
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('read', args.seed + i), name=f'reader-{i}')
+               for i in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=('write', args.seed + 1000 + i), name=f'writer-{i}')
+                for i in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'operation': 'concurrent',
+        'readers': args.readers,
+        'writers': args.writers,
+        'seconds': wall,
+        'reads_per_s': len(stats['read']) / wall,
+        'writes_per_s': len(stats['write']) / wall,
+        'read_latency': percentiles(stats['read']),
+        'write_latency': percentiles(stats['write']),
+        'locked_errors': errors,
+    }
+
+
+def print_result(result):
+    if result['operation'] == 'concurrent':
+        for kind in ('read', 'write'):
+            latency = result[f'{kind}_latency'] or {}
+            print(f"  concurrent {kind:<5}   {result[f'{kind}s_per_s']:10.0f} ops/s  "
+                  f"p50 {latency.get('p50_ms', 0):7.2f} ms  p95 {latency.get('p95_ms', 0):7.2f} ms  "
+                  f"p99 {latency.get('p99_ms', 0):7.2f} ms  ({result['locked_errors'][kind]} locked)", flush=True)
+        return
+    latency = result['latency']
+    line = (f"  {result['operation']:<18} {result['ops_per_s']:10.0f} ops/s  p50 {latency['p50_ms']:7.2f} ms  "
+            f"p95 {latency['p95_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms")
+    if result['rows_per_s'] != result['ops_per_s']:
+        line += f"  ({result['rows_per_s']:.0f} rows/s)"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite database on large fleets')
+    parser.add_argument('--devices', type=int, default=2000, help='Devices in the database')
+    parser.add_argument('--connections', type=int, default=20000, help='Connections in the database')
+    parser.add_argument('--ops', default=','.join(OPERATIONS),
+                        help=f"Comma-separated operations ({', '.join(OPERATIONS)})")
+    parser.add_argument('--calls', type=int, default=1000, help='Calls per operation')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Time limit per operation, and length of the concurrent run, in seconds')
+    parser.add_argument('--batch', type=int, default=500, help='Rows per update_connection_statuses call')
+    parser.add_argument('--readers', type=int, default=4, help='Reader threads in the concurrent run')
+    parser.add_argument('--writers', type=int, default=2, help='Writer threads in the concurrent run')
+    parser.add_argument('--dir', help='Directory for the database file (default: a temporary one); '
+                                      'use the disk the real database lives on')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    ops = [op for op in args.ops.split(',') if op]
+    unknown = [op for op in ops if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"unknown operation(s): {', '.join(unknown)}")
+
+    tmp = tempfile.mkdtemp(prefix='bench_db_', dir=args.dir)
+    try:
+        fixture = Fixture(os.path.join(tmp, 'bench.db'), args.devices, args.connections)
+        if not args.json:
+            print(f"{args.devices} devices, {args.connections} connections")
+        results = []
+        for name in ops:
+            result = (benchmark_concurrent(fixture, args) if name == 'concurrent'
+                      else benchmark_operation(fixture, name, args))
+            results.append(result)
+            if not args.json:
+                print_result(result)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({'python': sys.version.split()[0], 'sqlite': sqlite3.sqlite_version,
+                          'devices': args.devices, 'connections': args.connections,
+                          'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Benchmark fleet operations against simulated devices
+
+Starts an AdbSimulator (see adb_simulator.py) per fleet size and times the
+code paths a real fleet goes through, with ADBManager forking the fake adb
+executable just as it forks adb:
+
+    discovery        ADBManager.get_connected_devices() with a cold cache
+    start-all        bulk_ops.start_all() over one connection per device
+    stop-all         bulk_ops.stop_all()
+    check-all-ips    bulk_ops.check_all_ips()
+    rotate-one       bulk_ops.change_all_ips() for one device
+    rotate-all       bulk_ops.change_all_ips() for the whole fleet
+    cli-list-devices / cli-check-all-ips
+                     `cli.py --no-daemon ...` in a fresh interpreter
+
+Each operation reports wall-clock percentiles over --runs runs, per-item
+percentiles (one item = one device or connection) and items per second.
+Rotations include the fixed 2 s settle sleep of change_all_ips, so
+rotate-all is slow for large fleets; leave it out with --ops.
+
+Usage:
+    python benchmarks/bench_fleet.py
+    python benchmarks/bench_fleet.py --sizes 10,100,500 --json > fleet.json
+    python benchmarks/bench_fleet.py --sizes 100 --ops discovery,start-all,stop-all --relay asyncio
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bulk_ops
+from adb_manager import ADBManager
+from adb_simulator import AdbSimulator
+from database import Database
+from proxy_manager import ProxyManager
+
+CLI = os.path.join(ROOT, 'cli.py')
+
+OPERATIONS = ('discovery', 'start-all', 'stop-all', 'check-all-ips', 'rotate-one', 'rotate-all',
+              'cli-list-devices', 'cli-check-all-ips')
+
+
+def percentiles(values):
+    """p50/p95/p99/max in milliseconds (nearest rank)"""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(round(p * len(values))) - 1))] * 1000
+
+    return {'p50_ms': rank(0.50), 'p95_ms': rank(0.95), 'p99_ms': rank(0.99), 'max_ms': values[-1] * 1000}
+
+
+class Fleet:
+    """A simulator, fake adb, database and managers for one fleet size"""
+
+    def __init__(self, size, args):
+        self.size = size
+        self.tmp = tempfile.mkdtemp(prefix='bench_fleet_')
+        self.simulator = AdbSimulator(size, command_latency=args.command_latency,
+                                      airplane_latency=args.airplane_latency,
+                                      failure_rate=args.failure_rate, seed=args.seed)
+        self.simulator.start()
+        self.adb_path = self.simulator.make_adb_executable(os.path.join(self.tmp, 'bin'))
+        self.adb = ADBManager(self.adb_path)
+        self.relay = None
+        if args.relay != 'none':
+            from relay import create_relay
+            self.relay = create_relay(args.relay)
+        self.proxy = ProxyManager(self.adb, self.relay)
+        self.db = Database(os.path.join(self.tmp, 'fleet.db'))
+        for index, serial in enumerate(self.simulator.devices):
+            device_id = self.db.add_device(serial, self.simulator.devices[serial].props['ro.product.model'])
+            self.db.add_connection(device_id, args.base_port + index, 8080)
+
+    def close(self):
+        if self.relay is not None:
+            self.relay.close()
+        self.simulator.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def cli(self, command):
+        """Run cli.py --no-daemon <command> against the simulator"""
+        env = dict(os.environ,
+                   PATH=os.path.dirname(self.adb_path) + os.pathsep + os.environ.get('PATH', ''),
+                   MOBILE_PROXY_STATE=os.path.join(self.tmp, 'state.json'),
+                   MOBILE_PROXY_SOCKET=os.path.join(self.tmp, 'none.sock'))
+        result = subprocess.run([sys.executable, CLI, '--no-daemon'] + command, cwd=self.tmp, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"cli.py {' '.join(command)} failed: {result.stdout}{result.stderr}")
+        return []
+
+
+def run_operation(fleet, name, args):
+    """One run of an operation; returns the bulk results (per-item dicts)"""
+    parallel, timeout = args.parallel, args.timeout
+    if name == 'discovery':
+        fleet.adb.devices.clear()
+        started = time.perf_counter()
+        devices = fleet.adb.get_connected_devices()
+        elapsed = time.perf_counter() - started
+        # Discovery runs serially; report the mean per device as the item latency
+        return [{'ok': bool(d['model']), 'elapsed': elapsed / max(1, len(devices))} for d in devices]
+    if name == 'start-all':
+        return bulk_ops.start_all(fleet.db, fleet.proxy, parallel, timeout)[0]
+    if name == 'stop-all':
+        return bulk_ops.stop_all(fleet.db, fleet.proxy, parallel, timeout)[0]
+    if name == 'check-all-ips':
+        return bulk_ops.check_all_ips(fleet.db, fleet.adb, parallel, timeout)[0]
+    if name == 'rotate-one':
+        serial = random.choice(list(fleet.simulator.devices))
+        return bulk_ops.change_all_ips(fleet.db, fleet.adb, parallel, timeout,
+                                       wait_time=args.wait_time, serials=[serial])[0]
+    if name == 'rotate-all':
+        return bulk_ops.change_all_ips(fleet.db, fleet.adb, parallel, timeout, wait_time=args.wait_time,
+                                       serials=list(fleet.simulator.devices))[0]
+    if name == 'cli-list-devices':
+        return fleet.cli(['list-devices'])
+    if name == 'cli-check-all-ips':
+        return fleet.cli(['check-all-ips', '--parallel', str(parallel)])
+    raise ValueError(f"Unknown operation: {name}")
+
+
+def benchmark_operation(fleet, name, args):
+    """Time --runs runs of an operation; returns a result dict"""
+    walls, item_times, items, failures = [], [], 0, 0
+    requests = {}
+    for _ in range(args.runs):
+        if name == 'start-all':
+            # Every run starts the whole fleet, so stop what the last one started
+            bulk_ops.stop_all(fleet.db, fleet.proxy, args.parallel, args.timeout)
+        elif name == 'stop-all':
+            bulk_ops.start_all(fleet.db, fleet.proxy, args.parallel, args.timeout)
+        before = dict(fleet.simulator.requests)
+        started = time.perf_counter()
+        results = run_operation(fleet, name, args)
+        walls.append(time.perf_counter() - started)
+        for kind, count in fleet.simulator.requests.items():
+            if count != before.get(kind, 0):
+                requests[kind] = requests.get(kind, 0) + count - before.get(kind, 0)
+        items += len(results)
+        failures += sum(1 for r in results if not r['ok'])
+        item_times.extend(r['elapsed'] for r in results)
+
+    total = sum(walls)
+    return {
+        'operation': name,
+        'devices': fleet.size,
+        'runs': args.runs,
+        'items': items,
+        'failures': failures,
+        'wall': percentiles(walls),
+        'item': percentiles(item_times),
+        'ops_per_s': (items or args.runs) / total if total else None,
+        # adb server requests made per operation, by kind
+        'adb_requests': {kind: count / args.runs for kind, count in sorted(requests.items())},
+    }
+
+
+def run_benchmark(args):
+    results = []
+    for size in args.sizes:
+        fleet = Fleet(size, args)
+        try:
+            for name in args.ops:
+                result = benchmark_operation(fleet, name, args)
+                results.append(result)
+                if not args.json:
+                    print_result(result)
+            bulk_ops.stop_all(fleet.db, fleet.proxy, args.parallel, args.timeout)
+        finally:
+            fleet.close()
+    return {
+        'python': sys.version.split()[0],
+        'parallel': args.parallel,
+        'relay': args.relay,
+        'simulator': {'command_latency': args.command_latency, 'airplane_latency': args.airplane_latency,
+                      'failure_rate': args.failure_rate, 'seed': args.seed},
+        'results': results,
+    }
+
+
+def print_result(result):
+    wall, item = result['wall'], result['item']
+    line = (f"{result['devices']:>5} devices  {result['operation']:<18} "
+            f"wall p50 {wall['p50_ms']:9.1f} ms  p95 {wall['p95_ms']:9.1f} ms  p99 {wall['p99_ms']:9.1f} ms  "
+            f"{result['ops_per_s']:8.1f} ops/s")
+    if item and result['items'] != result['runs']:
+        line += f"  item p50 {item['p50_ms']:.1f} ms p99 {item['p99_ms']:.1f} ms"
+    if result['failures']:
+        line += f"  ⚠ {result['failures']} failed"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fleet operations against simulated devices')
+    parser.add_argument('--sizes', default='10,100,500', help='Comma-separated fleet sizes')
+    parser.add_argument('--ops', default=','.join(OPERATIONS),
+                        help=f"Comma-separated operations ({', '.join(OPERATIONS)})")
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per operation')
+    parser.add_argument('--parallel', type=int, default=bulk_ops.DEFAULT_PARALLEL, help='Bulk worker count')
+    parser.add_argument('--timeout', type=float, default=bulk_ops.DEFAULT_TIMEOUT, help='Per-item timeout')
+    parser.add_argument('--relay', choices=('none', 'asyncio', 'thread'), default='none',
+                        help='Relay mode for start-all/stop-all')
+    parser.add_argument('--wait-time', type=float, default=0, help='toggle_airplane_mode wait_time for rotations')
+    parser.add_argument('--command-latency', type=float, default=0.005,
+                        help='Simulated seconds per device request')
+    parser.add_argument('--airplane-latency', type=float, default=0.5,
+                        help='Simulated seconds per airplane-mode switch')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Simulated request failure rate')
+    parser.add_argument('--base-port', type=int, default=21000, help='First local port of the connections')
+    parser.add_argument('--seed', type=int, default=1, help='Simulator random seed')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    args.sizes = [int(size) for size in args.sizes.split(',') if size]
+    args.ops = [op for op in args.ops.split(',') if op]
+    unknown = [op for op in args.ops if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"unknown operation(s): {', '.join(unknown)}")
+    random.seed(args.seed)
+
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark GUI startup: time to first frame, stored rows shown and ready
+
+Launches `main.py` repeatedly with MOBILE_PROXY_STARTUP_METRICS pointing at
+a temporary file and MOBILE_PROXY_EXIT_AFTER_STARTUP set, so each run closes
+itself once the background bootstrap has finished. The milestones the app
+records (see main.StartupMetrics) are collected and summarized:
+
+    first_frame   the window is on screen
+    lists_loaded  stored devices and connections are shown
+    ready         device discovery and forward reconciliation are done
+
+Needs a display (or e.g. `xvfb-run`) and Kivy.
+
+Usage:
+    python benchmarks/bench_gui_startup.py
+    python benchmarks/bench_gui_startup.py --runs 10 --json > gui_startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+MILESTONES = ('first_frame', 'lists_loaded', 'ready')
+
+
+def run_once(metrics_path, timeout):
+    """Start the GUI once and return its milestones"""
+    env = dict(os.environ, MOBILE_PROXY_STARTUP_METRICS=metrics_path,
+               MOBILE_PROXY_EXIT_AFTER_STARTUP='1')
+    open(metrics_path, 'w').close()
+    # main.py loads main.kv and rows.kv relative to the working directory
+    result = subprocess.run([sys.executable, MAIN], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=timeout)
+    with open(metrics_path) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        raise RuntimeError(f"main.py reported no startup metrics (exit {result.returncode}):\n"
+                           f"{result.stdout}{result.stderr}")
+    return json.loads(lines[-1])
+
+
+def run_benchmark(runs, warmup, timeout):
+    """Collect milestones over several runs and return a result dict"""
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics_path = os.path.join(tmp, 'startup.jsonl')
+        for _ in range(warmup):
+            run_once(metrics_path, timeout)
+        samples = [run_once(metrics_path, timeout) for _ in range(runs)]
+
+    result = {'runs': runs, 'python': sys.version.split()[0]}
+    for name in MILESTONES:
+        values = sorted(s[name] for s in samples if name in s)
+        if values:
+            result[name] = {'min_ms': values[0], 'median_ms': statistics.median(values),
+                            'max_ms': values[-1]}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GUI startup milestones')
+    parser.add_argument('--runs', type=int, default=5, help='Number of timed runs')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs to warm the OS caches')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for one run')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.runs, args.warmup, args.timeout)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"main.py startup  ({result['runs']} runs, Python {result['python']})")
+    for name in MILESTONES:
+        if name in result:
+            stats = result[name]
+            print(f"  {name:<13} min {stats['min_ms']:.0f} ms  median {stats['median_ms']:.0f} ms  "
+                  f"max {stats['max_ms']:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Benchmark relay throughput, connection setup and per-connection cost
+
+The relay (relay.py) runs in this process between a load generator and
+local upstream stand-ins (an echo server and a byte source), which run in a
+child process so this process's CPU time and memory are the relay's own.
+Every relay variant is compared with `direct`, the generator talking to the
+upstream without a relay:
+
+    throughput   N concurrent long downloads; Gbit/s and relay CPU seconds per GB
+    setup        many short connections (connect, 1-byte echo, close);
+                 p50/p95/p99 latency and connections per second
+    memory       relay RSS growth per idle, established connection
+
+Variants: direct, thread, asyncio and, when uvloop is installed,
+asyncio+uvloop (AsyncioRelay with loop_factory=uvloop.new_event_loop).
+
+Usage:
+    python benchmarks/bench_relay.py
+    python benchmarks/bench_relay.py --json > relay.json
+    python benchmarks/bench_relay.py --relays asyncio,asyncio+uvloop --streams 1,64 --bytes 1G
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relay import create_relay
+
+CHUNK = b'\0' * (256 * 1024)
+
+
+def percentiles(values):
+    """p50/p95/p99/max in milliseconds (nearest rank)"""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(round(p * len(values))) - 1))] * 1000
+
+    return {'p50_ms': rank(0.50), 'p95_ms': rank(0.95), 'p99_ms': rank(0.99), 'max_ms': values[-1] * 1000}
+
+
+def parse_size(text):
+    """'64M' -> bytes"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def rss_bytes():
+    """Resident memory of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # Peak, not current, where /proc is missing (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 65536 if hard == resource.RLIM_INFINITY else hard
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Child process: upstream stand-ins and load generator
+def load_process(conn):
+    """Entry point of the child process; serves commands from conn"""
+    raise_file_limit()
+    asyncio.run(_load_main(conn))
+
+
+async def _load_main(conn):
+    loop = asyncio.get_running_loop()
+    echo = await asyncio.start_server(_echo, '127.0.0.1', 0, backlog=4096)
+    source = await asyncio.start_server(_source, '127.0.0.1', 0, backlog=4096)
+    conn.send({'echo': echo.sockets[0].getsockname()[1], 'source': source.sockets[0].getsockname()[1]})
+    held = []
+    while True:
+        command = await loop.run_in_executor(None, conn.recv)
+        name = command.pop('command')
+        if name == 'quit':
+            break
+        if name == 'stream':
+            conn.send(await _stream(**command))
+        elif name == 'setup':
+            conn.send(await _setup(**command))
+        elif name == 'hold':
+            held = await _hold(**command)
+            conn.send({'held': len(held)})
+        elif name == 'release':
+            for writer in held:
+                writer.close()
+            held = []
+            conn.send({})
+    echo.close()
+    source.close()
+
+
+async def _echo(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def _source(reader, writer):
+    """Send as many bytes as the 8-byte request asks for, then close"""
+    try:
+        remaining, = struct.unpack('!Q', await reader.readexactly(8))
+        while remaining > 0:
+            chunk = CHUNK if remaining >= len(CHUNK) else CHUNK[:remaining]
+            writer.write(chunk)
+            remaining -= len(chunk)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    writer.close()
+
+
+async def _stream(port, connections, size):
+    async def download():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(struct.pack('!Q', size))
+        received = 0
+        while True:
+            data = await reader.read(262144)
+            if not data:
+                break
+            received += len(data)
+        writer.close()
+        return received
+
+    started = time.perf_counter()
+    received = await asyncio.gather(*(download() for _ in range(connections)))
+    return {'bytes': sum(received), 'wall': time.perf_counter() - started}
+
+
+async def _setup(port, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b'x')
+                if await reader.read(1) != b'x':
+                    raise ConnectionError('no echo')
+                latencies.append(time.perf_counter() - started)
+                writer.close()
+            except OSError:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return {'latencies': latencies, 'failures': failures, 'wall': time.perf_counter() - started}
+
+
+async def _hold(port, count):
+    writers = []
+    for _ in range(count):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'x')
+        await reader.readexactly(1)
+        writers.append(writer)
+    return writers
+
+
+# Relay side
+def make_relay(variant):
+    """Relay for a variant name; None for direct"""
+    if variant == 'direct':
+        return None
+    mode, _, loop = variant.partition('+')
+    kwargs = {}
+    if loop == 'uvloop':
+        import uvloop
+        kwargs['loop_factory'] = uvloop.new_event_loop
+    elif loop:
+        raise ValueError(f"Unknown event loop: {loop}")
+    return create_relay(mode, **kwargs)
+
+
+def available_variants():
+    variants = ['direct', 'thread', 'asyncio']
+    try:
+        import uvloop  # noqa: F401
+        variants.append('asyncio+uvloop')
+    except ImportError:
+        pass
+    return variants
+
+
+class Generator:
+    """The child process and its command pipe"""
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=load_process, args=(child_conn,), daemon=True)
+        self.process.start()
+        self.ports = self.conn.recv()
+
+    def run(self, command, **params):
+        self.conn.send(dict(params, command=command))
+        return self.conn.recv()
+
+    def close(self):
+        self.conn.send({'command': 'quit'})
+        self.process.join(10)
+
+
+def benchmark_variant(variant, generator, args):
+    relay = make_relay(variant)
+    echo_port, source_port = generator.ports['echo'], generator.ports['source']
+    if relay is not None:
+        echo_port, source_port = free_port(), free_port()
+        if not (relay.start('echo', echo_port, generator.ports['echo'])
+                and relay.start('source', source_port, generator.ports['source'])):
+            raise RuntimeError(f"{variant}: relay did not start")
+    result = {'relay': variant, 'throughput': [], 'setup': None, 'memory': None}
+    try:
+        for connections in args.streams:
+            size = max(1, args.bytes // connections)
+            cpu = time.process_time()
+            stream = generator.run('stream', port=source_port, connections=connections, size=size)
+            cpu = time.process_time() - cpu
+            gigabytes = stream['bytes'] / 1e9
+            result['throughput'].append({
+                'connections': connections,
+                'bytes': stream['bytes'],
+                'seconds': stream['wall'],
+                'gbit_per_s': stream['bytes'] * 8 / 1e9 / stream['wall'],
+                'relay_cpu_s_per_gb': cpu / gigabytes if gigabytes else None,
+            })
+
+        setup = generator.run('setup', port=echo_port, count=args.short, concurrency=args.short_concurrency)
+        result['setup'] = {
+            'connections': args.short,
+            'concurrency': args.short_concurrency,
+            'failures': setup['failures'],
+            'conn_per_s': len(setup['latencies']) / setup['wall'],
+            'latency': percentiles(setup['latencies']),
+        }
+
+        # Let closed clients drain so they do not count against the idle ones
+        time.sleep(0.5)
+        before = rss_bytes()
+        held = generator.run('hold', port=echo_port, count=args.idle)['held']
+        time.sleep(0.5)
+        after = rss_bytes()
+        generator.run('release')
+        result['memory'] = {
+            'idle_connections': held,
+            'rss_delta_bytes': after - before,
+            'bytes_per_connection': (after - before) / held if held else None,
+        }
+    finally:
+        if relay is not None:
+            relay.close()
+    return result
+
+
+def print_result(result):
+    print(f"{result['relay']}")
+    for entry in result['throughput']:
+        cpu = entry['relay_cpu_s_per_gb']
+        print(f"  throughput  {entry['connections']:>4} conns  {entry['gbit_per_s']:7.2f} Gbit/s  "
+              f"relay CPU {cpu if cpu is not None else 0:6.2f} s/GB")
+    setup = result['setup']
+    latency = setup['latency'] or {}
+    print(f"  setup       {setup['conn_per_s']:7.0f} conn/s  p50 {latency.get('p50_ms', 0):.2f} ms  "
+          f"p95 {latency.get('p95_ms', 0):.2f} ms  p99 {latency.get('p99_ms', 0):.2f} ms"
+          + (f"  ⚠ {setup['failures']} failed" if setup['failures'] else ''))
+    memory = result['memory']
+    per_conn = memory['bytes_per_connection']
+    print(f"  memory      {memory['idle_connections']} idle conns  "
+          f"{per_conn / 1024 if per_conn is not None else 0:.1f} KiB per connection", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark relay throughput and connection costs')
+    parser.add_argument('--relays', default=','.join(available_variants()),
+                        help='Comma-separated variants: direct, thread, asyncio, asyncio+uvloop')
+    parser.add_argument('--streams', default='1,16,64', help='Concurrent download counts to measure')
+    parser.add_argument('--bytes', default='512M', help='Bytes downloaded per throughput run (e.g. 512M, 2G)')
+    parser.add_argument('--short', type=int, default=2000, help='Short connections for the setup test')
+    parser.add_argument('--short-concurrency', type=int, default=32, help='Short connections in flight')
+    parser.add_argument('--idle', type=int, default=500, help='Idle connections for the memory test')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    args.relays = [v for v in args.relays.split(',') if v]
+    args.streams = [int(n) for n in args.streams.split(',') if n]
+    args.bytes = parse_size(args.bytes)
+    raise_file_limit()
+
+    generator = Generator()
+    results = []
+    try:
+        for variant in args.relays:
+            try:
+                result = benchmark_variant(variant, generator, args)
+            except ImportError as e:
+                print(f"Skipping {variant}: {e}", file=sys.stderr)
+                continue
+            results.append(result)
+            if not args.json:
+                print_result(result)
+    finally:
+        generator.close()
+
+    if args.json:
+        print(json.dumps({'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+                          'bytes_per_run': args.bytes, 'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold CLI startup
+
+Runs `cli.py --no-daemon list-connections` (or another command) in fresh
+interpreters, each in an empty working directory so every run creates its
+own database, and reports wall-clock times. The modules loaded by the
+command are checked with `python -X importtime`, so a heavy import sneaking
+back onto the startup path shows up next to the timings.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 50 --json > startup.json
+    python benchmarks/bench_startup.py -- list-devices
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'cli.py')
+
+# Modules that should never load for a plain database command
+HEAVY_MODULES = ('requests', 'urllib3', 'kivy', 'curses', 'concurrent.futures.process')
+
+
+def time_run(command, cwd):
+    """Wall-clock seconds for one CLI run"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, CLI, '--no-daemon'] + command,
+                            cwd=cwd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"cli.py {' '.join(command)} failed: {result.stdout}{result.stderr}")
+    return elapsed
+
+
+def imported_modules(command, cwd):
+    """Top-level import cost per module (microseconds) for one CLI run"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', CLI, '--no-daemon'] + command,
+                            cwd=cwd, capture_output=True, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            continue
+        name = name.strip()
+        modules[name] = max(modules.get(name, 0), int(cumulative))
+    return modules
+
+
+def run_benchmark(command, runs, warmup):
+    """Time the command and return a result dict"""
+    with tempfile.TemporaryDirectory() as cwd:
+        env_state = os.path.join(cwd, 'mobile_proxy_state.json')
+        os.environ['MOBILE_PROXY_STATE'] = env_state
+        os.environ['MOBILE_PROXY_SOCKET'] = os.path.join(cwd, 'none.sock')
+
+        for _ in range(warmup):
+            time_run(command, cwd)
+        times = [time_run(command, cwd) for _ in range(runs)]
+        modules = imported_modules(command, cwd)
+
+    times.sort()
+    return {
+        'command': ' '.join(command),
+        'runs': runs,
+        'python': sys.version.split()[0],
+        'min_ms': times[0] * 1000,
+        'median_ms': statistics.median(times) * 1000,
+        'mean_ms': statistics.mean(times) * 1000,
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        'max_ms': times[-1] * 1000,
+        'heavy_modules': sorted(m for m in modules if m.split('.')[0] in HEAVY_MODULES
+                                or m in HEAVY_MODULES),
+        'slowest_imports': sorted(modules.items(), key=lambda item: -item[1])[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold CLI startup')
+    parser.add_argument('--runs', type=int, default=20, help='Number of timed runs')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed runs to warm the OS caches')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    parser.add_argument('command', nargs='*', default=['list-connections'],
+                        help='CLI command to time (default: list-connections)')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.command, args.runs, args.warmup)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"cli.py {result['command']}  ({result['runs']} runs, Python {result['python']})")
+    print(f"  min {result['min_ms']:.1f} ms  median {result['median_ms']:.1f} ms  "
+          f"p95 {result['p95_ms']:.1f} ms  max {result['max_ms']:.1f} ms")
+    print("  slowest imports (cumulative):")
+    for name, us in result['slowest_imports']:
+        print(f"    {us / 1000:7.1f} ms  {name}")
+    if result['heavy_modules']:
+        print(f"  ⚠ heavy modules loaded: {', '.join(result['heavy_modules'])}")
+    else:
+        print("  ✓ no heavy modules loaded")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+Fleet-wide bulk operations run on a bounded worker pool
+"""
+import threading
+import time
+
+from metrics import ROTATION_PHASE_SECONDS, ROTATION_SECONDS
+from tracing import span
+
+
+DEFAULT_PARALLEL = 8
+DEFAULT_TIMEOUT = 30
+
+
+def run_parallel(items, func, parallel=DEFAULT_PARALLEL, timeout=DEFAULT_TIMEOUT, on_result=None,
+                 executor=None, on_late=None):
+    """Run func(item) for every item on at most `parallel` worker threads
+
+    func returns (ok, message, extra) where extra is a dict merged into the
+    result, or raises. Each item gets `timeout` seconds from the moment a
+    worker picks it up; a hung item is reported as timed out and no longer
+    waited for. on_result(result) is called from the calling thread as soon
+    as each item finishes. Returns the list of result dicts in completion
+    order.
+
+    When an item that was reported as timed out finishes after all,
+    on_late(result) is called from its worker thread with its real outcome
+    (possibly after run_parallel has returned).
+
+    With an executor (e.g. the job manager's shared pool), items run there
+    and at most `parallel` of them are queued at a time, so concurrent
+    callers share the pool fairly; otherwise a private pool is used.
+    """
+    items = list(items)
+    total = len(items)
+    results = []
+    if not items:
+        return results
+
+    # Imported here so the CLI does not load it (and logging) for every command
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    parallel = max(1, parallel or 1)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=min(parallel, total))
+
+    started = {}
+
+    def run(index, item):
+        started[index] = time.monotonic()
+        return func(item)
+
+    queue = iter(enumerate(items))
+    pending = {}
+
+    def fill():
+        while len(pending) < parallel:
+            entry = next(queue, None)
+            if entry is None:
+                return
+            pending[executor.submit(run, *entry)] = entry[0]
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+
+            finished = [(future, pending[future]) for future in done]
+            if timeout:
+                finished += [
+                    (future, index) for future, index in pending.items()
+                    if future not in done and index in started and now - started[index] > timeout
+                ]
+
+            for future, index in finished:
+                del pending[future]
+                elapsed = now - started.get(index, now)
+                if future.done():
+                    result = _make_result(future, elapsed)
+                else:
+                    result = {'ok': False, 'status': 'timeout',
+                              'message': f'Timed out after {timeout}s', 'elapsed': elapsed}
+                    if on_late:
+                        future.add_done_callback(
+                            lambda f, item=items[index], start=started[index]:
+                            on_late(dict(_make_result(f, time.monotonic() - start), item=item))
+                        )
+                result['index'] = len(results) + 1
+                result['total'] = total
+                result['item'] = items[index]
+                results.append(result)
+                if on_result:
+                    on_result(result)
+            fill()
+    finally:
+        # Do not block on items that timed out; their threads finish on their own
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    return results
+
+
+def _make_result(future, elapsed):
+    """Turn a finished future into a result dict"""
+    try:
+        ok, message, extra = future.result()
+    except Exception as e:
+        return {'ok': False, 'status': 'error', 'message': str(e), 'elapsed': elapsed}
+
+    result = {'ok': bool(ok), 'status': 'ok' if ok else 'failed', 'message': message, 'elapsed': elapsed}
+    result.update(extra or {})
+    return result
+
+
+def summarize(results, elapsed=None):
+    """Count results by status"""
+    summary = {'total': len(results), 'ok': 0, 'failed': 0, 'timeout': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+    if elapsed is not None:
+        summary['elapsed'] = elapsed
+    return summary
+
+
+def _connection_item(conn):
+    conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
+    return {'connection_id': conn_id, 'serial': serial,
+            'local_port': local_port, 'remote_port': remote_port}
+
+
+def _flush_statuses(db, updates):
+    """Write collected status changes in one transaction"""
+    if not updates:
+        return
+    with span('flush_statuses', 'fleet', count=len(updates)):
+        if hasattr(db, 'update_connection_statuses'):
+            db.update_connection_statuses(updates)
+        else:
+            for update in updates:
+                db.update_connection_status(*update)
+
+
+def _run_bulk(items, func, db, updates, parallel, timeout, on_result, executor=None):
+    """Run func over items and write the status updates it collects in one batch
+
+    Items that time out keep running; whatever they add to updates after
+    the batch was written is written when they finish, so e.g. a forward
+    that came up late is not left recorded as stopped.
+    """
+    lock = threading.Lock()
+    written = [0]
+
+    def flush():
+        with lock:
+            pending = updates[written[0]:]
+            written[0] += len(pending)
+            _flush_statuses(db, pending)
+
+    def on_late(result):
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing late result for {result['item']}: {e}")
+
+    started = time.monotonic()
+    try:
+        results = run_parallel(items, func, parallel, timeout, on_result, executor, on_late)
+    finally:
+        flush()
+    return results, summarize(results, time.monotonic() - started)
+
+
+def _select_connections(db, status, selector, connection_ids=None):
+    """Connections with the given status, limited to devices matching selector
+    and to connection_ids when given"""
+    if not selector:
+        connections = db.get_connections_by_status(status)
+    else:
+        connections = [c for c in db.get_connections_by_tags(selector) if c[5] == status]
+    if connection_ids is not None:
+        wanted = set(connection_ids)
+        connections = [c for c in connections if c[0] in wanted]
+    return connections
+
+
+def _select_devices(db, adb, selector, serials=None):
+    """Items for per-device actions: the given serials, the devices matching
+    selector, or all connected devices"""
+    if serials:
+        devices = {}
+        for serial in serials:
+            device = db.get_device_by_serial(serial)
+            devices[serial] = device[2] or '' if device else ''
+        return [{'serial': serial, 'model': model} for serial, model in devices.items()]
+    if not selector:
+        return [{'serial': d['serial'], 'model': d['model']} for d in adb.get_connected_devices()]
+    return [{'serial': d[1], 'model': d[2] or ''} for d in db.get_devices_by_tags(selector)]
+
+
+def start_all(db, proxy, parallel=DEFAULT_PARALLEL, timeout=DEFAULT_TIMEOUT, on_result=None,
+              selector=None, executor=None, connection_ids=None):
+    """Start every stopped connection (of devices matching selector, and among
+    connection_ids if given); returns (results, summary)"""
+    updates = []
+
+    def start(item):
+        if proxy.start_proxy(item['serial'], item['local_port'], item['remote_port']):
+            updates.append((item['connection_id'], 'active'))
+            return True, 'Started', None
+        return False, 'Failed to start', None
+
+    items = [_connection_item(c) for c in _select_connections(db, 'stopped', selector, connection_ids)]
+    return _run_bulk(items, start, db, updates, parallel, timeout, on_result, executor)
+
+
+def stop_all(db, proxy, parallel=DEFAULT_PARALLEL, timeout=DEFAULT_TIMEOUT, on_result=None,
+             selector=None, executor=None, connection_ids=None):
+    """Stop every active connection (of devices matching selector, and among
+    connection_ids if given); returns (results, summary)"""
+    updates = []
+
+    def stop(item):
+        if proxy.stop_proxy(item['serial'], item['local_port']):
+            updates.append((item['connection_id'], 'stopped'))
+            return True, 'Stopped', None
+        return False, 'Failed to stop', None
+
+    items = [_connection_item(c) for c in _select_connections(db, 'active', selector, connection_ids)]
+    return _run_bulk(items, stop, db, updates, parallel, timeout, on_result, executor)
+
+
+def check_all_ips(db, adb, parallel=DEFAULT_PARALLEL, timeout=DEFAULT_TIMEOUT, on_result=None,
+                  selector=None, serials=None, executor=None):
+    """Check the IP of every connected device (or of the given serials or
+    devices matching selector)
+
+    Found IPs are also stored on the device's connections. Returns
+    (results, summary).
+    """
+    updates = []
+
+    def check(item):
+        ip = adb.get_device_ip(item['serial'])
+        if not ip:
+            return False, 'Could not retrieve IP', {'ip': None}
+        for conn in db.get_connections_by_serial(item['serial']):
+            updates.append((conn[0], conn[5], ip))
+        return True, ip, {'ip': ip}
+
+    items = _select_devices(db, adb, selector, serials)
+    return _run_bulk(items, check, db, updates, parallel, timeout, on_result, executor)
+
+
+def change_all_ips(db, adb, parallel=DEFAULT_PARALLEL, timeout=DEFAULT_TIMEOUT, on_result=None,
+                   selector=None, wait_time=5, serials=None, executor=None):
+    """Rotate the IP of every connected device (or of the given serials or
+    devices matching selector)
+
+    Airplane mode is toggled on each device and the new IP is read and stored
+    on its connections. Returns (results, summary).
+    """
+    updates = []
+
+    def change(item):
+        with ROTATION_SECONDS.time(), span('rotate', 'fleet', serial=item['serial']):
+            if not adb.toggle_airplane_mode(item['serial'], wait_time):
+                return False, 'Failed to toggle airplane mode', {'ip': None}
+            # Give the modem a moment to come back before asking for the IP
+            with ROTATION_PHASE_SECONDS.labels(phase='settle').time(), span('sleep', 'fleet'):
+                time.sleep(2)
+            with ROTATION_PHASE_SECONDS.labels(phase='ip_lookup').time():
+                ip = adb.get_device_ip(item['serial'])
+        if ip:
+            for conn in db.get_connections_by_serial(item['serial']):
+                updates.append((conn[0], conn[5], ip))
+        return True, ip or 'Rotated, IP not available yet', {'ip': ip}
+
+    items = _select_devices(db, adb, selector, serials)
+    return _run_bulk(items, change, db, updates, parallel, timeout, on_result, executor)
+
+
+def reconcile_forwards(db, adb, proxy=None):
+    """Bring stored connection statuses in line with the forwards adb really has
+
+    After a restart (or an adb server restart) the database can claim
+    connections are active whose forward is gone, or stopped while a forward
+    from an earlier session is still in place. A single `adb forward --list`
+    covers every device. Live forwards are recorded in proxy.active_forwards
+    when a proxy is given. Returns the (connection_id, status) updates
+    written; nothing changes when adb cannot be queried.
+    """
+    forwards = adb.list_all_forwards()
+    if forwards is None:
+        return []
+    live = {(serial, local_port): remote_port for serial, local_port, remote_port in forwards}
+
+    updates = []
+    for conn in db.get_connections():
+        conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
+        forwarded = live.get((serial, local_port)) == remote_port
+        if forwarded and proxy is not None:
+            proxy.active_forwards[local_port] = {'serial': serial, 'remote_port': remote_port,
+                                                 'status': 'active'}
+        if forwarded and status != 'active':
+            updates.append((conn_id, 'active'))
+        elif not forwarded and status == 'active':
+            updates.append((conn_id, 'stopped'))
+
+    _flush_statuses(db, updates)
+    return updates
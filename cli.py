@@ -4,17 +4,35 @@ CLI tool for Mobile Proxy Manager
 For headless operation and automation
 """
 import argparse
+import json
+import os
 import sys
 import time
-from database import Database
-from adb_manager import ADBManager
-from proxy_manager import ProxyManager
+import proxy_daemon
+
+# Database, ADB, proxy and bulk_ops modules are imported where they are
+# needed, so commands that do not use them (and --help) start quickly.
+
+# Commands that only use the database and need no adb binary
+DB_ONLY_COMMANDS = ('list-connections', 'tag')
+
+# Single-target commands that act on a whole device group with --select
+SELECT_ACTIONS = {
+    'start': 'start_all',
+    'stop': 'stop_all',
+    'check-ip': 'check_all_ips',
+    'change-ip': 'change_all_ips',
+}
 
 
 class InteractiveCLI:
     """Interactive CLI mode with menus and submenus"""
     
     def __init__(self):
+        from database import Database
+        from adb_manager import ADBManager
+        from proxy_manager import ProxyManager
+        
         self.db = Database()
         self.adb = ADBManager()
         self.proxy = ProxyManager(self.adb)
@@ -192,13 +210,8 @@ class InteractiveCLI:
         print("Scanning for connected devices...")
         devices = self.adb.get_connected_devices()
         
-        # Update database
-        for device in devices:
-            self.db.add_device(
-                device['serial'],
-                device['model'],
-                device['android_version']
-            )
+        # Update database in a single transaction
+        self.db.upsert_devices(devices)
         
         print(f"✓ Found and registered {len(devices)} device(s)")
         self.pause()
@@ -270,6 +283,7 @@ class InteractiveCLI:
                 success = self.adb.toggle_airplane_mode(serial, wait_time=5)
                 
                 if success:
+                    record_rotation(self.db, serial)
                     print("✓ Airplane mode toggled successfully")
                     time.sleep(2)
                     print("\nChecking new IP...")
@@ -433,7 +447,7 @@ class InteractiveCLI:
         
         try:
             conn_id = int(choice)
-            conn = next((c for c in connections if c[0] == conn_id), None)
+            conn = self.db.get_connection(conn_id)
             
             if conn:
                 _, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
@@ -479,7 +493,7 @@ class InteractiveCLI:
         
         try:
             conn_id = int(choice)
-            conn = next((c for c in connections if c[0] == conn_id), None)
+            conn = self.db.get_connection(conn_id)
             
             if conn:
                 _, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
@@ -525,7 +539,7 @@ class InteractiveCLI:
         
         try:
             conn_id = int(choice)
-            conn = next((c for c in connections if c[0] == conn_id), None)
+            conn = self.db.get_connection(conn_id)
             
             if conn:
                 confirm = self.get_input(f"Are you sure you want to delete connection {conn_id}? (yes/no): ")
@@ -571,7 +585,7 @@ class InteractiveCLI:
         
         try:
             conn_id = int(choice)
-            conn = next((c for c in connections if c[0] == conn_id), None)
+            conn = self.db.get_connection(conn_id)
             
             if conn:
                 conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
@@ -596,88 +610,21 @@ class InteractiveCLI:
         """Start all connections"""
         self.clear_screen()
         self.print_header("Start All Connections")
-        
-        connections = self.db.get_connections()
-        if not connections:
-            print("No connections configured.")
-            self.pause()
-            return
-        
-        started = 0
-        failed = 0
-        
-        for conn in connections:
-            conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
-            
-            if status == 'stopped':
-                print(f"Starting connection {conn_id} ({serial})...")
-                success = self.proxy.start_proxy(serial, local_port, remote_port)
-                
-                if success:
-                    self.db.update_connection_status(conn_id, 'active')
-                    started += 1
-                    print(f"  ✓ Started")
-                else:
-                    failed += 1
-                    print(f"  ✗ Failed")
-        
-        print(f"\nSummary: {started} started, {failed} failed")
+        bulk_action('start_all', self.db, self.adb, self.proxy)
         self.pause()
     
     def stop_all_connections_action(self):
         """Stop all connections"""
         self.clear_screen()
         self.print_header("Stop All Connections")
-        
-        connections = self.db.get_connections()
-        if not connections:
-            print("No connections configured.")
-            self.pause()
-            return
-        
-        stopped = 0
-        failed = 0
-        
-        for conn in connections:
-            conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
-            
-            if status == 'active':
-                print(f"Stopping connection {conn_id} ({serial})...")
-                success = self.proxy.stop_proxy(serial, local_port)
-                
-                if success:
-                    self.db.update_connection_status(conn_id, 'stopped')
-                    stopped += 1
-                    print(f"  ✓ Stopped")
-                else:
-                    failed += 1
-                    print(f"  ✗ Failed")
-        
-        print(f"\nSummary: {stopped} stopped, {failed} failed")
+        bulk_action('stop_all', self.db, self.adb, self.proxy)
         self.pause()
     
     def check_all_ips_action(self):
         """Check IPs for all devices"""
         self.clear_screen()
         self.print_header("Check All Device IPs")
-        
-        devices = self.adb.get_connected_devices()
-        if not devices:
-            print("No devices connected.")
-            self.pause()
-            return
-        
-        for device in devices:
-            serial = device['serial']
-            model = device['model']
-            print(f"Checking {model} ({serial})...")
-            
-            ip = self.adb.get_device_ip(serial)
-            if ip:
-                print(f"  ✓ IP: {ip}")
-            else:
-                print(f"  ✗ Could not retrieve IP")
-        
+        bulk_action('check_all_ips', self.db, self.adb, self.proxy)
         self.pause()
     
     def show_system_status_action(self):
@@ -707,7 +654,7 @@ class InteractiveCLI:
     def run(self):
         """Run the interactive CLI"""
         # Check ADB availability
-        if not self.adb.check_adb_available():
+        if not check_adb(self.adb):
             print("Error: ADB is not installed or not in PATH")
             print("Please install Android Debug Bridge (ADB) to use this application.")
             return 1
@@ -716,8 +663,30 @@ class InteractiveCLI:
         return 0
 
 
-def list_devices(adb):
+class NDJSONWriter:
+    """Machine-readable output: one JSON object per line, flushed as soon as
+    it is written so pipelines can consume results while others are pending"""
+    
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+    
+    def emit(self, record_type, **fields):
+        """Write a single record"""
+        record = {'type': record_type}
+        record.update(fields)
+        self.stream.write(json.dumps(record, default=str) + '\n')
+        self.stream.flush()
+
+
+def list_devices(adb, out=None):
     """List connected devices"""
+    if out:
+        # Stream each device as soon as its properties are known
+        iter_devices = getattr(adb, 'iter_connected_devices', None)
+        for device in (iter_devices() if iter_devices else adb.get_connected_devices()):
+            out.emit('device', **device)
+        return
+    
     devices = adb.get_connected_devices()
     
     if not devices:
@@ -732,9 +701,15 @@ def list_devices(adb):
     print()
 
 
-def list_connections(db):
-    """List all connections"""
-    connections = db.get_connections()
+def list_connections(db, out=None, selector=None):
+    """List all connections, or those of devices matching selector"""
+    connections = db.get_connections_by_tags(selector) if selector else db.get_connections()
+    
+    if out:
+        from database import connection_record
+        for conn in connections:
+            out.emit('connection', **connection_record(conn))
+        return
     
     if not connections:
         print("No connections configured.")
@@ -750,14 +725,16 @@ def list_connections(db):
     print()
 
 
-def add_connection(db, adb, serial, local_port, remote_port):
+def add_connection(db, adb, serial, local_port, remote_port, out=None):
     """Add a new connection"""
     # Get device info
-    devices = adb.get_connected_devices()
-    device = next((d for d in devices if d['serial'] == serial), None)
+    device = adb.get_device_info(serial)
     
     if not device:
-        print(f"Error: Device {serial} not found")
+        if out:
+            out.emit('error', message=f"Device {serial} not found", serial=serial)
+        else:
+            print(f"Error: Device {serial} not found")
         return False
     
     # Add device to database
@@ -766,6 +743,11 @@ def add_connection(db, adb, serial, local_port, remote_port):
     # Add connection
     conn_id = db.add_connection(device_id, local_port, remote_port)
     
+    if out:
+        out.emit('result', action='add', ok=bool(conn_id), connection_id=conn_id, serial=serial,
+                 local_port=local_port, remote_port=remote_port)
+        return bool(conn_id)
+    
     if conn_id:
         print(f"✓ Connection added (ID: {conn_id})")
         return True
@@ -774,13 +756,15 @@ def add_connection(db, adb, serial, local_port, remote_port):
         return False
 
 
-def start_connection(db, proxy, conn_id):
+def start_connection(db, proxy, conn_id, out=None):
     """Start a connection"""
-    connections = db.get_connections()
-    conn = next((c for c in connections if c[0] == conn_id), None)
+    conn = db.get_connection(conn_id)
     
     if not conn:
-        print(f"Error: Connection {conn_id} not found")
+        if out:
+            out.emit('error', message=f"Connection {conn_id} not found", connection_id=conn_id)
+        else:
+            print(f"Error: Connection {conn_id} not found")
         return False
     
     conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
@@ -789,20 +773,25 @@ def start_connection(db, proxy, conn_id):
     
     if success:
         db.update_connection_status(conn_id, 'active')
+    
+    if out:
+        out.emit('result', action='start', ok=success, connection_id=conn_id, serial=serial)
+    elif success:
         print(f"✓ Connection {conn_id} started")
-        return True
     else:
         print(f"✗ Failed to start connection {conn_id}")
-        return False
+    return success
 
 
-def stop_connection(db, proxy, conn_id):
+def stop_connection(db, proxy, conn_id, out=None):
     """Stop a connection"""
-    connections = db.get_connections()
-    conn = next((c for c in connections if c[0] == conn_id), None)
+    conn = db.get_connection(conn_id)
     
     if not conn:
-        print(f"Error: Connection {conn_id} not found")
+        if out:
+            out.emit('error', message=f"Connection {conn_id} not found", connection_id=conn_id)
+        else:
+            print(f"Error: Connection {conn_id} not found")
         return False
     
     conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
@@ -811,17 +800,24 @@ def stop_connection(db, proxy, conn_id):
     
     if success:
         db.update_connection_status(conn_id, 'stopped')
+    
+    if out:
+        out.emit('result', action='stop', ok=success, connection_id=conn_id, serial=serial)
+    elif success:
         print(f"✓ Connection {conn_id} stopped")
-        return True
     else:
         print(f"✗ Failed to stop connection {conn_id}")
-        return False
+    return success
 
 
-def check_ip(adb, serial):
+def check_ip(adb, serial, out=None):
     """Check device IP"""
     ip = adb.get_device_ip(serial)
     
+    if out:
+        out.emit('ip', serial=serial, ok=bool(ip), ip=ip)
+        return ip
+    
     if ip:
         print(f"Device IP: {ip}")
         return ip
@@ -830,12 +826,21 @@ def check_ip(adb, serial):
         return None
 
 
-def change_ip(adb, serial, wait_time=5):
+def change_ip(adb, serial, wait_time=5, out=None):
     """Change device IP by toggling airplane mode"""
-    print(f"Toggling airplane mode on {serial}...")
+    if not out:
+        print(f"Toggling airplane mode on {serial}...")
     
     success = adb.toggle_airplane_mode(serial, wait_time)
     
+    if out:
+        new_ip = None
+        if success:
+            time.sleep(2)
+            new_ip = adb.get_device_ip(serial)
+        out.emit('result', action='change_ip', ok=success, serial=serial, ip=new_ip)
+        return success
+    
     if success:
         print("✓ Airplane mode toggled successfully")
         time.sleep(2)
@@ -846,6 +851,316 @@ def change_ip(adb, serial, wait_time=5):
         return False
 
 
+def tag_device(db, serial, tags=None, remove=None, out=None):
+    """Set/remove tags on a device and show its tags"""
+    device = db.get_device_by_serial(serial)
+    if device:
+        device_id = device[0]
+    else:
+        # Tagging needs no adb; model and version are filled in on the next refresh
+        device_id = db.add_device(serial)
+    
+    if tags:
+        db.set_device_tags(device_id, tags)
+    if remove:
+        db.remove_device_tags(device_id, remove)
+    current = db.get_device_tags(device_id)
+    
+    if out:
+        out.emit('tags', serial=serial, device_id=device_id, tags=current)
+        return True
+    
+    if current:
+        print(f"{serial}: " + ', '.join(f"{k}={v}" if v else k for k, v in sorted(current.items())))
+    else:
+        print(f"{serial}: no tags")
+    return True
+
+
+def check_adb(adb, client=None):
+    """Whether adb is usable
+    
+    Local checks go through the state-file cache in adb_manager.resolve_adb,
+    and adb is pointed at the resolved binary. A daemon caches its own result.
+    """
+    if client:
+        return adb.check_adb_available()
+    
+    from adb_manager import resolve_adb
+    path, _ = resolve_adb(adb.adb_path)
+    if path:
+        adb.adb_path = path
+    return path is not None
+
+
+def record_rotation(db, serial):
+    """Store an IP rotation in the time-series history of a device's connections"""
+    from timeseries import TimeSeriesStore
+    
+    samples = [{'connection_id': conn[0], 'rotations': 1}
+               for conn in db.get_connections_by_serial(serial)]
+    if samples:
+        TimeSeriesStore(db).record_samples(samples)
+
+
+BULK_ACTIONS = {
+    # action: (past-tense verb, message when there is nothing to do)
+    'start_all': ('started', 'No stopped connections to start.'),
+    'stop_all': ('stopped', 'No active connections to stop.'),
+    'check_all_ips': ('checked', 'No devices connected.'),
+    'change_all_ips': ('rotated', 'No devices connected.'),
+}
+
+
+def print_bulk_result(result):
+    """Print one line of bulk operation progress"""
+    item = result['item']
+    if 'connection_id' in item:
+        label = f"Connection {item['connection_id']} ({item['serial']})"
+    elif item.get('model'):
+        label = f"{item['model']} ({item['serial']})"
+    else:
+        label = item['serial']
+    mark = '✓' if result['ok'] else '✗'
+    print(f"[{result['index']}/{result['total']}] {mark} {label}: {result['message']} "
+          f"({result['elapsed']:.1f}s)", flush=True)
+
+
+def result_printer(action, out=None):
+    """on_result callback that prints bulk/job results as text or NDJSON"""
+    if not out:
+        return print_bulk_result
+    
+    def on_result(result):
+        fields = dict(result)
+        fields.update(fields.pop('item'))
+        out.emit('result', action=action, **fields)
+    return on_result
+
+
+def bulk_action(action, db, adb, proxy, parallel=None, timeout=None, client=None, out=None,
+                selector=None, wait_time=5):
+    """Run a fleet-wide action in parallel with live progress and a summary
+    
+    With a selector, only devices carrying the matching tags are affected.
+    parallel and timeout default (None) to the bulk_ops defaults.
+    """
+    verb, empty_message = BULK_ACTIONS[action]
+    if selector:
+        empty_message = "No matching devices or connections."
+    
+    on_result = result_printer(action, out)
+    
+    if client:
+        params = (parallel, timeout, selector) + ((wait_time,) if action == 'change_all_ips' else ())
+        summary = client.call(f'fleet.{action}', *params, on_progress=on_result)
+    else:
+        import bulk_ops
+        parallel = bulk_ops.DEFAULT_PARALLEL if parallel is None else parallel
+        timeout = bulk_ops.DEFAULT_TIMEOUT if timeout is None else timeout
+        if action == 'check_all_ips':
+            results, summary = bulk_ops.check_all_ips(db, adb, parallel, timeout, on_result, selector)
+        elif action == 'change_all_ips':
+            results, summary = bulk_ops.change_all_ips(db, adb, parallel, timeout, on_result,
+                                                       selector, wait_time)
+            for result in results:
+                if result['ok']:
+                    record_rotation(db, result['item']['serial'])
+        else:
+            func = getattr(bulk_ops, action)
+            results, summary = func(db, proxy, parallel, timeout, on_result, selector)
+    
+    success = summary['ok'] == summary['total']
+    if out:
+        out.emit('summary', action=action, **summary)
+        return success
+    
+    if not summary['total']:
+        print(empty_message)
+        return True
+    
+    print(f"\nSummary: {summary['ok']} {verb}, {summary['failed'] + summary['error']} failed, "
+          f"{summary['timeout']} timed out in {summary['elapsed']:.1f}s")
+    return success
+
+
+def print_job(job):
+    """Print a job record"""
+    progress = f"{job['done']}/{job['total']}" if job['total'] is not None else f"{job['done']}/?"
+    print(f"Job {job['id']}: {job['action']} [{job['state']}]")
+    print(f"  Progress: {progress} done, {job['ok']} ok")
+    if job['params']:
+        print(f"  Parameters: {json.dumps(job['params'])}")
+    print(f"  Submitted: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created_at']))}")
+    if job['started_at']:
+        end = job['finished_at'] or time.time()
+        print(f"  Running time: {end - job['started_at']:.1f}s")
+    if job['error']:
+        print(f"  Error: {job['error']}")
+
+
+def job_command(args, db, adb, proxy, client=None, out=None):
+    """Submit, follow, inspect or list background jobs"""
+    from jobs import JobManager, JobStore, JOB_FINISHED
+    
+    if client:
+        jobs = client.service('job')
+    elif args.job_command in ('submit', 'follow'):
+        def record_rotations(job, result):
+            if job.action == 'change_all_ips' and result['ok']:
+                record_rotation(db, result['item']['serial'])
+        jobs = JobManager(db, adb, proxy, JobStore(db), on_result=record_rotations)
+    else:
+        jobs = JobStore(db)
+    
+    def emit_job(job):
+        if out:
+            out.emit('job', **job)
+        else:
+            print_job(job)
+    
+    def follow(job_id):
+        job = jobs.get_job(job_id)
+        if not job:
+            raise ValueError(f"Job {job_id} not found")
+        on_result = result_printer(job['action'], out)
+        if client:
+            job = client.call('job.follow', job_id, on_progress=on_result)
+        else:
+            job = jobs.follow(job_id, on_result)
+        if out:
+            out.emit('job', **job)
+        else:
+            print()
+            print_job(job)
+        return job['state'] == JOB_FINISHED and job['ok'] == job['total']
+    
+    try:
+        if args.job_command == 'submit':
+            action = SELECT_ACTIONS[args.action]
+            # Unset limits are left to the job's bulk_ops defaults
+            params = {name: value for name, value in (('parallel', args.parallel), ('timeout', args.timeout))
+                      if value is not None}
+            if args.select:
+                from database import parse_selector
+                params['selector'] = parse_selector(args.select)
+            if args.serials:
+                params['serials'] = args.serials
+            if action == 'change_all_ips':
+                params['wait_time'] = args.wait
+            
+            job_id = jobs.submit(action, params)
+            if not client and not out:
+                print(f"Job {job_id} submitted; no daemon is running, so it runs in the foreground")
+            if args.follow or not client:
+                return follow(job_id)
+            
+            if out:
+                out.emit('job', **jobs.get_job(job_id))
+            else:
+                print(f"✓ Job {job_id} submitted ({action})")
+                print(f"  Follow it with: cli.py job follow {job_id}")
+            return True
+        
+        elif args.job_command == 'follow':
+            return follow(args.job_id)
+        
+        elif args.job_command == 'status':
+            job = jobs.get_job(args.job_id)
+            if not job:
+                raise ValueError(f"Job {args.job_id} not found")
+            emit_job(job)
+            if args.results:
+                on_result = result_printer(job['action'], out)
+                if not out:
+                    print()
+                for result in jobs.get_results(args.job_id, 0):
+                    on_result(result)
+            return True
+        
+        elif args.job_command == 'list':
+            records = jobs.list_jobs(args.limit)
+            if out:
+                for job in records:
+                    out.emit('job', **job)
+            elif not records:
+                print("No jobs.")
+            else:
+                for job in records:
+                    progress = f"{job['done']}/{job['total'] if job['total'] is not None else '?'}"
+                    submitted = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created_at']))
+                    print(f"{job['id']}  {submitted}  {job['action']:<15} {job['state']:<9} {progress}")
+            return True
+    finally:
+        if isinstance(jobs, JobManager):
+            jobs.shutdown()
+
+
+def parse_http_address(text):
+    """Parse '[HOST:]PORT' into (host, port)"""
+    from api_server import DEFAULT_HOST
+    
+    host, _, port = text.rpartition(':')
+    return host or DEFAULT_HOST, int(port)
+
+
+def profile_command(socket_path, action, output=None, duration=None, interval=None):
+    """Start or stop sampling a running daemon (profile start/stop)"""
+    client = proxy_daemon.connect(socket_path)
+    if not client:
+        print("Error: profiling needs a running daemon (use --profile to profile one command)")
+        return 1
+    
+    try:
+        if action == 'start':
+            interval = interval / 1000 if interval else None
+            output = os.path.abspath(output) if output else None
+            started = client.call('daemon.profile_start', output, interval)
+            if not duration:
+                print(f"✓ Profiling the daemon into {started['base']}.*; run 'profile stop' to write it")
+                return 0
+            print(f"Profiling the daemon for {duration:g} s...")
+            try:
+                time.sleep(duration)
+            except KeyboardInterrupt:
+                pass
+        paths = client.call('daemon.profile_stop')
+        print("✓ Profile written to " + ", ".join(paths))
+        return 0
+    except proxy_daemon.DaemonError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        client.close()
+
+
+def serve(socket_path, stop=False, http=None, http_token=None, relay=None):
+    """Run the daemon in the foreground, or stop a running one"""
+    if stop:
+        client = proxy_daemon.connect(socket_path)
+        if not client:
+            print("Daemon is not running")
+            return 1
+        client.call('daemon.shutdown')
+        client.close()
+        print("✓ Daemon stopped")
+        return 0
+    
+    server = proxy_daemon.ProxyDaemon(socket_path, http_address=http, http_token=http_token,
+                                      relay_mode=relay)
+    print(f"Mobile Proxy daemon listening on {socket_path} (pid {server.ping()['pid']})")
+    if relay:
+        print(f"Relaying proxy traffic in-process ({relay} mode)")
+    if http:
+        print(f"REST API on http://{http[0]}:{http[1]}/api/")
+    try:
+        server.serve_forever()
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Mobile Proxy Manager CLI',
@@ -876,11 +1191,56 @@ Examples:
   
   Change device IP:
     %(prog)s change-ip ABC123
+  
+  Tag devices, then act on a whole group at once:
+    %(prog)s tag ABC123 carrier=tmobile rack=3
+    %(prog)s change-ip --select carrier=tmobile,rack=3
+    %(prog)s start --select rack=3
+  
+  Start all connections, 20 at a time:
+    %(prog)s start-all --parallel 20
+  
+  Rotate a rack in the background and check on it later:
+    %(prog)s job submit change-ip --select rack=3
+    %(prog)s job status <job-id>
+    %(prog)s job follow <job-id>
+  
+  Live connection dashboard:
+    %(prog)s top
+  
+  See where the time of a rotation goes:
+    %(prog)s --trace rotate.json change-ip ABC123
+  
+  Profile a command, or a running daemon for 30 seconds:
+    %(prog)s --profile list-devices.prof list-devices
+    %(prog)s profile start --duration 30
+  
+  Run the background daemon (other commands then use it automatically):
+    %(prog)s serve
+    %(prog)s serve --stop
         """
     )
     
     parser.add_argument('-i', '--interactive', action='store_true',
                        help='Run in interactive mode with menus')
+    parser.add_argument('--socket', default=proxy_daemon.DEFAULT_SOCKET_PATH,
+                       help='Daemon control socket path')
+    parser.add_argument('--no-daemon', action='store_true',
+                       help='Do not use a running daemon, work on local state')
+    parser.add_argument('--json', '--ndjson', dest='ndjson', action='store_true',
+                       help='Print results as newline-delimited JSON, one object per '
+                            'device/connection/result, as soon as each is available')
+    parser.add_argument('--trace', metavar='FILE',
+                       help='Write a Chrome trace (Perfetto, chrome://tracing) of the adb, '
+                            'proxy and database calls to FILE on exit; implies --no-daemon so '
+                            'the calls run (and are traced) in this process')
+    parser.add_argument('--profile', metavar='FILE',
+                       help='Profile the command; writes FILE.txt (sorted summary) and '
+                            'FILE.prof or FILE.folded (raw data) on exit. Implies --no-daemon; '
+                            'use "profile start/stop" to profile a running daemon')
+    parser.add_argument('--profile-mode', choices=('cprofile', 'sample'), default='cprofile',
+                       help='cprofile: exact call counts and times of the main thread (default); '
+                            'sample: wall-clock stack samples of every thread, e.g. bulk workers')
     
     subparsers = parser.add_subparsers(dest='command', help='Command to execute')
     
@@ -891,7 +1251,8 @@ Examples:
     subparsers.add_parser('list-devices', help='List connected devices')
     
     # List connections
-    subparsers.add_parser('list-connections', help='List configured connections')
+    list_parser = subparsers.add_parser('list-connections', help='List configured connections')
+    list_parser.add_argument('--select', help='Only devices with these tags, e.g. carrier=tmobile,rack=3')
     
     # Add connection
     add_parser = subparsers.add_parser('add', help='Add a new connection')
@@ -901,23 +1262,119 @@ Examples:
     
     # Start connection
     start_parser = subparsers.add_parser('start', help='Start a connection')
-    start_parser.add_argument('connection_id', type=int, help='Connection ID')
+    start_parser.add_argument('connection_id', type=int, nargs='?', help='Connection ID')
     
     # Stop connection
     stop_parser = subparsers.add_parser('stop', help='Stop a connection')
-    stop_parser.add_argument('connection_id', type=int, help='Connection ID')
+    stop_parser.add_argument('connection_id', type=int, nargs='?', help='Connection ID')
     
     # Check IP
     check_parser = subparsers.add_parser('check-ip', help='Check device IP')
-    check_parser.add_argument('serial', help='Device serial number')
+    check_parser.add_argument('serial', nargs='?', help='Device serial number')
     
     # Change IP
     change_parser = subparsers.add_parser('change-ip', help='Change device IP')
-    change_parser.add_argument('serial', help='Device serial number')
+    change_parser.add_argument('serial', nargs='?', help='Device serial number')
     change_parser.add_argument('--wait', type=int, default=5, help='Wait time between toggles')
     
+    # Single-target commands also take a tag selector instead of an id/serial
+    for command_parser in (start_parser, stop_parser, check_parser, change_parser):
+        command_parser.add_argument('--select', help='Act on all devices with these tags, '
+                                                     'e.g. carrier=tmobile,rack=3')
+        command_parser.add_argument('--parallel', type=int,
+                                    help='Number of devices to process at once with --select')
+        command_parser.add_argument('--timeout', type=float,
+                                    help='Per-device timeout in seconds with --select')
+    
+    # Tags
+    tag_parser = subparsers.add_parser('tag', help='Show, set or remove device tags')
+    tag_parser.add_argument('serial', help='Device serial number')
+    tag_parser.add_argument('tags', nargs='*', metavar='KEY=VALUE', help='Tags to set')
+    tag_parser.add_argument('--remove', action='append', default=[], metavar='KEY',
+                            help='Tag to remove (repeatable)')
+    
+    # Fleet-wide bulk actions
+    for name, help_text in (('start-all', 'Start all stopped connections'),
+                            ('stop-all', 'Stop all active connections'),
+                            ('check-all-ips', 'Check IPs of all connected devices')):
+        bulk_parser = subparsers.add_parser(name, help=help_text)
+        bulk_parser.add_argument('--parallel', type=int,
+                                 help='Number of items to process at once')
+        bulk_parser.add_argument('--timeout', type=float,
+                                 help='Per-item timeout in seconds')
+    
+    # Background jobs
+    job_parser = subparsers.add_parser('job', help='Submit and follow background jobs')
+    job_subparsers = job_parser.add_subparsers(dest='job_command', required=True)
+    submit_parser = job_subparsers.add_parser('submit', help='Submit an action as a background job')
+    submit_parser.add_argument('action', choices=list(SELECT_ACTIONS), help='Action to run')
+    submit_parser.add_argument('--select', help='Only devices with these tags, e.g. carrier=tmobile,rack=3')
+    submit_parser.add_argument('--serial', action='append', dest='serials', metavar='SERIAL',
+                               help='Only this device (repeatable; check-ip and change-ip)')
+    submit_parser.add_argument('--parallel', type=int,
+                               help='Number of items to process at once')
+    submit_parser.add_argument('--timeout', type=float,
+                               help='Per-item timeout in seconds')
+    submit_parser.add_argument('--wait', type=int, default=5, help='Wait time between toggles (change-ip)')
+    submit_parser.add_argument('--follow', action='store_true', help='Stream results until the job finishes')
+    status_parser = job_subparsers.add_parser('status', help='Show a job')
+    status_parser.add_argument('job_id', help='Job ID')
+    status_parser.add_argument('--results', action='store_true', help='Also list per-item results')
+    follow_parser = job_subparsers.add_parser('follow', help='Stream results until a job finishes')
+    follow_parser.add_argument('job_id', help='Job ID')
+    jobs_list_parser = job_subparsers.add_parser('list', help='List recent jobs')
+    jobs_list_parser.add_argument('--limit', type=int, default=20, help='Number of jobs to show')
+    
+    # Live dashboard
+    top_parser = subparsers.add_parser('top', help='Live connection dashboard')
+    top_parser.add_argument('--interval', type=float, default=1.0, help='Seconds between updates')
+    top_parser.add_argument('--once', action='store_true', help='Print one snapshot and exit')
+    
+    # Daemon
+    serve_parser = subparsers.add_parser('serve', help='Run the background daemon')
+    serve_parser.add_argument('--stop', action='store_true', help='Stop a running daemon')
+    serve_parser.add_argument('--http', metavar='[HOST:]PORT',
+                              help='Also serve the REST API, e.g. --http 8765 (localhost only) '
+                                   'or --http 0.0.0.0:8765')
+    serve_parser.add_argument('--http-token', default=os.environ.get('MOBILE_PROXY_API_TOKEN'),
+                              help='Require "Authorization: Bearer TOKEN" on API requests '
+                                   '(default: $MOBILE_PROXY_API_TOKEN)')
+    serve_parser.add_argument('--relay', choices=('asyncio', 'thread'),
+                              default=os.environ.get('MOBILE_PROXY_RELAY') or None,
+                              help='Relay proxy traffic through the daemon to measure throughput '
+                                   'and clients (default: $MOBILE_PROXY_RELAY; plain adb forwards '
+                                   'when unset)')
+    
+    # Profile a running daemon
+    profile_parser = subparsers.add_parser('profile', help='Sample the running daemon')
+    profile_parser.add_argument('action', choices=('start', 'stop'), help='Start or stop recording')
+    profile_parser.add_argument('--output', metavar='FILE',
+                                help='Output file name without extension (default profile-<time>)')
+    profile_parser.add_argument('--duration', type=float,
+                                help='With start: record this many seconds, then write the profile')
+    profile_parser.add_argument('--interval', type=float, help='Milliseconds between samples (default 5)')
+    
+    # Accept --json/--ndjson after the command name as well
+    command_parsers = dict(subparsers.choices)
+    command_parsers.update(('job ' + name, p) for name, p in job_subparsers.choices.items())
+    for name, command_parser in command_parsers.items():
+        if name not in ('interactive', 'serve', 'top', 'profile'):
+            command_parser.add_argument('--json', '--ndjson', dest='ndjson', action='store_true',
+                                        default=argparse.SUPPRESS,
+                                        help='Print results as newline-delimited JSON')
+    
     args = parser.parse_args()
     
+    # A daemon would do the work out of sight of the trace or profile
+    if args.trace or args.profile:
+        args.no_daemon = True
+    if args.trace:
+        import tracing
+        tracing.start(args.trace)
+    if args.profile:
+        import profiling
+        profiling.start(args.profile, args.profile_mode)
+    
     # Check if interactive mode is requested
     if args.interactive or args.command == 'interactive':
         cli = InteractiveCLI()
@@ -927,42 +1384,127 @@ Examples:
         parser.print_help()
         return 1
     
-    # Initialize components
-    db = Database()
-    adb = ADBManager()
-    proxy = ProxyManager(adb)
+    if args.command == 'profile':
+        return profile_command(args.socket, args.action, args.output, args.duration, args.interval)
+    
+    if args.command == 'serve':
+        try:
+            http = parse_http_address(args.http) if args.http else None
+        except ValueError:
+            parser.error(f"Invalid --http address: {args.http}")
+        return serve(args.socket, args.stop, http, args.http_token, args.relay)
+    
+    # Validate selectors before doing any work
+    selector = None
+    try:
+        if getattr(args, 'select', None) or args.command == 'tag':
+            from database import parse_selector
+        if getattr(args, 'select', None):
+            selector = parse_selector(args.select)
+        if args.command == 'tag':
+            tags = {}
+            for tag in args.tags:
+                tags.update(parse_selector(tag))
+            args.tags = {k: v or '' for k, v in tags.items()}
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.command == 'job' and args.job_command == 'submit' and args.serials \
+            and args.action not in ('check-ip', 'change-ip'):
+        parser.error("--serial is only supported for check-ip and change-ip jobs")
+    
+    if args.command in SELECT_ACTIONS:
+        target = args.connection_id if args.command in ('start', 'stop') else args.serial
+        if (target is None) == (selector is None):
+            target_name = 'a connection ID' if args.command in ('start', 'stop') else 'a serial'
+            parser.error(f"{args.command} needs either {target_name} or --select")
+    
+    # Commands that only read or write the database
+    db_only = args.command in DB_ONLY_COMMANDS or \
+        (args.command == 'job' and args.job_command in ('status', 'list'))
+    
+    # Use the daemon's warm state when one is running
+    client = None if args.no_daemon else proxy_daemon.connect(args.socket)
+    if client:
+        db = client.service('db')
+        adb = client.service('adb')
+        proxy = client.service('proxy')
+    else:
+        # Initialize only the components the command uses
+        from database import Database
+        
+        db = Database()
+        adb = proxy = None
+        if not db_only:
+            from adb_manager import ADBManager
+            from proxy_manager import ProxyManager
+            
+            adb = ADBManager()
+            proxy = ProxyManager(adb)
+    
+    if args.command == 'top':
+        # Needs no adb: latency comes from local TCP probes of the forwards
+        import top_view
+        return top_view.run(db, proxy, client, args.interval, args.once)
+    
+    out = NDJSONWriter() if args.ndjson else None
     
     # Check ADB availability
-    if not adb.check_adb_available():
-        print("Error: ADB is not installed or not in PATH")
+    needs_adb = args.command not in DB_ONLY_COMMANDS and \
+        not (args.command == 'job' and args.job_command != 'submit')
+    if needs_adb and not check_adb(adb, client):
+        if out:
+            out.emit('error', message="ADB is not installed or not in PATH")
+        else:
+            print("Error: ADB is not installed or not in PATH")
         return 1
     
     # Execute command
     try:
         if args.command == 'list-devices':
-            list_devices(adb)
+            list_devices(adb, out)
         
         elif args.command == 'list-connections':
-            list_connections(db)
+            list_connections(db, out, selector)
+        
+        elif args.command == 'job':
+            success = job_command(args, db, adb, proxy, client, out)
+            return 0 if success else 1
+        
+        elif args.command == 'tag':
+            tag_device(db, args.serial, args.tags, args.remove, out)
+        
+        elif selector and args.command in SELECT_ACTIONS:
+            success = bulk_action(SELECT_ACTIONS[args.command], db, adb, proxy, args.parallel,
+                                  args.timeout, client, out, selector, getattr(args, 'wait', 5))
+            return 0 if success else 1
         
         elif args.command == 'add':
-            success = add_connection(db, adb, args.serial, args.local_port, args.remote_port)
+            success = add_connection(db, adb, args.serial, args.local_port, args.remote_port, out)
             return 0 if success else 1
         
         elif args.command == 'start':
-            success = start_connection(db, proxy, args.connection_id)
+            success = start_connection(db, proxy, args.connection_id, out)
             return 0 if success else 1
         
         elif args.command == 'stop':
-            success = stop_connection(db, proxy, args.connection_id)
+            success = stop_connection(db, proxy, args.connection_id, out)
             return 0 if success else 1
         
         elif args.command == 'check-ip':
-            ip = check_ip(adb, args.serial)
+            ip = check_ip(adb, args.serial, out)
             return 0 if ip else 1
         
         elif args.command == 'change-ip':
-            success = change_ip(adb, args.serial, args.wait)
+            success = change_ip(adb, args.serial, args.wait, out)
+            if success and not client:
+                # The daemon records rotations itself
+                record_rotation(db, args.serial)
+            return 0 if success else 1
+        
+        elif args.command in ('start-all', 'stop-all', 'check-all-ips'):
+            action = args.command.replace('-', '_')
+            success = bulk_action(action, db, adb, proxy, args.parallel, args.timeout, client, out)
             return 0 if success else 1
         
         else:
@@ -970,10 +1512,16 @@ Examples:
             return 1
     
     except KeyboardInterrupt:
-        print("\nOperation cancelled")
+        if out:
+            out.emit('error', message="Operation cancelled")
+        else:
+            print("\nOperation cancelled")
         return 1
     except Exception as e:
-        print(f"Error: {e}")
+        if out:
+            out.emit('error', message=str(e))
+        else:
+            print(f"Error: {e}")
         return 1
     
     return 0
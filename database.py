@@ -1,10 +1,67 @@
 """
 Database module for managing device and connection configurations
 """
+import functools
 import sqlite3
 import json
 from datetime import datetime
 
+from metrics import DB_WRITE_SECONDS
+from tracing import traced
+
+
+# Column list shared by every query that returns connection rows
+CONNECTION_COLUMNS = '''
+    c.id, c.device_id, d.serial_number, c.local_port, c.remote_port,
+    c.status, c.current_ip, c.last_check
+'''
+
+DEVICE_COLUMNS = 'id, serial_number, model, android_version, status, last_seen'
+
+
+def parse_selector(text):
+    """Parse 'carrier=tmobile,rack=3' into {'carrier': 'tmobile', 'rack': '3'}
+    
+    A bare key (e.g. 'spare') matches any device that has that tag (see
+    Database.get_devices_by_tags). Raises ValueError for an empty key.
+    """
+    selector = {}
+    for part in text.split(','):
+        key, sep, value = part.partition('=')
+        key = key.strip()
+        if not key:
+            raise ValueError(f"Invalid selector: {text!r}")
+        selector[key] = value.strip() if sep else None
+    return selector
+
+
+def connection_record(row):
+    """Fields of a connection row (CONNECTION_COLUMNS) as a dict, for JSON output"""
+    conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = row
+    return {
+        'id': conn_id,
+        'device_id': device_id,
+        'serial': serial,
+        'local_port': local_port,
+        'remote_port': remote_port,
+        'status': status,
+        'current_ip': current_ip,
+        'last_check': last_check,
+    }
+
+
+def _timed_write(method):
+    """Record the latency of a write method in DB_WRITE_SECONDS under its
+    name, and trace it as a span"""
+    histogram = DB_WRITE_SECONDS.labels(operation=method.__name__)
+    method = traced(f'db.{method.__name__}', 'db')(method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return method(*args, **kwargs)
+    return wrapper
+
 
 class Database:
     def __init__(self, db_path='mobile_proxy.db'):
@@ -44,39 +101,214 @@ class Database:
             )
         ''')
         
+        # Device tags/groups, e.g. carrier=tmobile or rack=3; a bare tag has
+        # an empty value
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_tags (
+                device_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (device_id, key),
+                FOREIGN KEY (device_id) REFERENCES devices (id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Indexes backing the point lookups below
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connections_device_id ON connections (device_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connections_status ON connections (status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_device_tags_key_value ON device_tags (key, value)')
+        
         conn.commit()
         conn.close()
     
+    @_timed_write
     def add_device(self, serial_number, model='', android_version=''):
         """Add or update a device in the database"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # Upsert in place so the device keeps its id (and its connections)
         cursor.execute('''
-            INSERT OR REPLACE INTO devices (serial_number, model, android_version, last_seen)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO devices (serial_number, model, android_version, status, last_seen)
+            VALUES (?, ?, ?, 'connected', ?)
+            ON CONFLICT(serial_number) DO UPDATE SET
+                model = excluded.model,
+                android_version = excluded.android_version,
+                status = excluded.status,
+                last_seen = excluded.last_seen
         ''', (serial_number, model, android_version, datetime.now()))
         
-        device_id = cursor.lastrowid
-        if device_id == 0:  # Device already exists
-            cursor.execute('SELECT id FROM devices WHERE serial_number = ?', (serial_number,))
-            device_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM devices WHERE serial_number = ?', (serial_number,))
+        device_id = cursor.fetchone()[0]
         
         conn.commit()
         conn.close()
         return device_id
     
+    @_timed_write
+    def upsert_devices(self, devices):
+        """Add or update many devices in a single transaction
+        
+        Accepts an iterable of dicts as returned by
+        ADBManager.get_connected_devices() and returns a dict mapping
+        serial number to device id.
+        """
+        now = datetime.now()
+        rows = [
+            (device['serial'], device.get('model', ''), device.get('android_version', ''), now)
+            for device in devices
+        ]
+        if not rows:
+            return {}
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            INSERT INTO devices (serial_number, model, android_version, status, last_seen)
+            VALUES (?, ?, ?, 'connected', ?)
+            ON CONFLICT(serial_number) DO UPDATE SET
+                model = excluded.model,
+                android_version = excluded.android_version,
+                status = excluded.status,
+                last_seen = excluded.last_seen
+        ''', rows)
+        
+        serials = [row[0] for row in rows]
+        device_ids = {}
+        # Stay under SQLite's bound-parameter limit on very large racks
+        for start in range(0, len(serials), 500):
+            chunk = serials[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f'SELECT serial_number, id FROM devices WHERE serial_number IN ({placeholders})',
+                chunk
+            )
+            device_ids.update(cursor.fetchall())
+        
+        conn.commit()
+        conn.close()
+        return device_ids
+    
+    @traced('db.get_devices', 'db')
     def get_devices(self):
         """Get all devices"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('SELECT id, serial_number, model, android_version, status, last_seen FROM devices')
+        cursor.execute(f'SELECT {DEVICE_COLUMNS} FROM devices')
         devices = cursor.fetchall()
         
         conn.close()
         return devices
     
+    @traced('db.get_device_by_serial', 'db')
+    def get_device_by_serial(self, serial_number):
+        """Get a single device by serial number, or None"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT {DEVICE_COLUMNS} FROM devices WHERE serial_number = ?', (serial_number,))
+        device = cursor.fetchone()
+        
+        conn.close()
+        return device
+    
+    @_timed_write
+    def set_device_tags(self, device_id, tags):
+        """Set tags on a device from a {key: value} dict, replacing existing values"""
+        rows = [(device_id, key, '' if value is None else str(value)) for key, value in tags.items()]
+        if not rows:
+            return
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            INSERT INTO device_tags (device_id, key, value) VALUES (?, ?, ?)
+            ON CONFLICT(device_id, key) DO UPDATE SET value = excluded.value
+        ''', rows)
+        
+        conn.commit()
+        conn.close()
+    
+    @_timed_write
+    def remove_device_tags(self, device_id, keys):
+        """Remove tags from a device"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.executemany('DELETE FROM device_tags WHERE device_id = ? AND key = ?',
+                           [(device_id, key) for key in keys])
+        
+        conn.commit()
+        conn.close()
+    
+    @traced('db.get_device_tags', 'db')
+    def get_device_tags(self, device_id=None):
+        """Tags of one device as a dict, or of all devices as {device_id: {key: value}}"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        if device_id is not None:
+            cursor.execute('SELECT key, value FROM device_tags WHERE device_id = ?', (device_id,))
+            tags = dict(cursor.fetchall())
+        else:
+            cursor.execute('SELECT device_id, key, value FROM device_tags')
+            tags = {}
+            for tag_device_id, key, value in cursor.fetchall():
+                tags.setdefault(tag_device_id, {})[key] = value
+        
+        conn.close()
+        return tags
+    
+    @traced('db.get_devices_by_tags', 'db')
+    def get_devices_by_tags(self, selector):
+        """Get all devices matching every key/value pair of selector
+        
+        A value of None matches any device that has the key at all.
+        """
+        where, params = self._tag_filter(selector, 'id')
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT {DEVICE_COLUMNS} FROM devices WHERE {where}', params)
+        devices = cursor.fetchall()
+        
+        conn.close()
+        return devices
+    
+    def get_connections_by_tags(self, selector):
+        """Get all connections of devices matching selector (see get_devices_by_tags)"""
+        where, params = self._tag_filter(selector, 'c.device_id')
+        return self._query_connections(f'WHERE {where}', params)
+    
+    def _tag_filter(self, selector, column):
+        """WHERE condition limiting column (a device id) to devices matching selector"""
+        if not selector:
+            raise ValueError("Empty device selector")
+        
+        conditions = []
+        params = []
+        for key, value in selector.items():
+            if value is None:
+                conditions.append('key = ?')
+                params.append(key)
+            else:
+                conditions.append('(key = ? AND value = ?)')
+                params += [key, str(value)]
+        
+        # Every condition matches a different key of the primary key, so a
+        # device matches all of them exactly when it has len(selector) hits
+        where = f'''{column} IN (
+            SELECT device_id FROM device_tags
+            WHERE {' OR '.join(conditions)}
+            GROUP BY device_id
+            HAVING COUNT(*) = ?
+        )'''
+        return where, params + [len(selector)]
+    
+    @_timed_write
     def add_connection(self, device_id, local_port, remote_port):
         """Add a new connection"""
         conn = sqlite3.connect(self.db_path)
@@ -98,29 +330,46 @@ class Database:
     
     def get_connections(self, device_id=None):
         """Get all connections, optionally filtered by device_id"""
+        if device_id:
+            return self._query_connections('WHERE c.device_id = ?', (device_id,))
+        return self._query_connections()
+    
+    def get_connection(self, connection_id):
+        """Get a single connection by id, or None"""
+        rows = self._query_connections('WHERE c.id = ?', (connection_id,))
+        return rows[0] if rows else None
+    
+    def get_connection_by_port(self, local_port):
+        """Get the connection bound to a local port, or None"""
+        rows = self._query_connections('WHERE c.local_port = ?', (local_port,))
+        return rows[0] if rows else None
+    
+    def get_connections_by_serial(self, serial_number):
+        """Get all connections of the device with the given serial number"""
+        return self._query_connections('WHERE d.serial_number = ?', (serial_number,))
+    
+    def get_connections_by_status(self, status):
+        """Get all connections with the given status"""
+        return self._query_connections('WHERE c.status = ?', (status,))
+    
+    @traced('db.query_connections', 'db')
+    def _query_connections(self, where='', params=()):
+        """Run a connections/devices join with an optional WHERE clause"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        if device_id:
-            cursor.execute('''
-                SELECT c.id, c.device_id, d.serial_number, c.local_port, c.remote_port, 
-                       c.status, c.current_ip, c.last_check
-                FROM connections c
-                JOIN devices d ON c.device_id = d.id
-                WHERE c.device_id = ?
-            ''', (device_id,))
-        else:
-            cursor.execute('''
-                SELECT c.id, c.device_id, d.serial_number, c.local_port, c.remote_port, 
-                       c.status, c.current_ip, c.last_check
-                FROM connections c
-                JOIN devices d ON c.device_id = d.id
-            ''')
+        cursor.execute(f'''
+            SELECT {CONNECTION_COLUMNS}
+            FROM connections c
+            JOIN devices d ON c.device_id = d.id
+            {where}
+        ''', params)
         
         connections = cursor.fetchall()
         conn.close()
         return connections
     
+    @_timed_write
     def update_connection_status(self, connection_id, status, ip=None):
         """Update connection status and IP"""
         conn = sqlite3.connect(self.db_path)
@@ -142,6 +391,51 @@ class Database:
         conn.commit()
         conn.close()
     
+    @_timed_write
+    def update_connection_statuses(self, updates):
+        """Update status (and optionally IP) of many connections in one transaction
+        
+        Accepts an iterable of (connection_id, status), (connection_id,
+        status, ip) or (connection_id, status, ip, last_check) tuples. As with
+        update_connection_status, the IP and last_check are only touched when
+        an IP is given; last_check defaults to the current time.
+        """
+        now = datetime.now()
+        with_ip = []
+        without_ip = []
+        for update in updates:
+            connection_id, status = update[0], update[1]
+            ip = update[2] if len(update) > 2 else None
+            if ip:
+                last_check = update[3] if len(update) > 3 and update[3] else now
+                with_ip.append((status, ip, last_check, connection_id))
+            else:
+                without_ip.append((status, connection_id))
+        
+        if not with_ip and not without_ip:
+            return 0
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        if with_ip:
+            cursor.executemany('''
+                UPDATE connections 
+                SET status = ?, current_ip = ?, last_check = ?
+                WHERE id = ?
+            ''', with_ip)
+        if without_ip:
+            cursor.executemany('''
+                UPDATE connections 
+                SET status = ?
+                WHERE id = ?
+            ''', without_ip)
+        
+        conn.commit()
+        conn.close()
+        return len(with_ip) + len(without_ip)
+    
+    @_timed_write
     def delete_connection(self, connection_id):
         """Delete a connection"""
         conn = sqlite3.connect(self.db_path)
@@ -152,12 +446,14 @@ class Database:
         conn.commit()
         conn.close()
     
+    @_timed_write
     def delete_device(self, device_id):
         """Delete a device and all its connections"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('DELETE FROM connections WHERE device_id = ?', (device_id,))
+        cursor.execute('DELETE FROM device_tags WHERE device_id = ?', (device_id,))
         cursor.execute('DELETE FROM devices WHERE id = ?', (device_id,))
         
         conn.commit()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Minimal `adb` command line client for adb_simulator.py
+
+Covers the commands ADBManager runs (version, devices, get-state, shell,
+forward, kill-server) and talks to the server on ANDROID_ADB_SERVER_PORT
+(or -P/-H). Kept to the standard library and a handful of imports so each
+invocation starts about as fast as the real adb.
+"""
+import os
+import shlex
+import socket
+import sys
+
+
+class AdbError(Exception):
+    """The server answered FAIL, or could not be reached"""
+
+
+class _Connection:
+    """One request to the adb server"""
+
+    def __init__(self, host, port):
+        try:
+            self.sock = socket.create_connection((host, port))
+        except OSError as e:
+            raise AdbError(f"cannot connect to daemon at tcp:{host}:{port}: {e.strerror or e}")
+        self.file = self.sock.makefile('rb')
+
+    def send(self, request):
+        data = request.encode()
+        self.sock.sendall(f'{len(data):04x}'.encode() + data)
+        self.status()
+
+    def status(self):
+        status = self.file.read(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbError(self.prefixed())
+        raise AdbError(f"protocol fault (status {status!r})")
+
+    def prefixed(self):
+        header = self.file.read(4)
+        if len(header) < 4:
+            raise AdbError("protocol fault (no length)")
+        return self.file.read(int(header, 16)).decode()
+
+    def rest(self):
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def _usage():
+    print("usage: adb [-s SERIAL] [-H HOST] [-P PORT] "
+          "{version|devices [-l]|get-state|shell CMD...|forward ...|kill-server}", file=sys.stderr)
+    return 1
+
+
+def main(argv):
+    host = os.environ.get('ANDROID_ADB_SERVER_ADDRESS', '127.0.0.1')
+    port = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+    serial = os.environ.get('ANDROID_SERIAL')
+
+    args = list(argv)
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option in ('-s', '-H', '-P') and not args:
+            return _usage()
+        if option == '-s':
+            serial = args.pop(0)
+        elif option == '-H':
+            host = args.pop(0)
+        elif option == '-P':
+            port = int(args.pop(0))
+        elif option not in ('-d', '-e'):
+            return _usage()
+    if not args:
+        return _usage()
+    command, rest = args[0], args[1:]
+    prefix = f'host-serial:{serial}:' if serial else 'host:'
+
+    conn = _Connection(host, port)
+    try:
+        if command == 'version':
+            conn.send('host:version')
+            print(f"Android Debug Bridge version 1.0.{int(conn.prefixed(), 16)}")
+            print("Version simulated")
+            print(f"Installed as {os.path.abspath(__file__)}")
+        elif command == 'devices':
+            conn.send('host:devices-l' if '-l' in rest else 'host:devices')
+            print("List of devices attached")
+            sys.stdout.write(conn.prefixed())
+            print()
+        elif command == 'get-state':
+            conn.send(f'{prefix}get-state')
+            print(conn.prefixed())
+        elif command == 'shell':
+            conn.send(f'host:transport:{serial}' if serial else 'host:transport-any')
+            conn.send('shell:' + ' '.join(rest if len(rest) == 1 else map(shlex.quote, rest)))
+            sys.stdout.buffer.write(conn.rest())
+        elif command == 'forward':
+            if rest == ['--list']:
+                conn.send(f'{prefix}list-forward')
+                sys.stdout.write(conn.prefixed())
+            elif rest == ['--remove-all']:
+                conn.send(f'{prefix}killforward-all')
+                conn.status()
+            elif len(rest) == 2 and rest[0] == '--remove':
+                conn.send(f'{prefix}killforward:{rest[1]}')
+                conn.status()
+            elif len(rest) == 2 or (len(rest) == 3 and rest[0] == '--no-rebind'):
+                local, remote = rest[-2:]
+                norebind = 'norebind:' if len(rest) == 3 else ''
+                conn.send(f'{prefix}forward:{norebind}{local};{remote}')
+                conn.status()
+                if local == 'tcp:0':
+                    print(conn.prefixed())
+            else:
+                return _usage()
+        elif command == 'kill-server':
+            conn.send('host:kill')
+        elif command == 'start-server':
+            pass
+        else:
+            return _usage()
+    except AdbError as e:
+        print(f"adb: error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except AdbError as e:
+        print(f"adb: error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,364 @@
+"""
+In-memory fleet state with change notifications, layered on top of Database
+"""
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+
+
+# type is one of the *_ADDED/*_REMOVED/*_CHANGED constants below; key is the
+# device or connection id; old/new are rows in Database format (None when the
+# row did not exist before or no longer exists).
+FleetEvent = namedtuple('FleetEvent', ['type', 'key', 'old', 'new'])
+
+DEVICE_ADDED = 'device_added'
+DEVICE_REMOVED = 'device_removed'
+DEVICE_CHANGED = 'device_changed'
+CONNECTION_ADDED = 'connection_added'
+CONNECTION_REMOVED = 'connection_removed'
+CONNECTION_STATUS_CHANGED = 'connection_status_changed'
+CONNECTION_IP_CHANGED = 'connection_ip_changed'
+CONNECTION_CHANGED = 'connection_changed'
+
+# Column positions in Database connection rows
+CONN_ID, CONN_DEVICE_ID, CONN_SERIAL, CONN_LOCAL_PORT, CONN_REMOTE_PORT, \
+    CONN_STATUS, CONN_IP, CONN_LAST_CHECK = range(8)
+
+
+class FleetState:
+    """Read-through cache of devices and connections
+
+    Rows are kept in the same tuple format Database returns, indexed by id,
+    serial number and local port, so readers can use a FleetState wherever
+    they used a Database. Writes go to the database (or to status_writer,
+    e.g. a StatusWriteBuffer, for status updates) and are applied to the cache
+    straight away. refresh() reloads from SQLite to pick up changes made by
+    other processes. Every difference is published to subscribers as a
+    FleetEvent, so consumers can react to deltas instead of re-rendering
+    everything. Events reach subscribers in the order the cache changed.
+    """
+
+    def __init__(self, db, status_writer=None):
+        self.db = db
+        self.status_writer = status_writer or db
+        self.lock = threading.RLock()
+        self.subscribers = []
+        # Events queued under self.lock, delivered in order under publish_lock
+        self.pending_events = deque()
+        self.publish_lock = threading.RLock()
+        self.delivering = False
+
+        self.devices = {}
+        self.device_by_serial = {}
+        self.connections = {}
+        self.connection_by_port = {}
+        self.connections_by_device = {}
+
+        self.refresh()
+
+    # Subscriptions
+    def subscribe(self, callback, event_types=None):
+        """Call callback(event) for every FleetEvent, optionally filtered by type"""
+        types = frozenset(event_types) if event_types else None
+        with self.lock:
+            self.subscribers.append((callback, types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop delivering events to callback"""
+        with self.lock:
+            self.subscribers = [(cb, types) for cb, types in self.subscribers if cb != callback]
+
+    def _queue(self, events):
+        """Queue events for delivery; call with self.lock held, so the queue
+        follows the order in which the cache changed"""
+        self.pending_events.extend(events)
+        return events
+
+    def _publish(self):
+        """Deliver queued events outside the cache lock
+
+        Writers on other threads wait on publish_lock rather than racing the
+        delivery in progress, so subscribers see events in queue order. A
+        subscriber that writes to the fleet only queues its events; the loop
+        already running on this thread delivers them next. A failing
+        subscriber does not stop the others.
+        """
+        with self.publish_lock:
+            if self.delivering:
+                return
+            self.delivering = True
+            try:
+                while True:
+                    with self.lock:
+                        if not self.pending_events:
+                            return
+                        event = self.pending_events.popleft()
+                        subscribers = list(self.subscribers)
+                    for callback, types in subscribers:
+                        if types is None or event.type in types:
+                            try:
+                                callback(event)
+                            except Exception as e:
+                                print(f"Error in fleet subscriber: {e}")
+            finally:
+                self.delivering = False
+
+    # Loading
+    def refresh(self):
+        """Reload devices and connections from the database and publish the differences"""
+        devices = self.db.get_devices()
+        reader = self.status_writer if hasattr(self.status_writer, 'get_connections') else self.db
+        connections = reader.get_connections()
+
+        with self.lock:
+            events = self._sync_devices(devices)
+            events += self._sync_connections(connections)
+            self._queue(events)
+        self._publish()
+        return events
+
+    def refresh_devices(self):
+        """Reload only the devices table"""
+        devices = self.db.get_devices()
+        with self.lock:
+            events = self._queue(self._sync_devices(devices))
+        self._publish()
+        return events
+
+    def _sync_devices(self, rows):
+        """Replace the device cache with rows and describe the differences"""
+        events = []
+        seen = set()
+        for row in rows:
+            device_id = row[0]
+            seen.add(device_id)
+            old = self.devices.get(device_id)
+            if old == row:
+                continue
+            self._store_device(row)
+            events.append(FleetEvent(DEVICE_CHANGED if old else DEVICE_ADDED, device_id, old, row))
+
+        for device_id in [d for d in self.devices if d not in seen]:
+            events.append(FleetEvent(DEVICE_REMOVED, device_id, self._drop_device(device_id), None))
+        return events
+
+    def _sync_connections(self, rows):
+        """Replace the connection cache with rows and describe the differences"""
+        events = []
+        seen = set()
+        for row in rows:
+            seen.add(row[CONN_ID])
+            events += self._apply_connection(row)
+
+        for connection_id in [c for c in self.connections if c not in seen]:
+            old = self._drop_connection(connection_id)
+            events.append(FleetEvent(CONNECTION_REMOVED, connection_id, old, None))
+        return events
+
+    def _store_device(self, row):
+        """Store a device row and keep the serial index in step"""
+        old = self.devices.get(row[0])
+        if old and old[1] != row[1]:
+            self.device_by_serial.pop(old[1], None)
+        self.devices[row[0]] = row
+        self.device_by_serial[row[1]] = row[0]
+
+    def _drop_device(self, device_id):
+        """Remove a device from the cache and return its row"""
+        row = self.devices.pop(device_id)
+        self.device_by_serial.pop(row[1], None)
+        return row
+
+    def _apply_connection(self, row):
+        """Store a connection row and describe how it changed"""
+        connection_id = row[CONN_ID]
+        old = self.connections.get(connection_id)
+        if old == row:
+            return []
+
+        if old:
+            self.connection_by_port.pop(old[CONN_LOCAL_PORT], None)
+            self.connections_by_device.get(old[CONN_DEVICE_ID], set()).discard(connection_id)
+        self.connections[connection_id] = row
+        self.connection_by_port[row[CONN_LOCAL_PORT]] = connection_id
+        self.connections_by_device.setdefault(row[CONN_DEVICE_ID], set()).add(connection_id)
+
+        if old is None:
+            return [FleetEvent(CONNECTION_ADDED, connection_id, None, row)]
+
+        events = []
+        if old[CONN_STATUS] != row[CONN_STATUS]:
+            events.append(FleetEvent(CONNECTION_STATUS_CHANGED, connection_id, old, row))
+        if old[CONN_IP] != row[CONN_IP]:
+            events.append(FleetEvent(CONNECTION_IP_CHANGED, connection_id, old, row))
+        if not events:
+            events.append(FleetEvent(CONNECTION_CHANGED, connection_id, old, row))
+        return events
+
+    def _drop_connection(self, connection_id):
+        """Remove a connection from the cache and return its row"""
+        row = self.connections.pop(connection_id)
+        if self.connection_by_port.get(row[CONN_LOCAL_PORT]) == connection_id:
+            del self.connection_by_port[row[CONN_LOCAL_PORT]]
+        self.connections_by_device.get(row[CONN_DEVICE_ID], set()).discard(connection_id)
+        return row
+
+    # Reads (same row formats as Database)
+    def get_devices(self):
+        """Get all devices"""
+        with self.lock:
+            return list(self.devices.values())
+
+    def get_device(self, device_id):
+        """Get a device by id, or None"""
+        with self.lock:
+            return self.devices.get(device_id)
+
+    def get_device_by_serial(self, serial_number):
+        """Get a device by serial number, or None"""
+        with self.lock:
+            device_id = self.device_by_serial.get(serial_number)
+            return self.devices.get(device_id) if device_id is not None else None
+
+    def get_connections(self, device_id=None):
+        """Get all connections, optionally filtered by device_id"""
+        with self.lock:
+            if device_id:
+                ids = sorted(self.connections_by_device.get(device_id, ()))
+                return [self.connections[c] for c in ids]
+            return list(self.connections.values())
+
+    def get_connection(self, connection_id):
+        """Get a connection by id, or None"""
+        with self.lock:
+            return self.connections.get(connection_id)
+
+    def get_connection_by_port(self, local_port):
+        """Get the connection bound to a local port, or None"""
+        with self.lock:
+            connection_id = self.connection_by_port.get(local_port)
+            return self.connections.get(connection_id) if connection_id is not None else None
+
+    def get_connections_by_serial(self, serial_number):
+        """Get all connections of the device with the given serial number"""
+        with self.lock:
+            device_id = self.device_by_serial.get(serial_number)
+            if device_id is None:
+                return []
+            return self.get_connections(device_id)
+
+    def get_connections_by_status(self, status):
+        """Get all connections with the given status"""
+        with self.lock:
+            return [row for row in self.connections.values() if row[CONN_STATUS] == status]
+
+    # Tags are not cached; selections go straight to the indexed tag table
+    def get_device_tags(self, device_id=None):
+        """Tags of one device, or of all devices"""
+        return self.db.get_device_tags(device_id)
+
+    def get_devices_by_tags(self, selector):
+        """Get all devices matching selector"""
+        return self.db.get_devices_by_tags(selector)
+
+    def get_connections_by_tags(self, selector):
+        """Get all connections of devices matching selector, as cached rows"""
+        rows = self.db.get_connections_by_tags(selector)
+        with self.lock:
+            return [self.connections.get(row[CONN_ID], row) for row in rows]
+
+    def set_device_tags(self, device_id, tags):
+        """Set tags on a device"""
+        self.db.set_device_tags(device_id, tags)
+
+    def remove_device_tags(self, device_id, keys):
+        """Remove tags from a device"""
+        self.db.remove_device_tags(device_id, keys)
+
+    # Writes
+    def upsert_devices(self, devices):
+        """Upsert devices in the database and pick up the resulting rows"""
+        device_ids = self.db.upsert_devices(devices)
+        self.refresh_devices()
+        return device_ids
+
+    def add_device(self, serial_number, model='', android_version=''):
+        """Add or update a device and pick up the resulting row"""
+        device_id = self.db.add_device(serial_number, model, android_version)
+        self.refresh_devices()
+        return device_id
+
+    def add_connection(self, device_id, local_port, remote_port):
+        """Add a new connection"""
+        connection_id = self.db.add_connection(device_id, local_port, remote_port)
+        if connection_id:
+            row = self.db.get_connection(connection_id)
+            if row:
+                with self.lock:
+                    self._queue(self._apply_connection(row))
+                self._publish()
+        return connection_id
+
+    def update_connection_status(self, connection_id, status, ip=None):
+        """Update connection status and IP"""
+        self.status_writer.update_connection_status(connection_id, status, ip)
+
+        with self.lock:
+            old = self.connections.get(connection_id)
+            if old is None:
+                return
+            if ip:
+                row = old[:CONN_STATUS] + (status, ip, str(datetime.now()))
+            else:
+                row = old[:CONN_STATUS] + (status,) + old[CONN_IP:]
+            self._queue(self._apply_connection(row))
+        self._publish()
+
+    def update_connection_statuses(self, updates):
+        """Update status (and optionally IP) of many connections in one transaction"""
+        updates = list(updates)
+        if hasattr(self.status_writer, 'update_connection_statuses'):
+            self.status_writer.update_connection_statuses(updates)
+        else:
+            for update in updates:
+                self.status_writer.update_connection_status(*update[:3])
+
+        now = str(datetime.now())
+        with self.lock:
+            for update in updates:
+                connection_id, status = update[0], update[1]
+                ip = update[2] if len(update) > 2 else None
+                old = self.connections.get(connection_id)
+                if old is None:
+                    continue
+                if ip:
+                    row = old[:CONN_STATUS] + (status, ip, now)
+                else:
+                    row = old[:CONN_STATUS] + (status,) + old[CONN_IP:]
+                self._queue(self._apply_connection(row))
+        self._publish()
+        return len(updates)
+
+    def delete_connection(self, connection_id):
+        """Delete a connection"""
+        self.db.delete_connection(connection_id)
+        with self.lock:
+            if connection_id in self.connections:
+                old = self._drop_connection(connection_id)
+                self._queue([FleetEvent(CONNECTION_REMOVED, connection_id, old, None)])
+        self._publish()
+
+    def delete_device(self, device_id):
+        """Delete a device and all its connections"""
+        self.db.delete_device(device_id)
+        with self.lock:
+            events = []
+            for connection_id in sorted(self.connections_by_device.pop(device_id, ())):
+                if connection_id in self.connections:
+                    old = self._drop_connection(connection_id)
+                    events.append(FleetEvent(CONNECTION_REMOVED, connection_id, old, None))
+            if device_id in self.devices:
+                events.append(FleetEvent(DEVICE_REMOVED, device_id, self._drop_device(device_id), None))
+            self._queue(events)
+        self._publish()
@@ -0,0 +1,591 @@
+"""
+Background jobs for long-running fleet actions
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import bulk_ops
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Action name: (bulk_ops target, accepted parameters)
+ACTIONS = {
+    'start_all': ('proxy', ('parallel', 'timeout', 'selector', 'connection_ids')),
+    'stop_all': ('proxy', ('parallel', 'timeout', 'selector', 'connection_ids')),
+    'check_all_ips': ('adb', ('parallel', 'timeout', 'selector', 'serials')),
+    'change_all_ips': ('adb', ('parallel', 'timeout', 'selector', 'serials', 'wait_time')),
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_parallel(value):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f"parallel must be an integer of at least 1, not {value!r}")
+
+
+def _check_seconds(name):
+    def check(value):
+        if value is not None and not (_is_number(value) and math.isfinite(value) and value >= 0):
+            raise ValueError(f"{name} must be a number of seconds, not {value!r}")
+    return check
+
+
+def _check_list(name, kind, kind_name):
+    def check(value):
+        if value is not None and (not isinstance(value, list)
+                                  or not all(isinstance(v, kind) and not isinstance(v, bool) for v in value)):
+            raise ValueError(f"{name} must be a list of {kind_name}")
+    return check
+
+
+def _check_selector(value):
+    if value is None:
+        return
+    if not isinstance(value, dict) or not all(
+            isinstance(k, str) and (v is None or isinstance(v, str) or _is_number(v)) for k, v in value.items()):
+        raise ValueError("selector must map tag names to strings, numbers or null")
+
+
+# Parameter name: check raising ValueError for a bad value
+PARAM_CHECKS = {
+    'parallel': _check_parallel,
+    'timeout': _check_seconds('timeout'),
+    'wait_time': _check_seconds('wait_time'),
+    'selector': _check_selector,
+    'serials': _check_list('serials', str, 'serial numbers'),
+    'connection_ids': _check_list('connection_ids', int, 'connection ids'),
+}
+
+
+def check_params(action, params):
+    """Validate an action and its parameters; returns the parameters as a new dict
+
+    Raises ValueError for an unknown action or an unsupported or malformed
+    parameter, so bad requests fail before anything is queued.
+    """
+    if not isinstance(action, str) or action not in ACTIONS:
+        raise ValueError(f"Unknown job action: {action}")
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    unknown = set(params) - set(ACTIONS[action][1])
+    if unknown:
+        raise ValueError(f"Unsupported parameters for {action}: {', '.join(sorted(map(str, unknown)))}")
+    for name, value in params.items():
+        PARAM_CHECKS[name](value)
+    return dict(params)
+
+
+# Fields of a stored result that are not kept in its 'extra' column
+RESULT_FIELDS = ('index', 'total', 'ok', 'status', 'message', 'elapsed', 'item')
+
+
+def _process_alive(pid):
+    """Whether a process with this pid is running (assumed so where it cannot be checked)"""
+    if not pid:
+        return False
+    if pid == os.getpid() or os.name == 'nt':
+        # On Windows os.kill(pid, 0) would send CTRL_C_EVENT
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # EPERM: it exists but belongs to another user
+        return True
+    return True
+
+
+class JobStore:
+    """Job records and per-item results stored next to the main database"""
+
+    def __init__(self, db):
+        self.db_path = db.db_path
+        self.init_tables()
+
+    def init_tables(self):
+        """Create the job tables"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                action TEXT NOT NULL,
+                params TEXT,
+                state TEXT NOT NULL,
+                total INTEGER,
+                done INTEGER NOT NULL DEFAULT 0,
+                ok INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                summary TEXT,
+                error TEXT,
+                owner INTEGER
+            )
+        ''')
+        # Tables created before jobs recorded the pid running them
+        cursor.execute('PRAGMA table_info(jobs)')
+        if 'owner' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                ok INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                message TEXT,
+                elapsed REAL,
+                item TEXT,
+                extra TEXT,
+                PRIMARY KEY (job_id, idx)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)')
+
+        conn.commit()
+        conn.close()
+
+    def save_job(self, job):
+        """Insert or update a job record (a dict as returned by Job.to_dict)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO jobs (id, action, params, state, total, done, ok,
+                              created_at, started_at, finished_at, summary, error, owner)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                state = excluded.state,
+                total = excluded.total,
+                done = excluded.done,
+                ok = excluded.ok,
+                started_at = excluded.started_at,
+                finished_at = excluded.finished_at,
+                summary = excluded.summary,
+                error = excluded.error
+        ''', (job['id'], job['action'], json.dumps(job['params']), job['state'], job['total'],
+              job['done'], job['ok'], job['created_at'], job['started_at'], job['finished_at'],
+              json.dumps(job['summary']) if job['summary'] is not None else None, job['error'],
+              job.get('owner')))
+
+        conn.commit()
+        conn.close()
+
+    def add_results(self, job_id, results):
+        """Store per-item results of a job in one transaction"""
+        rows = [
+            (job_id, r['index'], int(r['ok']), r['status'], r['message'], r['elapsed'],
+             json.dumps(r['item']),
+             json.dumps({k: v for k, v in r.items() if k not in RESULT_FIELDS}))
+            for r in results
+        ]
+        if not rows:
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO job_results (job_id, idx, ok, status, message, elapsed, item, extra)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+        conn.commit()
+        conn.close()
+
+    def get_job(self, job_id):
+        """Get a job record as a dict, or None"""
+        rows = self._query_jobs('WHERE id = ?', (job_id,))
+        return rows[0] if rows else None
+
+    def list_jobs(self, limit=20):
+        """Most recent job records, newest first"""
+        return self._query_jobs('ORDER BY created_at DESC LIMIT ?', (limit,))
+
+    def _query_jobs(self, clause, params):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT id, action, params, state, total, done, ok,
+                   created_at, started_at, finished_at, summary, error, owner
+            FROM jobs {clause}
+        ''', params)
+        rows = cursor.fetchall()
+
+        conn.close()
+        return [{
+            'id': row[0], 'action': row[1], 'params': json.loads(row[2] or '{}'),
+            'state': row[3], 'total': row[4], 'done': row[5], 'ok': row[6],
+            'created_at': row[7], 'started_at': row[8], 'finished_at': row[9],
+            'summary': json.loads(row[10]) if row[10] else None, 'error': row[11],
+            'owner': row[12],
+        } for row in rows]
+
+    def get_results(self, job_id, after=0):
+        """Stored results of a job with index greater than after, in order"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT r.idx, r.ok, r.status, r.message, r.elapsed, r.item, r.extra, j.total
+            FROM job_results r JOIN jobs j ON j.id = r.job_id
+            WHERE r.job_id = ? AND r.idx > ?
+            ORDER BY r.idx
+        ''', (job_id, after))
+        rows = cursor.fetchall()
+
+        conn.close()
+        results = []
+        for idx, ok, status, message, elapsed, item, extra, total in rows:
+            result = {'index': idx, 'total': total, 'ok': bool(ok), 'status': status,
+                      'message': message, 'elapsed': elapsed, 'item': json.loads(item)}
+            result.update(json.loads(extra or '{}'))
+            results.append(result)
+        return results
+
+    def fail_orphaned(self, job_id=None):
+        """Mark queued or running jobs whose process has exited as failed
+
+        Covers jobs left behind by a crashed or killed process; pass job_id
+        to check a single job. Returns the ids of the jobs marked failed.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        clause, params = 'WHERE state IN (?, ?)', [JOB_QUEUED, JOB_RUNNING]
+        if job_id is not None:
+            clause += ' AND id = ?'
+            params.append(job_id)
+        cursor.execute(f'SELECT id, owner FROM jobs {clause}', params)
+        orphaned = [row[0] for row in cursor.fetchall() if not _process_alive(row[1])]
+
+        cursor.executemany('''
+            UPDATE jobs SET state = ?, error = ?, finished_at = ?
+            WHERE id = ? AND state IN (?, ?)
+        ''', [(JOB_FAILED, 'Interrupted: the process running it exited', time.time(), orphaned_id,
+               JOB_QUEUED, JOB_RUNNING) for orphaned_id in orphaned])
+
+        conn.commit()
+        conn.close()
+        return orphaned
+
+    def prune(self, max_age):
+        """Delete finished jobs (and their results) older than max_age seconds"""
+        cutoff = time.time() - max_age
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            DELETE FROM job_results WHERE job_id IN (
+                SELECT id FROM jobs WHERE state IN (?, ?) AND finished_at < ?
+            )
+        ''', (JOB_FINISHED, JOB_FAILED, cutoff))
+        cursor.execute('DELETE FROM jobs WHERE state IN (?, ?) AND finished_at < ?',
+                       (JOB_FINISHED, JOB_FAILED, cutoff))
+        deleted = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return deleted
+
+
+class Job:
+    """A submitted action and its progress"""
+
+    def __init__(self, action, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.action = action
+        self.params = params
+        self.state = JOB_QUEUED
+        self.total = None
+        self.results = []
+        self.ok = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.summary = None
+        self.error = None
+        self.owner = os.getpid()
+        self.stored = 0
+
+    @property
+    def finished(self):
+        return self.state in (JOB_FINISHED, JOB_FAILED)
+
+    def to_dict(self):
+        """Plain-dict view, also the format JobStore returns"""
+        return {
+            'id': self.id, 'action': self.action, 'params': self.params, 'state': self.state,
+            'total': self.total, 'done': len(self.results), 'ok': self.ok,
+            'created_at': self.created_at, 'started_at': self.started_at,
+            'finished_at': self.finished_at, 'summary': self.summary, 'error': self.error,
+            'owner': self.owner,
+        }
+
+
+class JobManager:
+    """Runs fleet actions in the background and tracks their progress
+
+    submit() returns a job id straight away. Jobs are coordinated by up to
+    max_jobs threads, while the per-device work of every job runs on one
+    shared pool of max_workers threads; each job still limits itself to its
+    own `parallel` setting, so one large job cannot starve the others.
+    Progress and results are kept in memory for jobs of this process and
+    written to the JobStore (about once a second while running), so they can
+    be polled with get_job()/get_results() or streamed with follow(), also
+    from other processes. Jobs a crashed process left queued or running in
+    the store are marked failed on startup.
+    """
+
+    def __init__(self, db, adb, proxy, store=None, max_workers=32, max_jobs=16,
+                 on_result=None, keep_finished=200, flush_interval=1.0):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.targets = {'adb': adb, 'proxy': proxy}
+        self.db = db
+        self.store = store
+        self.on_result = on_result
+        self.keep_finished = keep_finished
+        self.flush_interval = flush_interval
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-item')
+        self.coordinators = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+        self.jobs = {}
+        self.changed = threading.Condition()
+        self.listeners = []
+
+        if store:
+            try:
+                orphaned = store.fail_orphaned()
+            except sqlite3.Error as e:
+                print(f"Error recovering interrupted jobs: {e}")
+            else:
+                if orphaned:
+                    print(f"Marked {len(orphaned)} interrupted job(s) as failed")
+
+    def submit(self, action, params=None):
+        """Queue an action and return its job id
+
+        params may contain the bulk_ops arguments accepted by the action
+        (see ACTIONS), e.g. {'selector': {'rack': '3'}, 'parallel': 20}.
+        """
+        params = check_params(action, params)
+
+        job = Job(action, params)
+        with self.changed:
+            self.jobs[job.id] = job
+            self._forget_finished()
+        if self.store:
+            self.store.save_job(job.to_dict())
+        self.coordinators.submit(self._run, job)
+        return job.id
+
+    def add_listener(self, callback):
+        """Call callback(job_id, kind, data) for job events in this process
+
+        kind is 'result' (data is a result dict) or 'job' (data is the job
+        record, sent when the job starts and when it finishes). Callbacks run
+        on job threads and must not block.
+        """
+        with self.changed:
+            self.listeners.append(callback)
+        return callback
+
+    def remove_listener(self, callback):
+        """Stop delivering job events to callback"""
+        with self.changed:
+            self.listeners = [cb for cb in self.listeners if cb != callback]
+
+    def _notify(self, job_id, kind, data):
+        with self.changed:
+            listeners = list(self.listeners)
+        for callback in listeners:
+            try:
+                callback(job_id, kind, data)
+            except Exception as e:
+                print(f"Error in job listener: {e}")
+
+    def _forget_finished(self):
+        """Drop the oldest finished jobs from memory (they stay in the store)"""
+        finished = [j for j in self.jobs.values() if j.finished]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:-self.keep_finished or None]:
+            if self.store:
+                del self.jobs[job.id]
+
+    def _run(self, job):
+        target_name, _ = ACTIONS[job.action]
+        func = getattr(bulk_ops, job.action)
+        last_flush = time.monotonic()
+
+        def on_result(result):
+            nonlocal last_flush
+            with self.changed:
+                job.results.append(result)
+                job.total = result['total']
+                job.ok += result['ok']
+                self.changed.notify_all()
+            if self.on_result:
+                try:
+                    self.on_result(job, result)
+                except Exception as e:
+                    print(f"Error in job result hook: {e}")
+            self._notify(job.id, 'result', result)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._flush(job)
+                last_flush = time.monotonic()
+
+        with self.changed:
+            # Marked interrupted by shutdown() while still queued
+            if job.finished:
+                return
+            job.state = JOB_RUNNING
+            job.started_at = time.time()
+            record = job.to_dict()
+        self._save(job)
+        self._notify(job.id, 'job', record)
+
+        try:
+            results, summary = func(self.db, self.targets[target_name], on_result=on_result,
+                                    executor=self.executor, **job.params)
+            with self.changed:
+                job.total = summary['total']
+                job.summary = summary
+                # Keep the record of a job shutdown() interrupted as it is
+                if not job.finished:
+                    job.state = JOB_FINISHED
+        except Exception as e:
+            with self.changed:
+                if not job.finished:
+                    job.error = str(e)
+                    job.state = JOB_FAILED
+        finally:
+            job.finished_at = job.finished_at or time.time()
+            self._flush(job)
+            self._save(job)
+            with self.changed:
+                self.changed.notify_all()
+                record = job.to_dict()
+            self._notify(job.id, 'job', record)
+
+    def _flush(self, job):
+        """Write results not yet in the store"""
+        if not self.store:
+            return
+        with self.changed:
+            pending = job.results[job.stored:]
+            job.stored = len(job.results)
+        try:
+            self.store.add_results(job.id, pending)
+        except sqlite3.Error as e:
+            print(f"Error storing job results: {e}")
+
+    def _save(self, job):
+        if not self.store:
+            return
+        with self.changed:
+            record = job.to_dict()
+        try:
+            self.store.save_job(record)
+        except sqlite3.Error as e:
+            print(f"Error storing job {job.id}: {e}")
+
+    # Queries
+    def get_job(self, job_id):
+        """Job record as a dict, or None"""
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job:
+                return job.to_dict()
+        return self.store.get_job(job_id) if self.store else None
+
+    def get_results(self, job_id, after=0):
+        """Results of a job with index greater than after, in order"""
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job:
+                return job.results[after:]
+        return self.store.get_results(job_id, after) if self.store else []
+
+    def list_jobs(self, limit=20):
+        """Most recent jobs, newest first"""
+        if self.store:
+            return self.store.list_jobs(limit)
+        with self.changed:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.created_at, reverse=True)
+            return [job.to_dict() for job in jobs[:limit]]
+
+    def follow(self, job_id, on_result, after=0, timeout=None):
+        """Pass each result to on_result as it arrives; returns the final job record
+
+        Jobs of other processes are followed by polling the store. Returns
+        the job record as it stands if timeout seconds pass first, or None
+        for an unknown job.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job:
+                    results = job.results[after:]
+                    record = job.to_dict()
+                    if not results and not job.finished:
+                        self.changed.wait(1.0)
+                        results = job.results[after:]
+                        record = job.to_dict()
+
+            if job is None:
+                record = self.store.get_job(job_id) if self.store else None
+                if record is None:
+                    return None
+                # Nobody will finish a job whose process is gone
+                if record['state'] in (JOB_QUEUED, JOB_RUNNING) and self.store.fail_orphaned(job_id):
+                    record = self.store.get_job(job_id)
+                results = self.store.get_results(job_id, after)
+
+            for result in results:
+                on_result(result)
+            after += len(results)
+
+            if record['state'] in (JOB_FINISHED, JOB_FAILED) and after >= record['done']:
+                return record
+            if deadline is not None and time.monotonic() >= deadline:
+                return record
+            if job is None and not results:
+                time.sleep(0.5)
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job of this process finishes; returns its record"""
+        return self.follow(job_id, lambda result: None, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; when not waiting, queued jobs are cancelled and
+        they and the running ones are marked failed"""
+        self.coordinators.shutdown(wait=wait, cancel_futures=not wait)
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        if not wait:
+            with self.changed:
+                unfinished = [job for job in self.jobs.values() if not job.finished]
+                for job in unfinished:
+                    job.state = JOB_FAILED
+                    job.error = 'Interrupted by shutdown'
+                    job.finished_at = time.time()
+            for job in unfinished:
+                self._flush(job)
+                self._save(job)
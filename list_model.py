@@ -0,0 +1,134 @@
+"""
+Filtered, sorted row lists for the GUI's RecycleViews, updated by diff
+"""
+from fleet_state import (CONN_ID, CONN_DEVICE_ID, CONN_SERIAL, CONN_LOCAL_PORT,
+                         CONN_REMOTE_PORT, CONN_STATUS, CONN_IP)
+
+
+STATUS_FILTERS = ('all', 'active', 'stopped')
+
+
+def connection_row(conn):
+    """RecycleView data for a ConnectionItem, from a connection row"""
+    return {
+        'connection_id': conn[CONN_ID],
+        'device_id': conn[CONN_DEVICE_ID],
+        'serial': conn[CONN_SERIAL],
+        'local_port': conn[CONN_LOCAL_PORT],
+        'remote_port': conn[CONN_REMOTE_PORT],
+        'status': conn[CONN_STATUS],
+        'current_ip': conn[CONN_IP] or '',
+        # Recycled widgets keep old values for keys a row lacks, so the
+        # overlay fields always need a default
+        'busy': False,
+        'busy_text': '',
+    }
+
+
+def device_row(device):
+    """RecycleView data for a DeviceItem, from a device row"""
+    device_id, serial, model, android_version, status, last_seen = device
+    return {
+        'device_id': device_id,
+        'serial': serial,
+        'device_name': model or serial,
+        'android_version': android_version or '',
+    }
+
+
+class RowList:
+    """All rows of one list plus the search/filter settings applied to them
+
+    Rows are dicts keyed by `key`. Changes are recorded with set_row(),
+    remove_row() or replace_all(), and sync(view) brings a RecycleView's data
+    up to date: when the visible rows are still the same rows in the same
+    order only the dicts that changed are replaced, so RecycleView refreshes
+    just those entries; only inserts, removals and filter changes replace
+    the whole data list. Either way, RecycleView only builds widgets for the
+    rows on screen.
+    """
+
+    def __init__(self, key, search_fields, sort_key=None, status_field=None):
+        self.key = key
+        self.search_fields = search_fields
+        self.sort_key = sort_key or (lambda row: row[key])
+        self.status_field = status_field
+        self.rows = {}
+        self.query = ''
+        self.status = 'all'
+        self.overlays = {}
+
+    # Rows
+    def set_row(self, row):
+        """Add or replace a row"""
+        self.rows[row[self.key]] = row
+
+    def remove_row(self, key):
+        """Drop a row if present"""
+        self.rows.pop(key, None)
+        self.overlays.pop(key, None)
+
+    def replace_all(self, rows):
+        """Replace every row, e.g. after the initial load"""
+        self.rows = {row[self.key]: row for row in rows}
+        self.overlays = {k: v for k, v in self.overlays.items() if k in self.rows}
+
+    def set_overlay(self, key, **fields):
+        """Display-only fields layered over a row (e.g. an in-progress flag)"""
+        overlay = self.overlays.setdefault(key, {})
+        overlay.update(fields)
+
+    def clear_overlay(self, key, *names):
+        """Remove overlay fields from a row (all of them without names)"""
+        overlay = self.overlays.get(key)
+        if overlay is None:
+            return
+        for name in names or list(overlay):
+            overlay.pop(name, None)
+        if not overlay:
+            del self.overlays[key]
+
+    # Filtering
+    def set_filter(self, query=None, status=None):
+        """Change the search text and/or status filter"""
+        if query is not None:
+            self.query = query.strip().lower()
+        if status is not None:
+            if status not in STATUS_FILTERS:
+                raise ValueError(f"Unknown status filter: {status}")
+            self.status = status
+
+    def matches(self, row):
+        """Whether a row passes the current search and status filter"""
+        if self.status != 'all' and self.status_field and row[self.status_field] != self.status:
+            return False
+        if not self.query:
+            return True
+        return any(self.query in str(row.get(field, '')).lower() for field in self.search_fields)
+
+    def visible_rows(self):
+        """Rows passing the filters, sorted, with overlays applied"""
+        rows = sorted((row for row in self.rows.values() if self.matches(row)), key=self.sort_key)
+        if self.overlays:
+            rows = [dict(row, **self.overlays[row[self.key]]) if row[self.key] in self.overlays else row
+                    for row in rows]
+        return rows
+
+    def count(self):
+        """(visible rows, all rows)"""
+        return sum(1 for row in self.rows.values() if self.matches(row)), len(self.rows)
+
+    def sync(self, view):
+        """Update view.data (a RecycleView) to the visible rows; returns rows written"""
+        rows = self.visible_rows()
+        data = view.data
+        key = self.key
+        if len(data) == len(rows) and all(old.get(key) == new[key] for old, new in zip(data, rows)):
+            written = 0
+            for index, (old, new) in enumerate(zip(data, rows)):
+                if old != new:
+                    data[index] = new
+                    written += 1
+            return written
+        view.data = rows
+        return len(rows)
@@ -3,6 +3,10 @@ Main application for Mobile Proxy Manager
 Cross-platform app for creating proxy connections from mobile devices
 """
 import sys
+import time
+
+# Reference point for the startup metrics (time to first frame etc.)
+PROCESS_START = time.perf_counter()
 
 # Check if CLI mode is requested before importing Kivy
 if len(sys.argv) > 1 and sys.argv[1] == '--cli':
@@ -11,7 +15,20 @@ if len(sys.argv) > 1 and sys.argv[1] == '--cli':
     from cli import main as cli_main
     sys.exit(cli_main())
 
+# --trace FILE writes a Chrome trace of the session on exit; taken out of
+# argv before Kivy parses it
+if '--trace' in sys.argv:
+    index = sys.argv.index('--trace')
+    if index + 1 >= len(sys.argv):
+        sys.exit("Usage: main.py [--trace FILE]")
+    trace_path = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    import tracing
+    tracing.start(trace_path)
+
 import os
+import json
+from collections import deque
 
 # Suppress clipboard provider errors (xsel/xclip) on systems without them
 # Kivy will automatically fall back to sdl2 clipboard which works cross-platform
@@ -52,191 +69,397 @@ class ClipboardErrorFilter:
 sys.stderr = ClipboardErrorFilter(original_stderr)
 from kivymd.app import MDApp
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.widget import Widget
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivymd.uix.button import MDRaisedButton, MDFlatButton
 from kivymd.uix.label import MDLabel
-from kivymd.uix.dialog import MDDialog
-from kivy.uix.textinput import TextInput
 from kivy.clock import Clock
-from kivy.properties import StringProperty, NumericProperty
+from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ListProperty
 from kivy.lang import Builder
 
+import bulk_ops
 from database import Database
-from adb_manager import ADBManager
+from adb_manager import ADBManager, resolve_adb
 from proxy_manager import ProxyManager
+from fleet_state import FleetState, CONN_STATUS
+from monitor import ConnectionMonitor
+from sparklines import SeriesStore, sparkline_points
+from top_view import format_rate
+from list_model import RowList, connection_row, device_row, STATUS_FILTERS
+from task_dispatcher import TaskDispatcher
+from tracing import span
 
 
-class DeviceItem(BoxLayout):
-    """Widget for displaying device information"""
+class DeviceItem(RecycleDataViewBehavior, BoxLayout):
+    """Row of the device RecycleView
+
+    Instances are recycled between rows, so actions are addressed by
+    device_id rather than by holding on to the widget.
+    """
+    device_id = NumericProperty(0)
     device_name = StringProperty('')
     serial = StringProperty('')
     android_version = StringProperty('')
-    device_id = NumericProperty(0)
-    
-    def __init__(self, device_id, serial, model, android_version, callback, **kwargs):
-        super().__init__(**kwargs)
-        self.device_id = device_id
-        self.serial = serial
-        self.device_name = model or serial
-        self.android_version = android_version
-        self.callback = callback
     
     def on_add_connection(self):
         """Handle add connection button"""
-        self.callback(self.device_id, self.serial)
+        MDApp.get_running_app().root.show_add_connection_dialog(self.device_id, self.serial)
+
+
+class Sparkline(Widget):
+    """Line chart of a RingBuffer; rows.kv draws `points` with one Line instruction"""
+    color = ListProperty([0.4, 0.7, 1, 1])
+    points = ListProperty([])
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.buffer = None
+        self.bind(pos=self.redraw, size=self.redraw)
+    
+    def set_buffer(self, buffer):
+        """Show a RingBuffer (or nothing for None)"""
+        self.buffer = buffer
+        self.redraw()
+    
+    def redraw(self, *args):
+        """Recompute the line from the buffer"""
+        values = self.buffer.values() if self.buffer is not None else ()
+        self.points = sparkline_points(values, self.x, self.y, self.width, self.height)
 
 
-class ConnectionItem(BoxLayout):
-    """Widget for displaying connection information"""
+class ConnectionItem(RecycleDataViewBehavior, BoxLayout):
+    """Row of the connection RecycleView
+
+    Instances are recycled between rows, so actions are addressed by
+    connection_id and the row follows fleet events instead of being
+    updated directly.
+    """
     connection_id = NumericProperty(0)
+    device_id = NumericProperty(0)
     serial = StringProperty('')
     local_port = NumericProperty(0)
     remote_port = NumericProperty(0)
     status = StringProperty('stopped')
     current_ip = StringProperty('')
+    busy = BooleanProperty(False)
+    busy_text = StringProperty('')
+    throughput_text = StringProperty('-')
+    clients_text = StringProperty('-')
+    latency_text = StringProperty('-')
     
-    def __init__(self, connection_id, device_id, serial, local_port, remote_port, 
-                 status, current_ip, callbacks, **kwargs):
-        super().__init__(**kwargs)
-        self.connection_id = connection_id
-        self.device_id = device_id
-        self.serial = serial
-        self.local_port = local_port
-        self.remote_port = remote_port
-        self.status = status
-        self.current_ip = current_ip or ''
-        self.callbacks = callbacks
+    def refresh_view_attrs(self, rv, index, data):
+        """Show the charts of the connection this widget now displays"""
+        super().refresh_view_attrs(rv, index, data)
+        root = MDApp.get_running_app().root
+        self.update_charts(root.series.get(self.connection_id))
+    
+    def update_charts(self, series):
+        """Redraw the sparklines from a ConnectionSeries (None clears them)"""
+        charts = (self.ids.throughput_chart, self.ids.clients_chart, self.ids.latency_chart)
+        if series is None:
+            for chart in charts:
+                chart.set_buffer(None)
+            self.throughput_text = self.clients_text = self.latency_text = '-'
+            return
+        
+        for chart, buffer in zip(charts, (series.throughput, series.clients, series.latency)):
+            chart.set_buffer(buffer)
+        rate, clients, latency = series.throughput.last(), series.clients.last(), series.latency.last()
+        self.throughput_text = format_rate(rate)
+        self.clients_text = '-' if clients is None else f"{clients:.0f} clients"
+        self.latency_text = '-' if latency is None else f"{latency:.0f} ms"
     
     def on_toggle(self):
         """Handle toggle button"""
-        self.callbacks['toggle'](self)
+        MDApp.get_running_app().root.toggle_connection(self.connection_id)
     
     def on_check_ip(self):
         """Handle check IP button"""
-        self.callbacks['check_ip'](self)
+        MDApp.get_running_app().root.check_connection_ip(self.connection_id)
     
     def on_change_ip(self):
         """Handle change IP button"""
-        self.callbacks['change_ip'](self)
+        MDApp.get_running_app().root.change_connection_ip(self.connection_id)
+
+
+class StartupMetrics:
+    """Startup milestones in milliseconds since the process started
+
+    Printed once the GUI is ready, and appended as a JSON line to the file
+    named by MOBILE_PROXY_STARTUP_METRICS (see benchmarks/bench_gui_startup.py)
+    so startup regressions show up in numbers.
+    """
+    
+    def __init__(self):
+        self.marks = {}
+    
+    def mark(self, name):
+        """Record a milestone (only the first time it is reached)"""
+        self.marks.setdefault(name, round((time.perf_counter() - PROCESS_START) * 1000, 1))
+    
+    def report(self):
+        """Print the milestones and append them to the metrics file, if any"""
+        print("Startup: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.marks.items()))
+        path = os.environ.get('MOBILE_PROXY_STARTUP_METRICS')
+        if path:
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.marks) + '\n')
 
 
 class MainLayout(BoxLayout):
-    """Main application layout"""
+    """Main application layout
+    
+    Nothing in __init__ touches SQLite or adb, so the window is drawn
+    straight away. bootstrap() then opens the database, checks adb, shows
+    the stored devices and connections, discovers devices and reconciles
+    forwards on a worker, and the lists fill in as each step lands.
+    """
+    device_count_text = StringProperty('0')
+    device_rows_total = NumericProperty(0)
+    connection_count_text = StringProperty('0')
+    connection_rows_total = NumericProperty(0)
+    connection_filter = StringProperty('all')
+    task_status = StringProperty('')
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.db = Database()
-        self.adb = ADBManager()
-        self.proxy = ProxyManager(self.adb)
+        # Set up by bootstrap(); None until then
+        self.db = None
+        self.fleet = None
+        self.adb = None
+        self.proxy = None
+        self.monitor = None
+        self.jobs = None
+        self.metrics = StartupMetrics()
+        
+        # Bulk actions run as background jobs; job id -> progress and the
+        # rows it has marked busy (connection_id -> serial)
+        self._jobs = {}
+        
+        # Live per-connection history for the row sparklines
+        self.series = SeriesStore()
+        
+        # adb and SQLite calls run on a worker pool; results come back to
+        # the UI thread through the Clock so the window never blocks
+        self.tasks = TaskDispatcher(
+            schedule=lambda callback: Clock.schedule_once(lambda dt: callback(), 0)
+        )
+        self._row_tasks = {}
+        
+        # The RecycleViews are fed from RowLists: fleet events are queued
+        # (they may arrive from any thread) and applied once per frame, and
+        # only the rows that changed are written to the views' data
+        self.device_rows = RowList('device_id', ('serial', 'device_name', 'android_version'))
+        self.connection_rows = RowList(
+            'connection_id', ('serial', 'current_ip', 'local_port', 'remote_port'),
+            sort_key=lambda row: row['connection_id'], status_field='status'
+        )
+        self._pending_events = deque()
+        self._device_list_trigger = Clock.create_trigger(lambda dt: self.update_device_list())
+        self._connection_list_trigger = Clock.create_trigger(lambda dt: self.update_connection_list())
+        
+        # Runs on the first frame, once the window is on screen
+        Clock.schedule_once(lambda dt: self.begin_bootstrap(), 0)
+    
+    # Startup
+    def begin_bootstrap(self):
+        """Load the row templates and start bootstrap() on a worker"""
+        self.metrics.mark('first_frame')
+        Builder.load_file('rows.kv')
+        self.task_status = 'Starting...'
+        self.tasks.submit(('bootstrap',), self.bootstrap, self._bootstrap_done)
+    
+    def _set_task_status(self, text):
+        """Show a status line from any thread"""
+        Clock.schedule_once(lambda dt: setattr(self, 'task_status', text), 0)
+    
+    def bootstrap(self):
+        """Open the database, check adb, discover devices and reconcile forwards (worker thread)"""
+        self._set_task_status('Opening database...')
+        db = Database()
+        fleet = FleetState(db)
+        fleet.subscribe(self.on_fleet_event)
+        self.db, self.fleet = db, fleet
+        
+        # Stored rows first, so the lists fill before any device is queried
+        Clock.schedule_once(lambda dt: self.load_lists(), 0)
+        
+        self._set_task_status('Checking adb...')
+        adb_path, version = resolve_adb()
+        self.adb = ADBManager(adb_path or 'adb')
+        
+        # MOBILE_PROXY_RELAY=asyncio|thread relays proxy traffic through the
+        # app so the throughput and client charts have data
+        relay = None
+        relay_mode = os.environ.get('MOBILE_PROXY_RELAY')
+        if relay_mode:
+            from relay import create_relay
+            relay = create_relay(relay_mode)
+        self.proxy = ProxyManager(self.adb, relay)
+        self.monitor = ConnectionMonitor(fleet, self.proxy)
+        if relay:
+            relay.on_traffic = self.monitor.record_port_traffic
         
-        # Check if ADB is available
-        if not self.adb.check_adb_available():
-            Clock.schedule_once(lambda dt: self.show_error(
+        # Bulk actions are queued as jobs, recorded next to the database
+        from jobs import JobManager, JobStore
+        self.jobs = JobManager(fleet, self.adb, self.proxy, JobStore(db), on_result=self._job_result)
+        self.jobs.add_listener(self.on_job_event)
+
+        # MOBILE_PROXY_METRICS=[host:]port serves Prometheus metrics at /metrics
+        metrics_address = os.environ.get('MOBILE_PROXY_METRICS')
+        if metrics_address:
+            from metrics import start_http_server
+            host, _, port = metrics_address.rpartition(':')
+            try:
+                start_http_server(int(port), host or '127.0.0.1')
+            except (OSError, ValueError) as e:
+                print(f"Error starting metrics endpoint on {metrics_address}: {e}")
+        if not adb_path:
+            return False
+        
+        self._set_task_status('Discovering devices...')
+        fleet.upsert_devices(self.adb.get_connected_devices())
+        
+        self._set_task_status('Reconciling forwards...')
+        bulk_ops.reconcile_forwards(fleet, self.adb, self.proxy)
+        return True
+    
+    def _bootstrap_done(self, adb_found, error):
+        """Finish startup on the UI thread"""
+        self.task_status = ''
+        if error:
+            self.show_error('Startup Failed', str(error))
+            return
+        if not adb_found:
+            self.show_error(
                 "ADB Not Found",
                 "ADB is not installed or not in PATH.\n"
                 "Please install Android Debug Bridge (ADB) to use this application."
-            ), 0.5)
+            )
         
-        # Schedule periodic refresh
+        # Periodically pick up changes made outside the GUI (e.g. by the CLI)
         Clock.schedule_interval(lambda dt: self.refresh_connections(), 10)
+        
+        if self.monitor:
+            self.monitor.start()
+            Clock.schedule_interval(lambda dt: self.update_charts(), 1)
+        
+        self.metrics.mark('ready')
+        self.metrics.report()
+        if os.environ.get('MOBILE_PROXY_EXIT_AFTER_STARTUP'):
+            MDApp.get_running_app().stop()
+    
+    def on_fleet_event(self, event):
+        """Queue a fleet state change for the next frame"""
+        self._pending_events.append(event)
+        if event.type.startswith('device_'):
+            self._device_list_trigger()
+        else:
+            self._connection_list_trigger()
+    
+    def _apply_pending_events(self):
+        """Fold queued fleet events into the row lists (main thread only)"""
+        while self._pending_events:
+            event = self._pending_events.popleft()
+            if event.type.startswith('device_'):
+                rows = self.device_rows
+                new_row = device_row(event.new) if event.new else None
+            else:
+                rows = self.connection_rows
+                new_row = connection_row(event.new) if event.new else None
+            if new_row is None:
+                rows.remove_row(event.key)
+            else:
+                rows.set_row(new_row)
+    
+    def load_lists(self):
+        """Fill both lists from the fleet state"""
+        self._pending_events.clear()
+        self.device_rows.replace_all(device_row(d) for d in self.fleet.get_devices())
+        self.connection_rows.replace_all(connection_row(c) for c in self.fleet.get_connections())
+        self.update_device_list()
+        self.update_connection_list()
+        self.metrics.mark('lists_loaded')
     
     def refresh_devices(self):
-        """Refresh the list of connected devices"""
-        devices = self.adb.get_connected_devices()
-        
-        # Update database
-        for device in devices:
-            self.db.add_device(
-                device['serial'],
-                device['model'],
-                device['android_version']
-            )
+        """Refresh the list of connected devices in the background"""
+        if self.proxy is None:
+            return
         
-        # Update UI
-        self.update_device_list()
+        def work():
+            devices = self.adb.get_connected_devices()
+            # Update database in a single transaction; the UI follows via fleet events
+            self.fleet.upsert_devices(devices)
+        
+        self.tasks.submit(('refresh_devices',), work, self._report_task_error)
     
     def update_device_list(self):
-        """Update the device list UI"""
+        """Bring the device list up to date with the fleet state"""
         # Check if widget is available (KV might not be fully loaded yet)
         if 'device_list' not in self.ids:
             return
         
-        device_list = self.ids.device_list
-        device_list.clear_widgets()
-        
-        devices = self.db.get_devices()
-        
-        if not devices:
-            label = MDLabel(
-                text='No devices connected.\nConnect a device via USB and enable USB debugging.',
-                halign='center',
-                theme_text_color='Custom',
-                text_color=(0.6, 0.6, 0.6, 1),
-                size_hint_y=None,
-                height=100
-            )
-            device_list.add_widget(label)
-        else:
-            for device in devices:
-                device_id, serial, model, android_version, status, last_seen = device
-                
-                item = DeviceItem(
-                    device_id=device_id,
-                    serial=serial,
-                    model=model,
-                    android_version=android_version,
-                    callback=self.show_add_connection_dialog
-                )
-                device_list.add_widget(item)
+        self._apply_pending_events()
+        self.device_rows.sync(self.ids.device_list)
+        shown, total = self.device_rows.count()
+        self.device_rows_total = total
+        self.device_count_text = f"{shown} of {total}" if shown != total else str(total)
     
     def refresh_connections(self):
-        """Refresh the list of connections"""
-        self.update_connection_list()
+        """Reload connections from the database in the background"""
+        if self.fleet is None:
+            return
+        self.tasks.submit(('refresh',), self.fleet.refresh, self._report_task_error)
+    
+    def _report_task_error(self, result, error):
+        """on_done for background refreshes: only failures are reported"""
+        if error:
+            print(f"Background refresh failed: {error}")
     
     def update_connection_list(self):
-        """Update the connection list UI"""
+        """Bring the connection list up to date with the fleet state"""
         # Check if widget is available (KV might not be fully loaded yet)
         if 'connection_list' not in self.ids:
             return
         
-        connection_list = self.ids.connection_list
-        connection_list.clear_widgets()
-        
-        connections = self.db.get_connections()
-        
-        if not connections:
-            label = MDLabel(
-                text='No connections configured.\nAdd a connection from a device.',
-                halign='center',
-                theme_text_color='Custom',
-                text_color=(0.6, 0.6, 0.6, 1),
-                size_hint_y=None,
-                height=100
-            )
-            connection_list.add_widget(label)
-        else:
-            for conn in connections:
-                conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
-                
-                callbacks = {
-                    'toggle': self.toggle_connection,
-                    'check_ip': self.check_connection_ip,
-                    'change_ip': self.change_connection_ip
-                }
-                
-                item = ConnectionItem(
-                    connection_id=conn_id,
-                    device_id=device_id,
-                    serial=serial,
-                    local_port=local_port,
-                    remote_port=remote_port,
-                    status=status,
-                    current_ip=current_ip,
-                    callbacks=callbacks
-                )
-                connection_list.add_widget(item)
+        self._apply_pending_events()
+        self.connection_rows.sync(self.ids.connection_list)
+        shown, total = self.connection_rows.count()
+        self.connection_rows_total = total
+        self.connection_count_text = f"{shown} of {total}" if shown != total else str(total)
+    
+    def update_charts(self):
+        """Sample the monitor and redraw the charts of the rows on screen"""
+        self.series.update(self.monitor.snapshot(self.series.version))
+        self.series.sample()
+        if 'connection_list' not in self.ids:
+            return
+        # The layout only holds the views currently on screen
+        for item in self.ids.connection_list.layout_manager.children:
+            item.update_charts(self.series.get(item.connection_id))
+    
+    def search_devices(self, text):
+        """Filter the device list by serial, model or Android version"""
+        self.device_rows.set_filter(query=text)
+        self.update_device_list()
+    
+    def search_connections(self, text):
+        """Filter the connection list by serial, IP or port"""
+        self.connection_rows.set_filter(query=text)
+        self.update_connection_list()
+    
+    def cycle_connection_filter(self):
+        """Switch the connection status filter: all -> active -> stopped"""
+        index = STATUS_FILTERS.index(self.connection_rows.status)
+        self.connection_rows.set_filter(status=STATUS_FILTERS[(index + 1) % len(STATUS_FILTERS)])
+        self.connection_filter = self.connection_rows.status
+        self.update_connection_list()
     
     def show_add_connection_dialog(self, device_id, serial):
         """Show dialog to add a new connection"""
+        from kivy.uix.textinput import TextInput
+        from kivymd.uix.dialog import MDDialog
+        
         content = BoxLayout(orientation='vertical', spacing=10, padding=20, size_hint_y=None)
         content.height = 200
         
@@ -272,11 +495,10 @@ class MainLayout(BoxLayout):
                     dialog.dismiss()
                     return
                 
-                conn_id = self.db.add_connection(device_id, local_port, remote_port)
+                conn_id = self.fleet.add_connection(device_id, local_port, remote_port)
                 
                 if conn_id:
                     dialog.dismiss()
-                    self.refresh_connections()
                 else:
                     self.show_error('Error', 'Failed to add connection. Port may already be in use.')
                     dialog.dismiss()
@@ -296,73 +518,208 @@ class MainLayout(BoxLayout):
         
         dialog.open()
     
-    def toggle_connection(self, connection_item):
-        """Toggle a connection on/off"""
-        if connection_item.status == 'stopped':
-            # Start connection
-            success = self.proxy.start_proxy(
-                connection_item.serial,
-                connection_item.local_port,
-                connection_item.remote_port
-            )
-            
-            if success:
-                self.db.update_connection_status(connection_item.connection_id, 'active')
-                connection_item.status = 'active'
-            else:
-                self.show_error('Error', 'Failed to start proxy connection')
-        else:
-            # Stop connection
-            success = self.proxy.stop_proxy(
-                connection_item.serial,
-                connection_item.local_port
-            )
+    def run_connection_task(self, action, connection_id, work, label, title, on_done=None):
+        """Run work() for one connection on the worker pool with its row marked busy
+
+        work returns (ok, message). Clicking the same action on a busy row
+        joins the running task instead of starting another. Without on_done
+        the outcome is shown in a dialog titled `title` (successes only if
+        there is a message); bulk actions pass on_done(ok, message) instead.
+        """
+        self._row_tasks.setdefault(connection_id, set()).add(action)
+        self.connection_rows.set_overlay(connection_id, busy=True, busy_text=label)
+        self._connection_list_trigger()
+        
+        def done(result, error):
+            actions = self._row_tasks.get(connection_id)
+            if actions is not None:
+                actions.discard(action)
+                if not actions:
+                    del self._row_tasks[connection_id]
+                    self.connection_rows.clear_overlay(connection_id)
+                    self._connection_list_trigger()
             
-            if success:
-                self.db.update_connection_status(connection_item.connection_id, 'stopped')
-                connection_item.status = 'stopped'
+            ok, message = (False, str(error)) if error else result
+            if on_done:
+                on_done(ok, message)
+            elif not ok:
+                self.show_error(title, message)
+            elif message:
+                self.show_info(title, message)
+        
+        def traced_work():
+            with span(f'gui {action}', 'gui', connection_id=connection_id):
+                return work()
+        
+        self.tasks.submit((action, connection_id), traced_work, done)
+    
+    def toggle_connection(self, connection_id):
+        """Toggle a connection on/off"""
+        conn = self.fleet.get_connection(connection_id)
+        if conn is not None:
+            self.set_connection_active(connection_id, conn[CONN_STATUS] == 'stopped')
+    
+    def set_connection_active(self, connection_id, start, on_done=None):
+        """Start or stop a connection; a connection already in that state is left alone"""
+        conn = self.fleet.get_connection(connection_id)
+        if conn is None:
+            if on_done:
+                on_done(False, 'Connection not found')
+            return
+        conn_id, device_id, serial, local_port, remote_port, status, current_ip, last_check = conn
+        if status == ('active' if start else 'stopped'):
+            if on_done:
+                on_done(True, None)
+            return
+        
+        def work():
+            if start:
+                if not self.proxy.start_proxy(serial, local_port, remote_port):
+                    return False, 'Failed to start proxy connection'
+                self.fleet.update_connection_status(conn_id, 'active')
             else:
-                self.show_error('Error', 'Failed to stop proxy connection')
+                if not self.proxy.stop_proxy(serial, local_port):
+                    return False, 'Failed to stop proxy connection'
+                self.fleet.update_connection_status(conn_id, 'stopped')
+            return True, None
+        
+        self.run_connection_task('toggle', conn_id, work,
+                                 'Starting...' if start else 'Stopping...', 'Error', on_done)
     
-    def check_connection_ip(self, connection_item):
+    def check_connection_ip(self, connection_id, on_done=None):
         """Check IP for a connection"""
-        # Get device IP
-        device_ip = self.adb.get_device_ip(connection_item.serial)
-        
-        if device_ip:
-            self.db.update_connection_status(
-                connection_item.connection_id,
-                connection_item.status,
-                device_ip
-            )
-            connection_item.current_ip = device_ip
-            self.show_info('IP Check', f'Device IP: {device_ip}')
-        else:
-            self.show_error('IP Check Failed', 'Could not retrieve device IP')
+        conn = self.fleet.get_connection(connection_id)
+        if conn is None:
+            if on_done:
+                on_done(False, 'Connection not found')
+            return
+        serial = conn[2]
+        
+        def work():
+            # Get device IP
+            device_ip = self.adb.get_device_ip(serial)
+            if not device_ip:
+                return False, 'Could not retrieve device IP'
+            # Re-read the status; a toggle may have finished meanwhile
+            current = self.fleet.get_connection(connection_id)
+            if current:
+                self.fleet.update_connection_status(connection_id, current[CONN_STATUS], device_ip)
+            return True, f'Device IP: {device_ip}'
+        
+        self.run_connection_task('check_ip', connection_id, work, 'Checking IP...',
+                                 'IP Check', on_done)
     
-    def change_connection_ip(self, connection_item):
+    def change_connection_ip(self, connection_id, on_done=None):
         """Change IP by toggling airplane mode"""
-        def do_change():
-            success = self.adb.toggle_airplane_mode(connection_item.serial)
+        conn = self.fleet.get_connection(connection_id)
+        if conn is None:
+            if on_done:
+                on_done(False, 'Connection not found')
+            return
+        serial = conn[2]
+        
+        def work():
+            if not self.adb.toggle_airplane_mode(serial):
+                return False, 'Failed to toggle airplane mode'
             
-            if success:
-                # Check new IP
-                Clock.schedule_once(lambda dt: self.check_connection_ip(connection_item), 1)
-                Clock.schedule_once(lambda dt: self.show_info(
-                    'IP Changed',
-                    'Airplane mode toggled. IP should be changed.'
-                ), 0)
-            else:
-                Clock.schedule_once(lambda dt: self.show_error(
-                    'Error',
-                    'Failed to toggle airplane mode'
-                ), 0)
+            # Give the mobile connection a moment before reading the new IP
+            time.sleep(1)
+            device_ip = self.adb.get_device_ip(serial)
+            if not device_ip:
+                return True, 'Airplane mode toggled. IP should be changed.'
+            current = self.fleet.get_connection(connection_id)
+            if current:
+                self.fleet.update_connection_status(connection_id, current[CONN_STATUS], device_ip)
+            return True, f'Airplane mode toggled. New IP: {device_ip}'
         
-        # Run in background thread to not block UI
-        import threading
-        threading.Thread(target=do_change, daemon=True).start()
+        self.run_connection_task('change_ip', connection_id, work, 'Changing IP...',
+                                 'Change IP', on_done)
+    
+    def run_job(self, title, action, params, rows, label):
+        """Submit a bulk action as a background job, marking rows busy until
+        their item is done; progress shows in the action bar"""
+        if not rows:
+            self.show_info(title, 'No connections to process.')
+            return
+        job_id = self.jobs.submit(action, params)
+        self._jobs[job_id] = {'title': title, 'done': 0, 'failed': 0, 'total': None,
+                              'rows': {row['connection_id']: row['serial'] for row in rows}}
+        for row in rows:
+            self.connection_rows.set_overlay(row['connection_id'], busy=True, busy_text=label)
+        self._connection_list_trigger()
+        self._show_job_progress()
+    
+    def on_job_event(self, job_id, kind, data):
+        """Queue a job event (from a job thread) for the UI thread"""
+        Clock.schedule_once(lambda dt: self._apply_job_event(job_id, kind, data), 0)
+    
+    def _apply_job_event(self, job_id, kind, data):
+        """Update progress and busy rows for a job result or state change"""
+        from jobs import JOB_FAILED, JOB_FINISHED
         
-        self.show_info('Changing IP', 'Toggling airplane mode...')
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        if kind == 'result':
+            job['done'] += 1
+            job['total'] = data['total']
+            if not data['ok']:
+                job['failed'] += 1
+            item = data['item']
+            # Connection items name their row; device items cover all rows of the device
+            done = ([item['connection_id']] if 'connection_id' in item else
+                    [cid for cid, serial in job['rows'].items() if serial == item.get('serial')])
+            self._release_rows(job, done)
+        elif data['state'] in (JOB_FINISHED, JOB_FAILED):
+            del self._jobs[job_id]
+            self._release_rows(job, list(job['rows']))
+            if data['state'] == JOB_FAILED:
+                self.show_error(job['title'], data['error'] or 'Job failed')
+            else:
+                total = data['total'] or 0
+                self.show_info(job['title'], f"{data['ok']} of {total} succeeded")
+        self._show_job_progress()
+    
+    def _release_rows(self, job, connection_ids):
+        for connection_id in connection_ids:
+            if job['rows'].pop(connection_id, None) is not None and connection_id not in self._row_tasks:
+                self.connection_rows.clear_overlay(connection_id)
+        self._connection_list_trigger()
+    
+    def _show_job_progress(self):
+        self.task_status = '  '.join(
+            f"{job['title']}: {job['done']}/{job['total'] if job['total'] is not None else '?'}"
+            for job in self._jobs.values()
+        )
+    
+    def _job_result(self, job, result):
+        """Record rotations done by background jobs (job thread)"""
+        if job.action == 'change_all_ips' and result['ok'] and self.monitor:
+            self.monitor.record_rotation(result['item']['serial'])
+    
+    def start_all(self):
+        """Start every stopped connection currently shown"""
+        rows = [row for row in self.connection_rows.visible_rows() if row['status'] == 'stopped']
+        self.run_job('Start All', 'start_all', {'connection_ids': [row['connection_id'] for row in rows]},
+                     rows, 'Starting...')
+    
+    def stop_all(self):
+        """Stop every active connection currently shown"""
+        rows = [row for row in self.connection_rows.visible_rows() if row['status'] == 'active']
+        self.run_job('Stop All', 'stop_all', {'connection_ids': [row['connection_id'] for row in rows]},
+                     rows, 'Stopping...')
+    
+    def check_all_ips(self):
+        """Check the IP of every device with a connection currently shown"""
+        rows = self.connection_rows.visible_rows()
+        self.run_job('Check IPs', 'check_all_ips', {'serials': sorted({row['serial'] for row in rows})},
+                     rows, 'Checking IP...')
+    
+    def change_all_ips(self):
+        """Rotate the IP of every device with a connection currently shown"""
+        rows = self.connection_rows.visible_rows()
+        self.run_job('Rotate IPs', 'change_all_ips', {'serials': sorted({row['serial'] for row in rows})},
+                     rows, 'Changing IP...')
     
     def refresh_all(self):
         """Refresh both devices and connections"""
@@ -371,6 +728,9 @@ class MainLayout(BoxLayout):
     
     def show_error(self, title, message):
         """Show error popup"""
+        # Dialog widgets are imported on first use to keep them off the startup path
+        from kivymd.uix.dialog import MDDialog
+        
         content = MDLabel(
             text=message,
             theme_text_color='Custom',
@@ -391,6 +751,8 @@ class MainLayout(BoxLayout):
     
     def show_info(self, title, message):
         """Show info popup"""
+        from kivymd.uix.dialog import MDDialog
+        
         content = MDLabel(
             text=message,
             theme_text_color='Custom',
@@ -419,11 +781,24 @@ class MobileProxyApp(MDApp):
         self.theme_cls.primary_palette = "Blue"
         self.theme_cls.accent_palette = "Amber"
         
-        # Explicitly load the .kv file since class name doesn't match filename
+        # Explicitly load the .kv file since class name doesn't match filename.
+        # Only the window layout is loaded here; row templates (rows.kv)
+        # follow after the first frame
         Builder.load_file('main.kv')
         
         self.title = 'Mobile Proxy Manager'
         return MainLayout()
+    
+    def on_stop(self):
+        # Drop queued background work; running adb calls finish on their own
+        if self.root:
+            self.root.tasks.shutdown(wait=False)
+            if self.root.jobs:
+                self.root.jobs.shutdown(wait=False)
+            if self.root.monitor:
+                self.root.monitor.stop()
+            if self.root.proxy:
+                self.root.proxy.close(self.root.fleet)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,350 @@
+"""
+Process-wide metrics (counters, gauges, histograms) in the Prometheus text
+format, and the metrics the manager records
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+
+
+# Content type of render(), for /metrics responses
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Shards:
+    """Per-thread rows of numbers, summed when read
+
+    Each thread writes only to its own row, so recording needs no lock; the
+    lock is taken once when a thread first records and when reading. Rows
+    are keyed by thread ident: a new thread that reuses the ident of a
+    finished one keeps adding to its row, so the count of rows stays at the
+    peak number of threads and no total is lost.
+    """
+
+    __slots__ = ('size', 'rows', 'lock')
+
+    def __init__(self, size):
+        self.size = size
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def row(self):
+        """The calling thread's row"""
+        ident = threading.get_ident()
+        row = self.rows.get(ident)
+        if row is None:
+            with self.lock:
+                row = self.rows.setdefault(ident, [0.0] * self.size)
+        return row
+
+    def totals(self):
+        """Column sums over every thread's row"""
+        with self.lock:
+            rows = list(self.rows.values())
+        totals = [0.0] * self.size
+        for row in rows:
+            for i, value in enumerate(row):
+                totals[i] += value
+        return totals
+
+
+class CounterChild:
+    """A monotonically increasing value"""
+
+    __slots__ = ('_shards',)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.row()[0] += amount
+
+    def value(self):
+        return self._shards.totals()[0]
+
+    def samples(self, name):
+        return [(name, (), self.value())]
+
+
+class GaugeChild:
+    """A value that goes up and down, or is read from a function when collected
+
+    Gauges are set rather than accumulated, so they use a plain lock; they
+    are not meant for per-packet paths.
+    """
+
+    __slots__ = ('_value', '_function', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function):
+        """Report function() instead of the stored value (None to stop)"""
+        self._function = function
+
+    def value(self):
+        function = self._function
+        if function is None:
+            return self._value
+        try:
+            return function()
+        except Exception as e:
+            print(f"Error collecting gauge: {e}")
+            return math.nan
+
+    def samples(self, name):
+        return [(name, (), self.value())]
+
+
+class HistogramChild:
+    """Counts of observations per fixed bucket plus their sum"""
+
+    __slots__ = ('buckets', '_shards')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket, one for +Inf, one for the sum
+        self._shards = _Shards(len(buckets) + 2)
+
+    def observe(self, value):
+        row = self._shards.row()
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def time(self):
+        """Context manager observing the seconds spent in its block"""
+        return _Timer(self)
+
+    def count(self):
+        return sum(self._shards.totals()[:-1])
+
+    def samples(self, name):
+        totals = self._shards.totals()
+        samples = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets + (math.inf,), totals):
+            cumulative += count
+            samples.append((f'{name}_bucket', (('le', _format_value(bound)),), cumulative))
+        samples.append((f'{name}_sum', (), totals[-1]))
+        samples.append((f'{name}_count', (), cumulative))
+        return samples
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metric:
+    """A named metric family with optional labels
+
+    Without labels the family records directly (inc/set/observe are
+    those of its single child). With labels, labels(**values) returns
+    the child for those values; look children up once and keep them where
+    recording is frequent.
+    """
+
+    def __init__(self, kind, name, documentation, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Record straight on the single child, without a lookup per call
+            child = self._children[()] = factory()
+            for attribute in ('inc', 'dec', 'set', 'set_function', 'observe', 'time', 'value', 'count'):
+                if hasattr(child, attribute):
+                    setattr(self, attribute, getattr(child, attribute))
+
+    def labels(self, *values, **kwargs):
+        """Child for the given label values (positional or by name)"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames)}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def collect(self):
+        """[(sample name, ((label, value), ...), value)]"""
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            labels = tuple(zip(self.labelnames, values))
+            for name, extra, value in child.samples(self.name):
+                samples.append((name, labels + extra, value))
+        return samples
+
+
+class Registry:
+    """A set of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Metric('counter', name, documentation, labelnames, CounterChild))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Metric('gauge', name, documentation, labelnames, GaugeChild))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        buckets = tuple(sorted(float(b) for b in buckets))
+        return self._register(Metric('histogram', name, documentation, labelnames,
+                                     lambda: HistogramChild(buckets)))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.collect():
+                if labels:
+                    label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                    lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def start_http_server(port, host='127.0.0.1', registry=None):
+    """Serve GET /metrics from a background thread; returns the server
+
+    For processes without the REST API (the GUI); the daemon's API serves
+    the same text at /metrics.
+    """
+    # Imported here: only needed when metrics are exported this way
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+REGISTRY = Registry()
+
+# ADB
+ADB_COMMAND_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_adb_command_seconds', 'Latency of adb invocations by command', ['command'])
+ADB_COMMAND_ERRORS = REGISTRY.counter(
+    'mobile_proxy_adb_command_errors_total', 'adb invocations that timed out or exited non-zero',
+    ['command'])
+
+# Connections
+FORWARD_SETUP_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_forward_setup_seconds', 'Time to start a proxy connection (adb forward plus relay)',
+    ['mode'])
+FORWARD_SETUP_FAILURES = REGISTRY.counter(
+    'mobile_proxy_forward_setup_failures_total', 'Proxy connections that failed to start', ['mode'])
+CONNECTIONS = REGISTRY.gauge(
+    'mobile_proxy_connections', 'Configured connections by status', ['status'])
+DEVICES = REGISTRY.gauge('mobile_proxy_devices', 'Known devices')
+
+# IP rotation
+ROTATION_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_rotation_seconds', 'Duration of a whole IP rotation of one device',
+    buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 120))
+ROTATION_PHASE_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_rotation_phase_seconds', 'Duration of each phase of an IP rotation', ['phase'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60))
+
+# Health probes
+PROBE_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_probe_latency_seconds', 'TCP connect latency of connection health probes',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+PROBE_FAILURES = REGISTRY.counter('mobile_proxy_probe_failures_total', 'Failed health probes')
+
+# Relay
+RELAY_BYTES = REGISTRY.counter(
+    'mobile_proxy_relay_bytes_total', 'Bytes copied by the relay (in: phone to client)', ['direction'])
+RELAY_CONNECTIONS = REGISTRY.counter('mobile_proxy_relay_connections_total', 'Clients accepted by the relay')
+RELAY_ACTIVE_CONNECTIONS = REGISTRY.gauge(
+    'mobile_proxy_relay_active_connections', 'Clients currently connected through the relay')
+
+# Database
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    'mobile_proxy_db_write_seconds', 'Latency of database writes by operation', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
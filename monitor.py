@@ -0,0 +1,262 @@
+"""
+Connection monitor: periodic health probes and live per-connection statistics
+"""
+import threading
+import time
+
+import bulk_ops
+from fleet_state import CONN_ID, CONN_SERIAL, CONN_LOCAL_PORT, CONN_STATUS, CONN_IP
+from metrics import PROBE_FAILURES, PROBE_SECONDS
+
+# Removed connection ids remembered for deltas; older clients get a full resync
+MAX_REMOVED = 1000
+
+
+class ConnectionStats:
+    """Live statistics for one connection"""
+
+    __slots__ = ('latency_ewma', 'last_latency', 'probe_failures', 'bytes_in', 'bytes_out',
+                 'bytes_rate', 'clients', 'last_rotation', '_rate_window_start', '_rate_window_bytes')
+
+    def __init__(self):
+        self.latency_ewma = None
+        self.last_latency = None
+        self.probe_failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_rate = None
+        self.clients = 0
+        self.last_rotation = None
+        self._rate_window_start = time.monotonic()
+        self._rate_window_bytes = 0
+
+
+class ConnectionMonitor:
+    """Probe active connections and keep latency/throughput/rotation stats
+
+    Every interval seconds the TCP connect latency of each active forward is
+    measured on a bounded worker pool and folded into an exponentially
+    weighted moving average. Probe results (and traffic and rotations
+    reported by other components) are recorded in the TimeSeriesStore when
+    one is given.
+
+    Every change bumps a version number stored with the connection, so
+    viewers can ask for snapshot(since=version) and only receive the rows
+    that changed. Only the last max_removed removals are kept; a viewer
+    whose version is older than the oldest dropped one gets a full snapshot.
+    """
+
+    def __init__(self, fleet, proxy, timeseries=None, interval=5, alpha=0.3,
+                 parallel=16, probe_timeout=2, max_removed=MAX_REMOVED):
+        self.fleet = fleet
+        self.proxy = proxy
+        self.timeseries = timeseries
+        self.interval = interval
+        self.alpha = alpha
+        self.parallel = parallel
+        self.probe_timeout = probe_timeout
+        self.max_removed = max_removed
+
+        self.stats = {}
+        self.row_versions = {}
+        self.removed = {}
+        # Version of the newest removal dropped from self.removed
+        self.removed_floor = 0
+        self.version = 0
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if timeseries:
+            last_rotations = timeseries.get_last_rotations()
+            for connection_id, ts in last_rotations.items():
+                self._stats(connection_id).last_rotation = ts
+
+        for row in fleet.get_connections():
+            self._touch(row[CONN_ID])
+        fleet.subscribe(self.on_fleet_event)
+
+    def _stats(self, connection_id):
+        stats = self.stats.get(connection_id)
+        if stats is None:
+            stats = self.stats[connection_id] = ConnectionStats()
+        return stats
+
+    def _touch(self, connection_id):
+        """Mark a connection as changed (caller may hold the lock)"""
+        self.version += 1
+        self.row_versions[connection_id] = self.version
+
+    def on_fleet_event(self, event):
+        """Track fleet changes so snapshots include status/IP updates"""
+        if not event.type.startswith('connection_'):
+            return
+        with self.lock:
+            if event.type == 'connection_removed':
+                self.stats.pop(event.key, None)
+                self.row_versions.pop(event.key, None)
+                self.version += 1
+                self.removed[event.key] = self.version
+                while len(self.removed) > self.max_removed:
+                    # Oldest first: removals are inserted in version order
+                    oldest = next(iter(self.removed))
+                    self.removed_floor = self.removed.pop(oldest)
+            else:
+                self.removed.pop(event.key, None)
+                self._touch(event.key)
+
+    # Inputs
+    def probe_all(self):
+        """Probe every active connection once; returns the number probed"""
+        active = self.fleet.get_connections_by_status('active')
+        samples = []
+
+        def probe(conn):
+            latency = self.proxy.probe_connection(conn[CONN_LOCAL_PORT], self.probe_timeout)
+            return latency is not None, latency, None
+
+        def on_result(result):
+            connection_id = result['item'][CONN_ID]
+            latency = result['message'] if result['ok'] else None
+            self.record_probe(connection_id, latency, record=False)
+            samples.append({'connection_id': connection_id, 'latency_ms': latency,
+                            'errors': 0 if result['ok'] else 1})
+
+        bulk_ops.run_parallel(active, probe, self.parallel, self.probe_timeout * 2, on_result)
+
+        if self.timeseries and samples:
+            self.timeseries.record_samples(samples)
+        return len(active)
+
+    def record_probe(self, connection_id, latency_ms, record=True):
+        """Fold one probe result (None for a failed probe) into the stats"""
+        if latency_ms is None:
+            PROBE_FAILURES.inc()
+        else:
+            PROBE_SECONDS.observe(latency_ms / 1000)
+        with self.lock:
+            stats = self._stats(connection_id)
+            stats.last_latency = latency_ms
+            if latency_ms is None:
+                stats.probe_failures += 1
+            elif stats.latency_ewma is None:
+                stats.latency_ewma = latency_ms
+            else:
+                stats.latency_ewma += self.alpha * (latency_ms - stats.latency_ewma)
+            self._touch(connection_id)
+
+        if record and self.timeseries:
+            self.timeseries.record_sample(connection_id, latency_ms=latency_ms,
+                                          errors=0 if latency_ms is not None else 1)
+
+    def record_traffic(self, connection_id, bytes_in=0, bytes_out=0, clients=None):
+        """Account relayed bytes (and optionally the current client count)"""
+        with self.lock:
+            stats = self._stats(connection_id)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats._rate_window_bytes += bytes_in + bytes_out
+            if clients is not None:
+                stats.clients = clients
+
+            now = time.monotonic()
+            window = now - stats._rate_window_start
+            if window >= 1:
+                stats.bytes_rate = stats._rate_window_bytes / window
+                stats._rate_window_start = now
+                stats._rate_window_bytes = 0
+                self._touch(connection_id)
+
+    def record_port_traffic(self, local_port, bytes_in=0, bytes_out=0, clients=None):
+        """record_traffic() keyed by local port, as relays report it"""
+        conn = self.fleet.get_connection_by_port(local_port)
+        if conn is not None:
+            self.record_traffic(conn[CONN_ID], bytes_in, bytes_out, clients)
+
+    def record_rotation(self, serial):
+        """Note an IP rotation on every connection of a device"""
+        now = int(time.time())
+        connection_ids = [row[CONN_ID] for row in self.fleet.get_connections_by_serial(serial)]
+        with self.lock:
+            for connection_id in connection_ids:
+                self._stats(connection_id).last_rotation = now
+                self._touch(connection_id)
+
+        if self.timeseries and connection_ids:
+            self.timeseries.record_samples(
+                {'connection_id': connection_id, 'ts': now, 'rotations': 1}
+                for connection_id in connection_ids
+            )
+
+    # Output
+    def snapshot(self, since=0):
+        """Rows changed after version `since`
+
+        Returns {'version', 'rows', 'removed', 'full'}; pass the returned
+        version as `since` next time to get only the delta. Rows are dicts
+        with the connection fields plus the live statistics. When removals
+        after `since` have been forgotten, every row is returned with
+        full=True and the caller should drop rows that are not in it.
+        """
+        with self.lock:
+            version = self.version
+            full = since < self.removed_floor
+            if full:
+                since = 0
+            changed = [c for c, v in self.row_versions.items() if v > since]
+            removed = [] if full else [c for c, v in self.removed.items() if v > since]
+            stats = {c: self.stats.get(c) for c in changed}
+
+        rows = []
+        for connection_id in changed:
+            conn = self.fleet.get_connection(connection_id)
+            if conn is None:
+                continue
+            row = {
+                'id': connection_id,
+                'serial': conn[CONN_SERIAL],
+                'local_port': conn[CONN_LOCAL_PORT],
+                'status': conn[CONN_STATUS],
+                'current_ip': conn[CONN_IP],
+                'latency_ewma': None,
+                'last_latency': None,
+                'probe_failures': 0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'bytes_rate': None,
+                'clients': 0,
+                'last_rotation': None,
+            }
+            s = stats.get(connection_id)
+            if s:
+                row.update(latency_ewma=s.latency_ewma, last_latency=s.last_latency,
+                           probe_failures=s.probe_failures, bytes_in=s.bytes_in,
+                           bytes_out=s.bytes_out, bytes_rate=s.bytes_rate, clients=s.clients,
+                           last_rotation=s.last_rotation)
+            rows.append(row)
+
+        return {'version': version, 'rows': rows, 'removed': removed, 'full': full}
+
+    # Background probing
+    def start(self):
+        """Start probing every interval seconds in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='connection-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the probe thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                print(f"Error probing connections: {e}")
+            self._stop_event.wait(self.interval)
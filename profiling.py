@@ -0,0 +1,192 @@
+"""
+On-demand profiling: cProfile of one thread, or a wall-clock sampler of
+every thread, written as a sorted text summary plus a raw dump
+"""
+import atexit
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+
+PROFILE_MODES = ('cprofile', 'sample')
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Rows per table in the text summaries
+SUMMARY_ROWS = 40
+
+# The running session, if any
+_session = None
+_lock = threading.Lock()
+
+
+class CProfileSession:
+    """Deterministic cProfile of the thread that starts it
+
+    Writes <base>.prof (raw pstats data, for pstats/snakeviz) and
+    <base>.txt (top functions by cumulative and by own time). Work done on
+    other threads (e.g. bulk_ops workers) only shows up as time waiting for
+    it; use a SampleSession to see inside those.
+    """
+
+    mode = 'cprofile'
+
+    def __init__(self, base):
+        import cProfile
+
+        self.base = base
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        """Stop and write the files; returns their paths"""
+        self.profile.disable()
+        import io
+        import pstats
+
+        prof_path = f'{self.base}.prof'
+        self.profile.dump_stats(prof_path)
+
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        out.write('Sorted by cumulative time\n')
+        stats.sort_stats('cumulative').print_stats(SUMMARY_ROWS)
+        out.write('Sorted by own time\n')
+        stats.sort_stats('tottime').print_stats(SUMMARY_ROWS)
+        txt_path = f'{self.base}.txt'
+        with open(txt_path, 'w') as f:
+            f.write(out.getvalue())
+        return [txt_path, prof_path]
+
+
+class SampleSession:
+    """Samples the stack of every thread at a fixed interval
+
+    Wall-clock sampling: a thread blocked in a subprocess, SQLite call or
+    lock wait is counted where it waits, which is what shows where the time
+    of an operation goes. The overhead is one sys._current_frames() per
+    interval, so it can run in a live daemon. Writes <base>.folded
+    (collapsed stacks, one "thread;outer;...;inner count" line each, for
+    flamegraph.pl or speedscope) and <base>.txt (top functions by own and
+    total samples).
+    """
+
+    mode = 'sample'
+
+    def __init__(self, base, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.base = base
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(_thread_group(names.get(ident, str(ident))))
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def stop(self):
+        """Stop sampling and write the files; returns their paths"""
+        self._stopped.set()
+        self._thread.join()
+        elapsed = time.monotonic() - self.started
+
+        folded_path = f'{self.base}.folded'
+        with open(folded_path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack[1:]):
+                total[function] += count
+        thread_samples = sum(self.stacks.values()) or 1
+
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} ms over {elapsed:.1f} s; '
+                 f'{thread_samples} thread stacks (waiting threads included)', '']
+        for title, counter in (('Own samples (where threads are)', own),
+                               ('Total samples (function on the stack)', total)):
+            lines.append(title)
+            lines.append(f"{'samples':>8} {'%':>6}  function")
+            for function, count in counter.most_common(SUMMARY_ROWS):
+                lines.append(f'{count:>8} {count * 100 / thread_samples:>5.1f}%  {function}')
+            lines.append('')
+        txt_path = f'{self.base}.txt'
+        with open(txt_path, 'w') as f:
+            f.write('\n'.join(lines))
+        return [txt_path, folded_path]
+
+
+def _thread_group(name):
+    """Thread name without its pool index, so workers of one pool fold together"""
+    return re.sub(r'[-_]\d+$', '', name)
+
+
+def _base_path(path):
+    """Output path without a .prof/.txt/.folded extension"""
+    base, ext = os.path.splitext(path)
+    return base if ext in ('.prof', '.txt', '.folded') else path
+
+
+def start(path, mode='cprofile', interval=DEFAULT_SAMPLE_INTERVAL, at_exit=True):
+    """Start profiling into files named after path; returns the session
+
+    With at_exit the files are written when the process exits, unless
+    stop() is called first. Only one session runs at a time.
+    """
+    global _session
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode} (choose from {', '.join(PROFILE_MODES)})")
+    with _lock:
+        if _session is not None:
+            raise RuntimeError(f"A profile is already being recorded to {_session.base}")
+        base = _base_path(path)
+        session = CProfileSession(base) if mode == 'cprofile' else SampleSession(base, interval)
+        session.start()
+        _session = session
+    if at_exit:
+        atexit.register(stop)
+    return session
+
+
+def stop():
+    """Stop the running session and write its files; returns their paths ([] if none ran)"""
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is None:
+        return []
+    atexit.unregister(stop)
+    paths = session.stop()
+    print(f"Profile written to {', '.join(paths)}", file=sys.stderr)
+    return paths
+
+
+def active():
+    """The running session, or None"""
+    return _session
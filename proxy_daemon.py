@@ -0,0 +1,483 @@
+"""
+Long-running daemon that keeps database, ADB and proxy state warm and serves
+JSON-RPC requests over a UNIX domain socket
+"""
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from tracing import span
+
+
+def _runtime_dir():
+    """Per-user directory for the socket: $XDG_RUNTIME_DIR, else a private one under the temp dir"""
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.environ['XDG_RUNTIME_DIR']
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), f'mobile-proxy-{user}')
+
+
+DEFAULT_SOCKET_PATH = os.environ.get('MOBILE_PROXY_SOCKET') or os.path.join(_runtime_dir(), 'mobile_proxy.sock')
+
+# How often the daemon re-runs `adb version` (adb_manager.ADB_CHECK_TTL is
+# the cache of the adb path shared by CLI processes)
+ADB_REFRESH_INTERVAL = 60
+
+# Finished jobs older than this are deleted, checked hourly
+JOB_RETENTION = 7 * 86400
+
+# Methods clients may call, per exposed service. Database calls are served by
+# the daemon's FleetState, so reads come from memory.
+EXPOSED_METHODS = {
+    'db': (
+        'get_devices', 'get_device_by_serial', 'get_connections', 'get_connection',
+        'get_connection_by_port', 'get_connections_by_serial', 'get_connections_by_status',
+        'get_device_tags', 'get_devices_by_tags', 'get_connections_by_tags',
+        'add_device', 'upsert_devices', 'add_connection', 'update_connection_status',
+        'update_connection_statuses', 'delete_connection', 'delete_device',
+        'set_device_tags', 'remove_device_tags',
+    ),
+    'job': (
+        'submit', 'get_job', 'get_results', 'list_jobs',
+    ),
+    'adb': (
+        'check_adb_available', 'get_connected_devices', 'get_device_info',
+        'get_device_property', 'get_device_ip', 'toggle_airplane_mode',
+        'enable_airplane_mode', 'disable_airplane_mode', 'list_port_forwards',
+    ),
+    'proxy': (
+        'start_proxy', 'stop_proxy', 'check_ip', 'check_connection', 'get_active_forwards',
+    ),
+}
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+class DaemonError(Exception):
+    """Error returned by the daemon for a JSON-RPC call"""
+
+
+class ProxyDaemon:
+    """Owns the Database/ADBManager/ProxyManager instances for the process lifetime"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, db_path='mobile_proxy.db', refresh_interval=10,
+                 job_workers=32, http_address=None, http_token=None, relay_mode=None):
+        from database import Database
+        from adb_manager import ADBManager
+        from proxy_manager import ProxyManager
+        from fleet_state import FleetState
+        from status_buffer import StatusWriteBuffer
+        from timeseries import TimeSeriesStore
+        from monitor import ConnectionMonitor
+        from jobs import JobManager, JobStore
+        from metrics import CONNECTIONS, DEVICES
+
+        self.socket_path = socket_path
+        self.db = Database(db_path)
+        # Status and IP updates are batched into one commit every couple of seconds
+        self.status_buffer = StatusWriteBuffer(self.db)
+        self.fleet = FleetState(self.db, self.status_buffer)
+        self.adb = ADBManager()
+        # With a relay, proxy traffic passes through this process and is
+        # accounted in the monitor
+        relay = None
+        if relay_mode:
+            from relay import create_relay
+            relay = create_relay(relay_mode)
+        self.proxy = ProxyManager(self.adb, relay)
+        self.timeseries = TimeSeriesStore(self.db)
+        self.monitor = ConnectionMonitor(self.fleet, self.proxy, self.timeseries)
+        if relay:
+            relay.on_traffic = self.monitor.record_port_traffic
+        # Fleet gauges are read from the cache when metrics are scraped
+        DEVICES.set_function(lambda: len(self.fleet.get_devices()))
+        for status in ('active', 'stopped'):
+            CONNECTIONS.labels(status=status).set_function(
+                lambda status=status: len(self.fleet.get_connections_by_status(status)))
+        self.jobs = JobManager(self.fleet, self.adb, self.proxy, JobStore(self.db),
+                               max_workers=job_workers, on_result=self._job_result)
+        self.refresh_interval = refresh_interval
+        # (host, port) for the REST API, or None to serve only the socket
+        self.http_address = http_address
+        self.http_token = http_token
+        self.api = None
+        self.started_at = time.time()
+        self.server = None
+        self._stopped = threading.Event()
+
+        self._adb_available = None
+        self._adb_checked_at = 0
+
+        self.services = {
+            'db': self.fleet,
+            'adb': self.adb,
+            'proxy': self.proxy,
+            'job': self.jobs,
+        }
+        self.methods = {
+            'daemon.ping': self.ping,
+            'daemon.status': self.status,
+            'daemon.refresh': self.refresh,
+            'daemon.shutdown': self.shutdown,
+            # Served from cache so thin clients do not fork `adb version`
+            'adb.check_adb_available': self.check_adb_available,
+            'adb.toggle_airplane_mode': self.toggle_airplane_mode,
+            'monitor.snapshot': self.monitor.snapshot,
+            'daemon.profile_start': self.profile_start,
+            'daemon.profile_stop': self.profile_stop,
+        }
+        # Methods that report per-item progress as JSON-RPC notifications
+        # before their final response; they receive an on_result callback
+        self.streaming_methods = {
+            'fleet.start_all': self.start_all,
+            'fleet.stop_all': self.stop_all,
+            'fleet.check_all_ips': self.check_all_ips,
+            'fleet.change_all_ips': self.change_all_ips,
+            'job.follow': self.follow_job,
+        }
+
+    # Daemon-level methods
+    def ping(self):
+        """Liveness check"""
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started_at}
+
+    def status(self):
+        """Summary of the state the daemon is holding"""
+        connections = self.fleet.get_connections()
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started_at,
+            'adb_available': self.check_adb_available(),
+            'devices': len(self.fleet.get_devices()),
+            'connections': len(connections),
+            'active_connections': sum(1 for c in connections if c[5] == 'active'),
+            'active_forwards': len(self.proxy.get_active_forwards()),
+            'pending_status_writes': self.status_buffer.pending_count(),
+        }
+
+    def profile_start(self, path=None, interval=None):
+        """Start sampling the stacks of every daemon thread until profile_stop()
+
+        path names the output files (default profile-<time> in the daemon's
+        working directory). Returns {'base', 'mode'}.
+        """
+        import profiling
+
+        path = path or os.path.abspath(time.strftime('profile-%Y%m%d-%H%M%S'))
+        session = profiling.start(path, 'sample', interval or profiling.DEFAULT_SAMPLE_INTERVAL)
+        return {'base': session.base, 'mode': session.mode}
+
+    def profile_stop(self):
+        """Stop the profile started by profile_start(); returns the files written"""
+        import profiling
+
+        if profiling.active() is None:
+            raise RuntimeError("No profile is being recorded")
+        return profiling.stop()
+
+    def refresh(self):
+        """Reload fleet state from the database"""
+        return len(self.fleet.refresh())
+
+    # Bulk actions; parallel and timeout default (None) to the bulk_ops defaults
+    def start_all(self, on_result, parallel=None, timeout=None, selector=None):
+        """Start every stopped connection; per-item results go to on_result"""
+        import bulk_ops
+        return bulk_ops.start_all(self.fleet, self.proxy, *_bulk_limits(parallel, timeout), on_result,
+                                  selector)[1]
+
+    def stop_all(self, on_result, parallel=None, timeout=None, selector=None):
+        """Stop every active connection; per-item results go to on_result"""
+        import bulk_ops
+        return bulk_ops.stop_all(self.fleet, self.proxy, *_bulk_limits(parallel, timeout), on_result,
+                                 selector)[1]
+
+    def check_all_ips(self, on_result, parallel=None, timeout=None, selector=None):
+        """Check every device IP; per-item results go to on_result"""
+        import bulk_ops
+        return bulk_ops.check_all_ips(self.fleet, self.adb, *_bulk_limits(parallel, timeout), on_result,
+                                      selector)[1]
+
+    def change_all_ips(self, on_result, parallel=None, timeout=None, selector=None, wait_time=5):
+        """Rotate device IPs and record the rotations; per-item results go to on_result"""
+        import bulk_ops
+
+        def record(result):
+            if result['ok']:
+                self.monitor.record_rotation(result['item']['serial'])
+            on_result(result)
+
+        return bulk_ops.change_all_ips(self.fleet, self.adb, *_bulk_limits(parallel, timeout), record,
+                                       selector, wait_time)[1]
+
+    def follow_job(self, on_result, job_id, after=0):
+        """Stream a job's results; returns the final job record"""
+        record = self.jobs.follow(job_id, on_result, after)
+        if record is None:
+            raise DaemonError(f"Job {job_id} not found")
+        return record
+
+    def _job_result(self, job, result):
+        """Record rotations done by background jobs"""
+        if job.action == 'change_all_ips' and result['ok']:
+            self.monitor.record_rotation(result['item']['serial'])
+
+    def toggle_airplane_mode(self, serial, wait_time=5):
+        """Rotate a device's IP and record the rotation for its connections"""
+        success = self.adb.toggle_airplane_mode(serial, wait_time)
+        if success:
+            self.monitor.record_rotation(serial)
+        return success
+
+    def check_adb_available(self):
+        """ADB availability, re-checked at most every ADB_REFRESH_INTERVAL seconds"""
+        now = time.time()
+        if self._adb_available is None or now - self._adb_checked_at > ADB_REFRESH_INTERVAL:
+            self._adb_available = self.adb.check_adb_available()
+            self._adb_checked_at = now
+        return self._adb_available
+
+    def shutdown(self):
+        """Stop serving after the current request"""
+        self._stopped.set()
+        if self.server:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return True
+
+    # Dispatch
+    def resolve(self, method):
+        """Find the callable for a JSON-RPC method name, or None"""
+        if method in self.methods:
+            return self.methods[method]
+
+        service, _, name = method.partition('.')
+        if name in EXPOSED_METHODS.get(service, ()):
+            return getattr(self.services[service], name)
+        return None
+
+    def handle_request(self, request, notify=None):
+        """Execute one JSON-RPC request object and return the response object
+
+        notify(params) sends a progress notification to the caller; it is
+        handed to streaming methods as their on_result callback.
+        """
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return _error_response(None, INVALID_REQUEST, 'Invalid request')
+
+        request_id = request.get('id')
+        func = self.resolve(request['method'])
+        if func is None and request['method'] in self.streaming_methods:
+            streaming = self.streaming_methods[request['method']]
+            func = lambda *args, **kwargs: streaming(notify or (lambda params: None), *args, **kwargs)
+        if func is None:
+            return _error_response(request_id, METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+
+        params = request.get('params') or []
+        try:
+            if isinstance(params, dict):
+                result = func(**params)
+            else:
+                result = func(*params)
+        except Exception as e:
+            return _error_response(request_id, INTERNAL_ERROR, str(e))
+
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    # Serving
+    def serve_forever(self):
+        """Bind the socket and serve until shutdown or SIGTERM/SIGINT"""
+        _prepare_socket_dir(self.socket_path)
+        _remove_stale_socket(self.socket_path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def send(self, message):
+                self.wfile.write(json.dumps(message, default=str).encode() + b'\n')
+                self.wfile.flush()
+
+            def notify(self, params):
+                self.send({'jsonrpc': '2.0', 'method': 'progress', 'params': params})
+
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        response = _error_response(None, PARSE_ERROR, 'Parse error')
+                    else:
+                        response = daemon.handle_request(request, self.notify)
+                    self.send(response)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        # The socket gives full control of the fleet; only its owner may connect
+        os.chmod(self.socket_path, 0o600)
+
+        def stop(signum, frame):
+            self.shutdown()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+
+        # Pick up changes made by processes that bypass the daemon
+        threading.Thread(target=self._refresh_loop, name='fleet-refresh', daemon=True).start()
+        self.status_buffer.start()
+        self.monitor.start()
+
+        if self.http_address:
+            from api_server import ApiServer
+            self.api = ApiServer(self, *self.http_address, token=self.http_token)
+            self.api.start_in_thread()
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self._stopped.set()
+            if self.api:
+                self.api.stop()
+            self.monitor.stop()
+            self.jobs.shutdown(wait=False)
+            self.proxy.close(self.fleet)
+            # Last, so the statuses written while shutting down reach the database
+            self.status_buffer.stop()
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _refresh_loop(self):
+        last_prune = 0
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.fleet.refresh()
+                if time.time() - last_prune >= 3600:
+                    self.jobs.store.prune(JOB_RETENTION)
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"Error refreshing fleet state: {e}")
+
+
+def _bulk_limits(parallel, timeout):
+    """(parallel, timeout) with None replaced by the bulk_ops defaults"""
+    import bulk_ops
+    return (bulk_ops.DEFAULT_PARALLEL if parallel is None else parallel,
+            bulk_ops.DEFAULT_TIMEOUT if timeout is None else timeout)
+
+
+def _error_response(request_id, code, message):
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def _prepare_socket_dir(socket_path):
+    """Create the socket's directory; the default one must be private to this user"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if directory != os.path.abspath(_runtime_dir()):
+        os.makedirs(directory, exist_ok=True)
+        return
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    # Someone else could swap the socket in a directory they own or can write to
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o022):
+        raise RuntimeError(f"{directory} must be owned by you and not writable by others")
+
+
+def _remove_stale_socket(socket_path):
+    """Remove a socket file left by a dead daemon; refuse to replace a live one"""
+    if not os.path.exists(socket_path):
+        return
+    client = connect(socket_path)
+    if client is not None:
+        client.close()
+        raise RuntimeError(f"A daemon is already listening on {socket_path}")
+    os.unlink(socket_path)
+
+
+class DaemonClient:
+    """JSON-RPC client for a running ProxyDaemon"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.next_id = 1
+        # One request in flight at a time on the shared socket
+        self.lock = threading.Lock()
+
+    def call(self, method, *params, on_progress=None):
+        """Call a daemon method and return its result
+
+        Progress notifications sent before the response are passed to
+        on_progress(params) as they arrive.
+        """
+        with span(f'rpc {method}', 'rpc'), self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            request = {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': list(params)}
+            self.sock.sendall(json.dumps(request).encode() + b'\n')
+
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    raise DaemonError('Daemon closed the connection')
+                message = json.loads(line)
+                if 'id' not in message:
+                    if on_progress:
+                        on_progress(message.get('params'))
+                    continue
+                if 'error' in message:
+                    raise DaemonError(message['error']['message'])
+                return message['result']
+
+    def service(self, name):
+        """Get a stand-in for the daemon's 'db', 'adb' or 'proxy' object"""
+        return RemoteService(self, name)
+
+    def close(self):
+        """Close the connection to the daemon"""
+        self.rfile.close()
+        self.sock.close()
+
+
+class RemoteService:
+    """Forwards method calls to the matching daemon service
+
+    Lets the CLI command functions run unchanged against the daemon's warm
+    instances. Rows come back as lists rather than tuples.
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr not in EXPOSED_METHODS[self._name]:
+            raise AttributeError(attr)
+        method = f'{self._name}.{attr}'
+        return lambda *params: self._client.call(method, *params)
+
+
+def connect(socket_path=DEFAULT_SOCKET_PATH, timeout=5):
+    """Connect to a running daemon; returns a DaemonClient or None"""
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    # Calls such as toggle_airplane_mode legitimately take many seconds
+    sock.settimeout(None)
+    return DaemonClient(sock)
@@ -3,30 +3,79 @@ Proxy Manager module for handling proxy connections and IP checking
 """
 import socket
 import threading
-import requests
 import time
 
+from metrics import FORWARD_SETUP_FAILURES, FORWARD_SETUP_SECONDS
+from tracing import traced
+
 
 class ProxyManager:
-    def __init__(self, adb_manager):
+    """Start and stop proxy connections
+
+    By default a connection is a plain adb forward from local_port to the
+    phone. With a relay (see relay.py) adb forwards a port of its choosing
+    instead, and the relay listens on local_port and copies traffic to it,
+    so bytes and clients can be counted. Relayed connections only live as
+    long as the process that started them.
+    """
+
+    def __init__(self, adb_manager, relay=None):
         self.adb_manager = adb_manager
+        self.relay = relay
         self.active_forwards = {}
     
+    @traced('proxy.start_proxy', 'proxy')
     def start_proxy(self, serial, local_port, remote_port):
         """Start a proxy connection"""
-        success = self.adb_manager.create_port_forward(serial, local_port, remote_port)
-        
-        if success:
-            self.active_forwards[local_port] = {
-                'serial': serial,
-                'remote_port': remote_port,
-                'status': 'active'
-            }
+        mode = 'direct' if self.relay is None else 'relay'
+        started = time.perf_counter()
+        if mode == 'relay':
+            success = self._start_relayed(serial, local_port, remote_port)
+        else:
+            success = self.adb_manager.create_port_forward(serial, local_port, remote_port)
+            if success:
+                self.active_forwards[local_port] = {
+                    'serial': serial,
+                    'remote_port': remote_port,
+                    'status': 'active'
+                }
         
+        FORWARD_SETUP_SECONDS.labels(mode=mode).observe(time.perf_counter() - started)
+        if not success:
+            FORWARD_SETUP_FAILURES.labels(mode=mode).inc()
         return success
     
+    def _start_relayed(self, serial, local_port, remote_port):
+        """Relay local_port to an adb forward on a port picked by adb"""
+        if self.relay.is_relaying(local_port):
+            self.stop_proxy(serial, local_port)
+
+        forward_port = self.adb_manager.create_dynamic_forward(serial, remote_port)
+        if forward_port is None:
+            return False
+        if not self.relay.start(local_port, local_port, forward_port):
+            self.adb_manager.remove_port_forward(serial, forward_port)
+            return False
+
+        self.active_forwards[local_port] = {
+            'serial': serial,
+            'remote_port': remote_port,
+            'status': 'active',
+            'forward_port': forward_port,
+        }
+        return True
+    
+    @traced('proxy.stop_proxy', 'proxy')
     def stop_proxy(self, serial, local_port):
         """Stop a proxy connection"""
+        forward = self.active_forwards.get(local_port)
+        if forward and forward.get('forward_port'):
+            self.relay.stop(local_port)
+            self.adb_manager.remove_port_forward(serial, forward['forward_port'])
+            # The relay is gone either way; a leftover forward is harmless
+            del self.active_forwards[local_port]
+            return True
+
         success = self.adb_manager.remove_port_forward(serial, local_port)
         
         if success and local_port in self.active_forwards:
@@ -36,6 +85,9 @@ class ProxyManager:
     
     def check_ip(self, timeout=10):
         """Check public IP address"""
+        # Imported here: requests is slow to load and most callers never need it
+        import requests
+        
         try:
             response = requests.get('https://api.ipify.org?format=json', timeout=timeout)
             if response.status_code == 200:
@@ -53,6 +105,7 @@ class ProxyManager:
         
         return None
     
+    @traced('proxy.check_connection', 'proxy')
     def check_connection(self, local_port, timeout=5):
         """Check if a connection on local_port is working"""
         try:
@@ -65,6 +118,47 @@ class ProxyManager:
             print(f"Error checking connection on port {local_port}: {e}")
             return False
     
+    @traced('proxy.probe_connection', 'proxy')
+    def probe_connection(self, local_port, timeout=5):
+        """Measure TCP connect latency to local_port in milliseconds, or None on failure"""
+        started = time.perf_counter()
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            result = sock.connect_ex(('127.0.0.1', local_port))
+            sock.close()
+        except Exception as e:
+            print(f"Error probing connection on port {local_port}: {e}")
+            return None
+        
+        if result != 0:
+            return None
+        return (time.perf_counter() - started) * 1000
+    
     def get_active_forwards(self):
         """Get all active port forwards"""
         return self.active_forwards.copy()
+    
+    def close(self, db=None):
+        """Stop relayed connections and the relay; plain adb forwards stay in place
+
+        Relayed connections die with the relay, so their adb forwards are
+        removed and, when db is given, their connections are marked
+        'stopped'. Returns the local ports that were stopped.
+        """
+        if self.relay is None:
+            return []
+
+        relayed = [(local_port, forward['serial']) for local_port, forward in self.active_forwards.items()
+                   if forward.get('forward_port')]
+        for local_port, serial in relayed:
+            try:
+                self.stop_proxy(serial, local_port)
+            except Exception as e:
+                print(f"Error stopping relayed connection on port {local_port}: {e}")
+            if db is not None:
+                row = db.get_connection_by_port(local_port)
+                if row:
+                    db.update_connection_status(row[0], 'stopped')
+        self.relay.close()
+        return [local_port for local_port, _ in relayed]
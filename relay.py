@@ -0,0 +1,432 @@
+"""
+In-process TCP relay between proxy clients and adb forwards, with traffic
+accounting
+"""
+import itertools
+import socket
+import threading
+
+from metrics import RELAY_ACTIVE_CONNECTIONS, RELAY_BYTES, RELAY_CONNECTIONS
+
+
+RELAY_MODES = ('asyncio', 'thread')
+DEFAULT_BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1.0
+CONNECT_TIMEOUT = 10
+
+# Process-wide byte counters, indexed like the per-client counts
+_BYTES_METRICS = (RELAY_BYTES.labels(direction='in'), RELAY_BYTES.labels(direction='out'))
+
+
+class _Listener:
+    """Bookkeeping for one relayed port
+
+    clients maps a client id to its [bytes_in, bytes_out] counters; each
+    counter is only written by the pump moving data in that direction, so
+    the data path needs no lock. bytes_in is traffic from the phone to the
+    client, bytes_out from the client to the phone.
+    """
+
+    __slots__ = ('key', 'listen_port', 'target_host', 'target_port', 'clients', 'sockets',
+                 'closed', 'reported', 'reported_clients', 'quiet', 'handle')
+
+    def __init__(self, key, listen_port, target_host, target_port):
+        self.key = key
+        self.listen_port = listen_port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.clients = {}
+        self.sockets = {}
+        self.closed = [0, 0]
+        self.reported = [0, 0]
+        self.reported_clients = 0
+        self.quiet = True
+        self.handle = None
+
+
+class BaseRelay:
+    """Listeners by key plus periodic traffic reports
+
+    on_traffic(key, bytes_in, bytes_out, clients) receives the bytes relayed
+    since the previous report, at most every flush_interval seconds, for
+    listeners whose traffic or client count changed (and once more when
+    traffic stops, so rates drop to zero). Keys are chosen by the caller;
+    ProxyManager uses the local port.
+    """
+
+    mode = None
+
+    def __init__(self, on_traffic=None, host='127.0.0.1', buffer_size=DEFAULT_BUFFER_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.on_traffic = on_traffic
+        self.host = host
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.listeners = {}
+        self.lock = threading.Lock()
+        self._client_ids = itertools.count(1)
+
+    # Client bookkeeping
+    def _client_opened(self, listener, sockets):
+        client_id = next(self._client_ids)
+        counts = [0, 0]
+        with self.lock:
+            listener.clients[client_id] = counts
+            listener.sockets[client_id] = sockets
+        RELAY_CONNECTIONS.inc()
+        RELAY_ACTIVE_CONNECTIONS.inc()
+        return client_id, counts
+
+    def _client_closed(self, listener, client_id):
+        with self.lock:
+            counts = listener.clients.pop(client_id, None)
+            listener.sockets.pop(client_id, None)
+            if counts:
+                listener.closed[0] += counts[0]
+                listener.closed[1] += counts[1]
+        if counts:
+            RELAY_ACTIVE_CONNECTIONS.dec()
+
+    # Reporting
+    def _report(self, listener):
+        with self.lock:
+            bytes_in, bytes_out = listener.closed
+            for counts in listener.clients.values():
+                bytes_in += counts[0]
+                bytes_out += counts[1]
+            clients = len(listener.clients)
+
+        delta_in = bytes_in - listener.reported[0]
+        delta_out = bytes_out - listener.reported[1]
+        idle = not (delta_in or delta_out)
+        if idle and clients == listener.reported_clients and listener.quiet:
+            return
+        listener.reported = [bytes_in, bytes_out]
+        listener.reported_clients = clients
+        listener.quiet = idle
+
+        if self.on_traffic:
+            try:
+                self.on_traffic(listener.key, delta_in, delta_out, clients)
+            except Exception as e:
+                print(f"Error reporting relay traffic: {e}")
+
+    def flush(self):
+        """Report traffic for every listener now"""
+        with self.lock:
+            listeners = list(self.listeners.values())
+        for listener in listeners:
+            self._report(listener)
+
+    def stats(self):
+        """{key: {'listen_port', 'target_port', 'clients', 'bytes_in', 'bytes_out'}}"""
+        result = {}
+        with self.lock:
+            for key, listener in self.listeners.items():
+                bytes_in, bytes_out = listener.closed
+                for counts in listener.clients.values():
+                    bytes_in += counts[0]
+                    bytes_out += counts[1]
+                result[key] = {'listen_port': listener.listen_port,
+                               'target_port': listener.target_port,
+                               'clients': len(listener.clients),
+                               'bytes_in': bytes_in, 'bytes_out': bytes_out}
+        return result
+
+    def is_relaying(self, key):
+        """Whether a listener with this key is running"""
+        with self.lock:
+            return key in self.listeners
+
+    def _claim(self, key, listener):
+        """Register a listener; False if the key is taken"""
+        with self.lock:
+            if key in self.listeners:
+                return False
+            self.listeners[key] = listener
+            return True
+
+    def _release(self, key):
+        with self.lock:
+            return self.listeners.pop(key, None)
+
+    # Interface
+    def start(self, key, listen_port, target_port, target_host='127.0.0.1'):
+        """Listen on listen_port and relay each client to target_port; returns success"""
+        raise NotImplementedError
+
+    def stop(self, key):
+        """Stop listening and drop the clients of one listener; returns whether it existed"""
+        raise NotImplementedError
+
+    def close(self):
+        """Stop every listener and release the relay's threads"""
+        raise NotImplementedError
+
+
+class ThreadRelay(BaseRelay):
+    """Blocking sockets: an accept thread per port and two copy threads per client"""
+
+    mode = 'thread'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def start(self, key, listen_port, target_port, target_host='127.0.0.1'):
+        listener = _Listener(key, listen_port, target_host, target_port)
+        if not self._claim(key, listener):
+            return False
+        try:
+            listener.handle = socket.create_server((self.host, listen_port), backlog=128)
+        except OSError as e:
+            self._release(key)
+            print(f"Error starting relay on port {listen_port}: {e}")
+            return False
+
+        threading.Thread(target=self._accept_loop, args=(listener,),
+                         name=f'relay-accept-{listen_port}', daemon=True).start()
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='relay-flush', daemon=True)
+            self._flusher.start()
+        return True
+
+    def stop(self, key):
+        listener = self._release(key)
+        if listener is None:
+            return False
+        _shutdown_socket(listener.handle)
+        listener.handle.close()
+        with self.lock:
+            sockets = [s for pair in listener.sockets.values() for s in pair]
+        for sock in sockets:
+            _shutdown_socket(sock)
+        self._report(listener)
+        return True
+
+    def close(self):
+        for key in list(self.listeners):
+            self.stop(key)
+        self._closed.set()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def _accept_loop(self, listener):
+        server = listener.handle
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                # The listening socket was shut down by stop()
+                return
+            threading.Thread(target=self._serve_client, args=(listener, client), daemon=True).start()
+
+    def _serve_client(self, listener, client):
+        try:
+            upstream = socket.create_connection((listener.target_host, listener.target_port),
+                                                timeout=CONNECT_TIMEOUT)
+        except OSError:
+            client.close()
+            return
+        upstream.settimeout(None)
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client_id, counts = self._client_opened(listener, (client, upstream))
+        try:
+            outbound = threading.Thread(target=self._pump, args=(client, upstream, counts, 1), daemon=True)
+            outbound.start()
+            self._pump(upstream, client, counts, 0)
+            outbound.join()
+        finally:
+            client.close()
+            upstream.close()
+            self._client_closed(listener, client_id)
+
+    def _pump(self, src, dst, counts, index):
+        """Copy src to dst until EOF; counts[index] += bytes copied"""
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        metric = _BYTES_METRICS[index]
+        try:
+            while True:
+                n = src.recv_into(buffer)
+                if not n:
+                    break
+                dst.sendall(view[:n])
+                counts[index] += n
+                metric.inc(n)
+        except OSError:
+            # A reset on either side ends both directions
+            _shutdown_socket(src)
+            _shutdown_socket(dst)
+            return
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class AsyncioRelay(BaseRelay):
+    """All ports and clients on one asyncio event loop in a background thread
+
+    loop_factory creates the event loop (e.g. uvloop.new_event_loop); the
+    default is asyncio's own.
+    """
+
+    mode = 'asyncio'
+
+    def __init__(self, *args, loop_factory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop_factory = loop_factory
+        self.loop = None
+        self._thread = None
+        self._loop_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._loop_lock:
+            if self.loop is not None:
+                return self.loop
+            import asyncio
+
+            self.loop = (self.loop_factory or asyncio.new_event_loop)()
+            self._thread = threading.Thread(target=self._run_loop, name='relay-loop', daemon=True)
+            self._thread.start()
+            return self.loop
+
+    def _run_loop(self):
+        import asyncio
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._flush_loop())
+        self.loop.run_forever()
+
+    def _call(self, coroutine, timeout=CONNECT_TIMEOUT):
+        """Run a coroutine on the relay loop and wait for its result"""
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result(timeout)
+
+    def start(self, key, listen_port, target_port, target_host='127.0.0.1'):
+        listener = _Listener(key, listen_port, target_host, target_port)
+        if not self._claim(key, listener):
+            return False
+        try:
+            listener.handle = self._call(self._start_server(listener))
+        except OSError as e:
+            self._release(key)
+            print(f"Error starting relay on port {listen_port}: {e}")
+            return False
+        return True
+
+    def stop(self, key):
+        listener = self._release(key)
+        if listener is None:
+            return False
+        self._call(self._stop_server(listener))
+        self._report(listener)
+        return True
+
+    def close(self):
+        for key in list(self.listeners):
+            self.stop(key)
+        with self._loop_lock:
+            loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        import asyncio
+
+        asyncio.run_coroutine_threadsafe(self._cancel_tasks(), loop).result(CONNECT_TIMEOUT)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+    async def _flush_loop(self):
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    async def _cancel_tasks(self):
+        import asyncio
+
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _start_server(self, listener):
+        import asyncio
+
+        return await asyncio.start_server(
+            lambda reader, writer: self._serve_client(listener, reader, writer),
+            self.host, listener.listen_port, backlog=128,
+        )
+
+    async def _stop_server(self, listener):
+        listener.handle.close()
+        with self.lock:
+            writers = [w for pair in listener.sockets.values() for w in pair]
+        for writer in writers:
+            writer.close()
+
+    async def _serve_client(self, listener, reader, writer):
+        import asyncio
+
+        try:
+            up_reader, up_writer = await asyncio.wait_for(
+                asyncio.open_connection(listener.target_host, listener.target_port),
+                CONNECT_TIMEOUT,
+            )
+        except (OSError, asyncio.TimeoutError):
+            writer.close()
+            return
+
+        client_id, counts = self._client_opened(listener, (writer, up_writer))
+        try:
+            await asyncio.gather(
+                self._pump(up_reader, writer, counts, 0),
+                self._pump(reader, up_writer, counts, 1),
+            )
+        finally:
+            writer.close()
+            up_writer.close()
+            self._client_closed(listener, client_id)
+
+    async def _pump(self, reader, writer, counts, index):
+        """Copy reader to writer until EOF; counts[index] += bytes copied"""
+        metric = _BYTES_METRICS[index]
+        try:
+            while True:
+                data = await reader.read(self.buffer_size)
+                if not data:
+                    break
+                writer.write(data)
+                counts[index] += len(data)
+                metric.inc(len(data))
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            # A reset on either side ends both directions
+            writer.close()
+
+
+def _shutdown_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def create_relay(mode='asyncio', **kwargs):
+    """Relay for one of RELAY_MODES"""
+    if mode == 'thread':
+        return ThreadRelay(**kwargs)
+    if mode == 'asyncio':
+        return AsyncioRelay(**kwargs)
+    raise ValueError(f"Unknown relay mode: {mode} (choose from {', '.join(RELAY_MODES)})")
@@ -0,0 +1,136 @@
+"""
+Fixed-size per-connection history (throughput, clients, latency) for the
+GUI's sparkline charts
+"""
+import math
+from array import array
+
+
+DEFAULT_CAPACITY = 60
+
+
+class RingBuffer:
+    """Fixed-capacity series of floats backed by a preallocated array
+
+    Appending overwrites the oldest sample once the buffer is full, so
+    memory stays constant however long the app runs. None is stored as NaN
+    (a gap, e.g. a failed probe).
+    """
+
+    __slots__ = ('capacity', 'data', 'start', 'count')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.data = array('d', [math.nan]) * capacity
+        self.start = 0
+        self.count = 0
+
+    def append(self, value):
+        """Add a sample, dropping the oldest if full"""
+        index = (self.start + self.count) % self.capacity
+        self.data[index] = math.nan if value is None else value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def values(self):
+        """Samples oldest first"""
+        end = self.start + self.count
+        if end <= self.capacity:
+            return self.data[self.start:end]
+        return self.data[self.start:] + self.data[:end - self.capacity]
+
+    def last(self):
+        """Newest sample, or None if empty or a gap"""
+        if not self.count:
+            return None
+        value = self.data[(self.start + self.count - 1) % self.capacity]
+        return None if math.isnan(value) else value
+
+    def peak(self):
+        """Largest sample, ignoring gaps (0 if there is none)"""
+        return max((v for v in self.values() if not math.isnan(v)), default=0.0)
+
+    def __len__(self):
+        return self.count
+
+
+class ConnectionSeries:
+    """Throughput (bytes/s), client count and probe latency (ms) of one connection"""
+
+    __slots__ = ('throughput', 'clients', 'latency')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.throughput = RingBuffer(capacity)
+        self.clients = RingBuffer(capacity)
+        self.latency = RingBuffer(capacity)
+
+
+class SeriesStore:
+    """Samples ConnectionMonitor snapshots into a ConnectionSeries per connection
+
+    update() folds in the delta since the last version seen and sample()
+    appends the latest values of every connection, so calling both on a
+    fixed interval gives evenly spaced series regardless of how often the
+    monitor reports.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.series = {}
+        self.latest = {}
+        self.version = 0
+
+    def update(self, snapshot):
+        """Apply a monitor.snapshot(self.version) delta"""
+        if snapshot.get('full'):
+            ids = {row['id'] for row in snapshot['rows']}
+            for connection_id in [c for c in self.latest if c not in ids]:
+                self.latest.pop(connection_id)
+                self.series.pop(connection_id, None)
+        for row in snapshot['rows']:
+            self.latest[row['id']] = row
+        for connection_id in snapshot['removed']:
+            self.latest.pop(connection_id, None)
+            self.series.pop(connection_id, None)
+        self.version = snapshot['version']
+
+    def sample(self):
+        """Append one sample per connection"""
+        for connection_id, row in self.latest.items():
+            series = self.series.get(connection_id)
+            if series is None:
+                series = self.series[connection_id] = ConnectionSeries(self.capacity)
+            active = row['status'] == 'active'
+            series.throughput.append((row['bytes_rate'] or 0) if active else None)
+            series.clients.append(row['clients'] if active else None)
+            series.latency.append(row['last_latency'] if active else None)
+
+    def get(self, connection_id):
+        """ConnectionSeries for a connection, or None before its first sample"""
+        return self.series.get(connection_id)
+
+
+def sparkline_points(values, x, y, width, height, peak=None):
+    """Flat [x0, y0, x1, y1, ...] list for a Kivy Line scaled into the box
+
+    Samples are spread evenly across the width and gaps (NaN) are skipped.
+    The vertical scale runs from 0 to `peak` (the largest sample by
+    default). Fewer than two points gives [].
+    """
+    count = len(values)
+    if count < 2:
+        return []
+    if peak is None:
+        peak = max((v for v in values if not math.isnan(v)), default=0.0)
+    scale = height / peak if peak > 0 else 0.0
+    step = width / (count - 1)
+
+    points = []
+    for i, value in enumerate(values):
+        if math.isnan(value):
+            continue
+        points.append(x + i * step)
+        points.append(y + min(value, peak) * scale)
+    return points if len(points) >= 4 else []
@@ -0,0 +1,161 @@
+"""
+Write-behind buffer for high-frequency connection status and IP updates
+"""
+import threading
+from datetime import datetime
+
+
+class StatusWriteBuffer:
+    """Coalesce connection status updates in memory and flush them in batches
+
+    Only the latest status, IP and last_check per connection are kept, so the
+    number of SQLite writes depends on the number of connections that changed
+    between flushes, not on how often they were probed. Reads made through the
+    buffer see pending values immediately, and keep seeing a flushed batch
+    (in `inflight`) until its transaction has committed.
+    """
+
+    def __init__(self, db, flush_interval=2.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        # One batch in flight at a time, so `inflight` is a single batch
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def update_connection_status(self, connection_id, status, ip=None):
+        """Record a status update; same signature as Database.update_connection_status"""
+        with self.lock:
+            entry = self.pending.get(connection_id) or self.inflight.get(connection_id)
+            if ip:
+                self.pending[connection_id] = (status, ip, datetime.now())
+            elif entry:
+                # Keep the buffered IP, as a later status-only write would
+                self.pending[connection_id] = (status, entry[1], entry[2])
+            else:
+                self.pending[connection_id] = (status, None, None)
+
+    def update_connection_statuses(self, updates):
+        """Record many status updates; takes the (connection_id, status[, ip]) tuples
+        Database.update_connection_statuses does"""
+        for update in updates:
+            self.update_connection_status(*update[:3])
+
+    def get_pending(self, connection_id):
+        """Get the buffered (status, ip, last_check) for a connection, or None"""
+        with self.lock:
+            return self.pending.get(connection_id) or self.inflight.get(connection_id)
+
+    def pending_count(self):
+        """Number of connections with unflushed changes"""
+        with self.lock:
+            return len(self.pending)
+
+    def flush(self):
+        """Write all pending changes to the database in one transaction"""
+        with self._flush_lock:
+            with self.lock:
+                batch = self.inflight = self.pending
+                self.pending = {}
+
+            if not batch:
+                return 0
+
+            try:
+                written = self.db.update_connection_statuses(
+                    (connection_id, status, ip, last_check)
+                    for connection_id, (status, ip, last_check) in batch.items()
+                )
+            except Exception:
+                # Put back whatever has not been superseded in the meantime
+                with self.lock:
+                    for connection_id, entry in batch.items():
+                        self.pending.setdefault(connection_id, entry)
+                    self.inflight = {}
+                raise
+
+            with self.lock:
+                self.inflight = {}
+            return written
+
+    # Read-through accessors returning rows in Database.get_connections() format
+    def get_connection(self, connection_id):
+        """Get a single connection with pending changes applied"""
+        return self._overlay(self.db.get_connection(connection_id))
+
+    def get_connections(self, device_id=None):
+        """Get all connections with pending changes applied"""
+        return [self._overlay(row) for row in self.db.get_connections(device_id)]
+
+    def get_connection_by_port(self, local_port):
+        """Get the connection bound to a local port with pending changes applied"""
+        return self._overlay(self.db.get_connection_by_port(local_port))
+
+    def get_connections_by_serial(self, serial_number):
+        """Get a device's connections with pending changes applied"""
+        return [self._overlay(row) for row in self.db.get_connections_by_serial(serial_number)]
+
+    def get_connections_by_status(self, status):
+        """Get connections whose current (possibly buffered) status matches"""
+        rows = {row[0]: self._overlay(row) for row in self.db.get_connections_by_status(status)}
+
+        with self.lock:
+            buffered = {**self.inflight, **self.pending}
+        moved_in = [connection_id for connection_id, entry in buffered.items()
+                    if entry[0] == status and connection_id not in rows]
+        for connection_id in moved_in:
+            row = self.get_connection(connection_id)
+            if row:
+                rows[connection_id] = row
+
+        return [row for row in rows.values() if row[5] == status]
+
+    def _overlay(self, row):
+        """Apply the pending entry for a connection row, if any"""
+        if row is None:
+            return None
+
+        entry = self.get_pending(row[0])
+        if entry is None:
+            return row
+
+        status, ip, last_check = entry
+        if ip:
+            # Match the text form SQLite hands back for stored timestamps
+            return row[:5] + (status, ip, str(last_check))
+        return row[:5] + (status,) + row[6:]
+
+    # Background flushing
+    def start(self):
+        """Start flushing every flush_interval seconds in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='status-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush what is left"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing status updates: {e}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -0,0 +1,80 @@
+"""
+Background task dispatch for the GUI: a worker pool whose results are handed
+back to the UI thread
+"""
+import threading
+
+
+DEFAULT_WORKERS = 8
+
+
+class TaskDispatcher:
+    """Run blocking actions (adb calls, SQLite writes) off the UI thread
+
+    Every task has a key, e.g. ('check_ip', connection_id). While a task is
+    running, submitting the same key again does not start a second one: the
+    new on_done callback is attached to the running task instead, so double
+    clicks and overlapping bulk actions coalesce. on_done(result, error) is
+    delivered through `schedule`, which the GUI sets to hand callbacks to
+    Clock.schedule_once; by default it is called directly on the worker.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, schedule=None):
+        self.max_workers = max_workers
+        self.schedule = schedule or (lambda callback: callback())
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.executor = None
+        self.closed = False
+
+    def _executor(self):
+        if self.executor is None:
+            # Imported here so importing this module stays cheap
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                               thread_name_prefix='gui-task')
+        return self.executor
+
+    def submit(self, key, func, on_done=None):
+        """Run func() in the pool; returns False if `key` was already running"""
+        with self.lock:
+            if self.closed:
+                return False
+            waiters = self.in_flight.get(key)
+            if waiters is not None:
+                if on_done:
+                    waiters.append(on_done)
+                return False
+            self.in_flight[key] = [on_done] if on_done else []
+            executor = self._executor()
+        executor.submit(self._run, key, func)
+        return True
+
+    def _run(self, key, func):
+        result = error = None
+        try:
+            result = func()
+        except Exception as e:
+            error = e
+        with self.lock:
+            waiters = self.in_flight.pop(key, [])
+        for callback in waiters:
+            self.schedule(lambda callback=callback: callback(result, error))
+
+    def busy(self, key):
+        """Whether a task with this key is running"""
+        with self.lock:
+            return key in self.in_flight
+
+    def pending(self):
+        """Number of queued or running tasks"""
+        with self.lock:
+            return len(self.in_flight)
+
+    def shutdown(self, wait=False):
+        """Stop accepting tasks; queued ones are dropped unless wait is True"""
+        with self.lock:
+            self.closed = True
+            executor = self.executor
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test the cached adb lookup used by the CLI
+"""
+import os
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from adb_manager import resolve_adb
+
+
+def make_fake_adb(directory, counter):
+    """Write an `adb` script that counts its invocations"""
+    path = os.path.join(directory, 'adb')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n'
+                f'echo run >> "{counter}"\n'
+                'echo "Android Debug Bridge version 1.0.41"\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def test_resolve_adb_cache():
+    """A successful check is reused until the TTL expires or PATH changes"""
+    if os.name == 'nt':
+        print("⊘ Skipped on Windows")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        counter = os.path.join(tmp, 'runs')
+        state = os.path.join(tmp, 'state.json')
+        fake = make_fake_adb(tmp, counter)
+
+        def runs():
+            with open(counter) as f:
+                return len(f.readlines())
+
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = tmp + os.pathsep + old_path
+        try:
+            assert resolve_adb('adb', state) == (fake, 'Android Debug Bridge version 1.0.41')
+            assert resolve_adb('adb', state)[0] == fake
+            assert runs() == 1, "second lookup should come from the state file"
+
+            assert resolve_adb('adb', state, ttl=0)[0] == fake
+            assert runs() == 2, "expired entry should be re-checked"
+
+            os.environ['PATH'] = old_path + os.pathsep + tmp
+            resolve_adb('adb', state)
+            assert runs() == 3, "changed PATH should invalidate the entry"
+        finally:
+            os.environ['PATH'] = old_path
+
+        assert resolve_adb(os.path.join(tmp, 'missing-adb'), state) == (None, None)
+        print("✓ resolve_adb caches successful checks")
+
+
+if __name__ == '__main__':
+    test_resolve_adb_cache()
+    print("\n✅ All tests passed!")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test ADBManager against the simulated adb server and fake adb executable
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from adb_manager import ADBManager
+from adb_simulator import AdbSimulator
+
+
+def test_simulated_fleet():
+    """Discovery, forwards carrying traffic and IP rotation work through the fake adb"""
+    if os.name == 'nt':
+        print("⊘ Skipped on Windows")
+        return
+
+    tmp = tempfile.mkdtemp()
+    simulator = AdbSimulator(devices=3, airplane_latency=0.01, props={'ro.product.model': lambda i: f'Sim {i}'},
+                             seed=1)
+    simulator.start()
+    try:
+        adb = ADBManager(simulator.make_adb_executable(tmp))
+        assert adb.check_adb_available()
+
+        devices = adb.get_connected_devices()
+        assert [d['serial'] for d in devices] == ['sim00000', 'sim00001', 'sim00002']
+        assert devices[1]['model'] == 'Sim 1'
+        serial = devices[0]['serial']
+
+        port = adb.create_dynamic_forward(serial, 8080)
+        assert port and adb.list_all_forwards() == [(serial, port, 8080)]
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+            conn.sendall(b'ping')
+            assert conn.recv(4) == b'ping'
+        assert adb.remove_port_forward(serial, port)
+        assert adb.list_all_forwards() == []
+
+        ip = adb.get_device_ip(serial)
+        assert ip and ip == simulator.devices[serial].ip
+        assert adb.toggle_airplane_mode(serial, wait_time=0)
+        assert adb.get_device_ip(serial) not in (None, ip)
+        assert simulator.devices[serial].rotations == 1
+        print("✓ ADBManager drives simulated devices")
+    finally:
+        simulator.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_injected_faults():
+    """Failures and hangs surface as errors and latency"""
+    if os.name == 'nt':
+        print("⊘ Skipped on Windows")
+        return
+
+    tmp = tempfile.mkdtemp()
+    simulator = AdbSimulator(devices=1, failure_rate=1.0)
+    simulator.start()
+    try:
+        adb = ADBManager(simulator.make_adb_executable(tmp))
+        assert [d['model'] for d in adb.get_connected_devices()] == ['']
+        assert adb.get_device_ip('sim00000') is None
+        assert adb.create_dynamic_forward('sim00000', 8080) is None
+        assert adb.get_device_ip('missing') is None
+
+        simulator.failure_rate = 0.0
+        simulator.hang_rate, simulator.hang_time = 1.0, 0.3
+        start = time.monotonic()
+        assert adb.get_device_ip('sim00000')
+        assert time.monotonic() - start >= 0.3
+        print("✓ Injected failures and hangs")
+    finally:
+        simulator.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_concurrent_discovery():
+    """Threads sharing one ADBManager can discover devices while they come and go"""
+    if os.name == 'nt':
+        print("⊘ Skipped on Windows")
+        return
+
+    tmp = tempfile.mkdtemp()
+    simulator = AdbSimulator(devices=6)
+    simulator.start()
+    errors = []
+    try:
+        adb = ADBManager(simulator.make_adb_executable(tmp))
+        unplugged = simulator.devices['sim00005']
+
+        def discover():
+            try:
+                for _ in range(10):
+                    adb.get_connected_devices()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=discover) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for i in range(20):
+            # Mutate the simulator's fleet on its own event loop thread
+            if i % 2:
+                simulator.loop.call_soon_threadsafe(simulator.devices.__setitem__, 'sim00005', unplugged)
+            else:
+                simulator.loop.call_soon_threadsafe(simulator.devices.pop, 'sim00005', None)
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        print("✓ Concurrent device discovery shares the device cache safely")
+    finally:
+        simulator.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_simulated_fleet()
+    test_injected_faults()
+    test_concurrent_discovery()
+    print("\n✅ All tests passed!")
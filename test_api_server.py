@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test the asyncio REST API against a daemon's instances
+"""
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import api_server
+import proxy_daemon
+from api_server import ApiServer
+
+
+def request(port, method, path, body=None):
+    """Make one request and return (status, parsed JSON body)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request(method, path, json.dumps(body) if body is not None else None)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+def test_api_round_trip():
+    """Reads, errors and a streamed job over HTTP"""
+    tmp = tempfile.mkdtemp()
+    daemon = proxy_daemon.ProxyDaemon(os.path.join(tmp, 'daemon.sock'),
+                                      db_path=os.path.join(tmp, 'test.db'))
+    api = ApiServer(daemon, port=0)
+    api.start_in_thread()
+
+    try:
+        device_id = daemon.fleet.add_device('AAA', 'Pixel', '13')
+        daemon.fleet.set_device_tags(device_id, {'rack': '3'})
+        conn_id = daemon.fleet.add_connection(device_id, 9090, 8080)
+
+        status, body = request(api.port, 'GET', '/api/connections?select=rack=3')
+        assert status == 200 and [c['id'] for c in body] == [conn_id]
+        assert request(api.port, 'GET', '/api/devices')[1][0]['tags'] == {'rack': '3'}
+        for tags in ({'rack': ['a']}, {'rack': {'row': 1}}, {'rack': True}, ['rack']):
+            status, body = request(api.port, 'PUT', '/api/devices/AAA/tags', tags)
+            assert status == 400 and 'error' in body, (tags, status, body)
+        assert request(api.port, 'PUT', '/api/devices/AAA/tags', {'row': 7})[1]['tags'] == {'rack': '3', 'row': '7'}
+        daemon.fleet.remove_device_tags(device_id, ['row'])
+        assert request(api.port, 'GET', '/api/connections?select==x')[0] == 400
+        assert request(api.port, 'GET', f'/api/connections/{conn_id}')[1]['serial'] == 'AAA'
+        assert request(api.port, 'GET', '/api/connections/999')[0] == 404
+        assert request(api.port, 'DELETE', '/api/jobs')[0] == 405
+        assert request(api.port, 'POST', '/api/jobs', {'action': 'reboot'})[0] == 400
+        for body in ({'action': 'start_all', 'params': [1]}, {'action': 'start_all', 'params': {'parallel': 0}},
+                     {'action': 'start_all', 'params': {'parallel': 'x'}}, {'action': ['start_all']}):
+            status, error = request(api.port, 'POST', '/api/jobs', body)
+            assert status == 400 and 'error' in error, (body, status, error)
+        assert request(api.port, 'POST', '/api/devices/AAA/rotate', {'wait_time': 'abc'})[0] == 400
+        for path in ('/api/jobs?limit=ten', '/api/jobs/1/results?after=x', '/api/monitor?since=x'):
+            status, body = request(api.port, 'GET', path)
+            assert status == 400 and 'must be a number' in body['error'], (path, status, body)
+
+        # A malformed Content-Length gets a 400, not a dropped connection
+        with socket.create_connection(('127.0.0.1', api.port), timeout=10) as sock:
+            sock.sendall(b'POST /api/jobs HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+            assert sock.recv(1024).startswith(b'HTTP/1.1 400 ')
+
+        # Long actions stream their results as server-sent events
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('POST', '/api/jobs?stream=1', json.dumps({'action': 'start_all'}))
+        response = conn.getresponse()
+        assert response.getheader('Content-Type') == 'text/event-stream'
+        events = [line for line in response.read().decode().splitlines() if line.startswith('event:')]
+        conn.close()
+        assert events == ['event: result', 'event: job'], events
+
+        status, jobs = request(api.port, 'GET', '/api/jobs')
+        assert status == 200 and jobs[0]['action'] == 'start_all' and jobs[0]['state'] == 'finished'
+        print("✓ REST API serves reads, errors and streamed jobs")
+    finally:
+        api.stop()
+        daemon.jobs.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_event(response):
+    """Read one server-sent event from a streaming response as (name, data)"""
+    name = data = None
+    while True:
+        line = response.fp.readline().decode().rstrip('\n')
+        if line.startswith('event: '):
+            name = line[7:]
+        elif line.startswith('data: '):
+            data = json.loads(line[6:])
+        elif not line and name:
+            return name, data
+
+
+def test_dashboard_and_token():
+    """The dashboard page is public; the API accepts the token as a header or query parameter"""
+    tmp = tempfile.mkdtemp()
+    daemon = proxy_daemon.ProxyDaemon(os.path.join(tmp, 'daemon.sock'),
+                                      db_path=os.path.join(tmp, 'test.db'))
+    api = ApiServer(daemon, port=0, token='secret')
+    api.start_in_thread()
+    backlog = api_server.FLEET_EVENT_BACKLOG
+
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        page = response.read()
+        conn.close()
+        assert response.status == 200 and response.getheader('Content-Type').startswith('text/html')
+        assert b'/api/monitor/events' in page
+
+        assert request(api.port, 'GET', '/api/status')[0] == 401
+        assert request(api.port, 'GET', '/api/status?access_token=wrong')[0] == 401
+        assert request(api.port, 'GET', '/api/status?access_token=s%C3%A9cret')[0] == 401
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/api/status', headers={'Authorization': 'Bearer s\xe9cret'})
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        assert response.status == 401
+        assert request(api.port, 'GET', '/api/status?access_token=secret')[0] == 200
+
+        device_id = daemon.fleet.add_device('AAA', 'Pixel', '13')
+        conn_id = daemon.fleet.add_connection(device_id, 9090, 8080)
+        status, body = request(api.port, 'POST', f'/api/connections/{conn_id}/check-ip?access_token=secret')
+        assert status == 200 and body['connection']['id'] == conn_id
+        assert request(api.port, 'POST', '/api/connections/999/check-ip?access_token=secret')[0] == 404
+
+        for path in ('/api/monitor/events?interval=soon', '/api/monitor/events?interval=nan',
+                     '/api/monitor/events?since=latest'):
+            assert request(api.port, 'GET', f'{path}&access_token=secret')[0] == 400, path
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/api/monitor/events?access_token=secret', headers={'Last-Event-ID': 'x'})
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        assert response.status == 400
+
+        # Monitor deltas stream as 'snapshot' events
+        daemon.monitor.record_traffic(conn_id, 100, 200, clients=1)
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/api/monitor/events?interval=0.5&access_token=secret')
+        response = conn.getresponse()
+        assert response.getheader('Content-Type') == 'text/event-stream'
+        name, delta = read_event(response)
+        conn.close()
+        assert name == 'snapshot' and [row['id'] for row in delta['rows']] == [conn_id]
+        assert delta['rows'][0]['clients'] == 1
+
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/metrics', headers={'Authorization': 'Bearer secret'})
+        response = conn.getresponse()
+        text = response.read().decode()
+        conn.close()
+        assert response.status == 200 and response.getheader('Content-Type').startswith('text/plain')
+        assert 'mobile_proxy_connections{status="stopped"} 1' in text
+        assert '# TYPE mobile_proxy_db_write_seconds histogram' in text
+
+        # A fleet event client that falls behind is told so and disconnected
+        api_server.FLEET_EVENT_BACKLOG = 2
+        conn = http.client.HTTPConnection('127.0.0.1', api.port, timeout=10)
+        conn.request('GET', '/api/events?access_token=secret')
+        response = conn.getresponse()
+        # Hold the event loop so the burst queues up before the stream reads it
+        api.loop.call_soon_threadsafe(time.sleep, 0.3)
+        time.sleep(0.05)
+        for status in ('active', 'error', 'stopped', 'active', 'error'):
+            daemon.fleet.update_connection_status(conn_id, status)
+        names = [line for line in response.read().decode().splitlines() if line.startswith('event:')]
+        conn.close()
+        assert names[-1] == 'event: overflow' and len(names) <= 3, names
+        print("✓ Dashboard is served and tokens work as header or query parameter")
+    finally:
+        api_server.FLEET_EVENT_BACKLOG = backlog
+        api.stop()
+        daemon.jobs.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_api_round_trip()
+    test_dashboard_and_token()
+    print("\n✅ All tests passed!")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test the parallel bulk operations with stand-in proxy objects
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bulk_ops
+from database import Database
+
+
+class FakeProxy:
+    """Proxy stand-in whose start_proxy sleeps, hangs or fails per serial"""
+
+    def __init__(self, delay=0.2, hang=(), fail=()):
+        self.delay = delay
+        self.hang = set(hang)
+        self.fail = set(fail)
+        self.release = threading.Event()
+
+    def start_proxy(self, serial, local_port, remote_port):
+        if serial in self.hang:
+            self.release.wait(10)
+        time.sleep(self.delay)
+        return serial not in self.fail
+
+
+def make_db(serials):
+    """Temporary database with one stopped connection per serial"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    db = Database(path)
+    ids = db.upsert_devices({'serial': s, 'model': 'Pixel', 'android_version': '13'} for s in serials)
+    for port, serial in enumerate(serials, 9000):
+        db.add_connection(ids[serial], port, 8080)
+    return db
+
+
+def test_start_all_runs_in_parallel():
+    """Twenty 0.2s starts on 10 workers finish in well under the serial time"""
+    serials = [f'DEV{i:02d}' for i in range(20)]
+    db = make_db(serials)
+    try:
+        progress = []
+        started = time.monotonic()
+        results, summary = bulk_ops.start_all(db, FakeProxy(fail={'DEV03'}), parallel=10,
+                                              on_result=progress.append)
+        elapsed = time.monotonic() - started
+
+        assert elapsed < 2.0, elapsed
+        assert len(progress) == 20 and progress[-1]['index'] == 20
+        assert summary['ok'] == 19 and summary['failed'] == 1
+        assert len(db.get_connections_by_status('active')) == 19
+        print(f"✓ start_all() started 19/20 connections in {elapsed:.2f}s")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_hung_item_times_out():
+    """A hung device is reported as timed out without stalling the others"""
+    db = make_db(['GOOD1', 'HUNG', 'GOOD2'])
+    proxy = FakeProxy(delay=0, hang={'HUNG'})
+    try:
+        started = time.monotonic()
+        results, summary = bulk_ops.start_all(db, proxy, parallel=3, timeout=0.5)
+        elapsed = time.monotonic() - started
+
+        assert elapsed < 2.0, elapsed
+        assert summary['ok'] == 2 and summary['timeout'] == 1
+        assert [r['item']['serial'] for r in results if r['status'] == 'timeout'] == ['HUNG']
+        assert len(db.get_connections_by_status('active')) == 2
+
+        # The forward that comes up late is still recorded
+        proxy.release.set()
+        deadline = time.monotonic() + 5
+        while len(db.get_connections_by_status('active')) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(db.get_connections_by_status('active')) == 3
+        print("✓ Hung items time out individually and late results are written")
+    finally:
+        proxy.release.set()
+        os.remove(db.db_path)
+
+
+def test_selector_limits_targets():
+    """Only connections of devices matching the selector are started"""
+    db = make_db(['RACK3A', 'RACK3B', 'RACK4A'])
+    try:
+        for serial, rack in (('RACK3A', '3'), ('RACK3B', '3'), ('RACK4A', '4')):
+            db.set_device_tags(db.get_device_by_serial(serial)[0], {'rack': rack})
+
+        results, summary = bulk_ops.start_all(db, FakeProxy(delay=0), selector={'rack': '3'})
+        assert sorted(r['item']['serial'] for r in results) == ['RACK3A', 'RACK3B']
+        assert [c[2] for c in db.get_connections_by_status('stopped')] == ['RACK4A']
+
+        # The GUI's bulk actions name the connections it shows
+        rack4 = db.get_connections_by_serial('RACK4A')[0][0]
+        results, summary = bulk_ops.start_all(db, FakeProxy(delay=0), connection_ids=[rack4 + 1])
+        assert results == []
+        results, summary = bulk_ops.start_all(db, FakeProxy(delay=0), connection_ids=[rack4])
+        assert [r['item']['serial'] for r in results] == ['RACK4A']
+        print("✓ Selectors limit bulk operations to matching devices")
+    finally:
+        os.remove(db.db_path)
+
+
+class FakeForwardsAdb:
+    """adb stand-in that only answers `adb forward --list`"""
+
+    def __init__(self, forwards):
+        self.forwards = forwards
+
+    def list_all_forwards(self):
+        return self.forwards
+
+
+def test_reconcile_forwards():
+    """Statuses follow the forwards adb reports; an unreachable adb changes nothing"""
+    db = make_db(['AAA', 'BBB', 'CCC'])
+    try:
+        conns = {c[2]: c for c in db.get_connections()}
+        db.update_connection_status(conns['AAA'][0], 'active')
+        db.update_connection_status(conns['BBB'][0], 'active')
+
+        # AAA lost its forward, CCC has one left over, BBB matches
+        adb = FakeForwardsAdb([('BBB', 9001, 8080), ('CCC', 9002, 8080), ('ZZZ', 9500, 8080)])
+        assert bulk_ops.reconcile_forwards(db, FakeForwardsAdb(None)) == []
+        proxy = FakeProxy()
+        proxy.active_forwards = {}
+        updates = bulk_ops.reconcile_forwards(db, adb, proxy)
+
+        assert sorted(updates) == sorted([(conns['AAA'][0], 'stopped'), (conns['CCC'][0], 'active')])
+        statuses = {c[2]: c[5] for c in db.get_connections()}
+        assert statuses == {'AAA': 'stopped', 'BBB': 'active', 'CCC': 'active'}
+        assert sorted(proxy.active_forwards) == [9001, 9002]
+        assert bulk_ops.reconcile_forwards(db, adb) == []
+        print("✓ reconcile_forwards syncs statuses with adb forwards")
+    finally:
+        os.remove(db.db_path)
+
+
+if __name__ == '__main__':
+    test_start_all_runs_in_parallel()
+    test_hung_item_times_out()
+    test_selector_limits_targets()
+    test_reconcile_forwards()
+    print("\n✅ All tests passed!")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test the CLI's NDJSON output mode
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cli
+from database import Database
+
+
+def test_list_connections_ndjson():
+    """Each connection is written as its own JSON line"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    db = Database(path)
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        db.add_connection(device_id, 9090, 8080)
+        db.add_connection(device_id, 9091, 8080)
+
+        stream = io.StringIO()
+        cli.list_connections(db, cli.NDJSONWriter(stream))
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+        assert [r['type'] for r in records] == ['connection', 'connection']
+        assert [r['local_port'] for r in records] == [9090, 9091]
+        assert records[0]['serial'] == 'AAA' and records[0]['status'] == 'stopped'
+        print("✓ list-connections --json emits one line per connection")
+    finally:
+        os.remove(path)
+
+
+def test_list_devices_streams():
+    """Devices are emitted as the generator yields them"""
+    class FakeADB:
+        def iter_connected_devices(self):
+            yield {'serial': 'AAA', 'model': 'Pixel', 'android_version': '13'}
+            # The first line must already be written before the next device is read
+            assert stream.getvalue().count('\n') == 1
+            yield {'serial': 'BBB', 'model': 'Galaxy', 'android_version': '12'}
+
+    stream = io.StringIO()
+    cli.list_devices(FakeADB(), cli.NDJSONWriter(stream))
+    assert [json.loads(l)['serial'] for l in stream.getvalue().splitlines()] == ['AAA', 'BBB']
+    print("✓ list-devices --json streams devices as they are found")
+
+
+def test_db_only_commands_import_lazily():
+    """list-connections loads neither bulk_ops nor the adb and proxy managers"""
+    tmp = tempfile.mkdtemp()
+    try:
+        result = subprocess.run([sys.executable, '-X', 'importtime', cli.__file__, '--no-daemon',
+                                 'list-connections'],
+                                cwd=tmp, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        imported = {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines()
+                    if line.startswith('import time:')}
+        assert 'database' in imported
+        assert not imported & {'bulk_ops', 'adb_manager', 'proxy_manager'}, imported
+        print("✓ list-connections imports only what it uses")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_list_connections_ndjson()
+    test_list_devices_streams()
+    test_db_only_commands_import_lazily()
+    print("\n✅ All tests passed!")
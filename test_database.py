@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Test the Database bulk and lookup APIs against a temporary SQLite file
+"""
+import os
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database, parse_selector
+
+
+def make_db():
+    """Create a Database backed by a fresh temporary file"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    return Database(path)
+
+
+def test_upsert_devices_keeps_ids():
+    """Upserting existing devices must not change their ids"""
+    db = make_db()
+    try:
+        first = db.upsert_devices([
+            {'serial': 'AAA', 'model': 'Pixel', 'android_version': '13'},
+            {'serial': 'BBB', 'model': 'Galaxy', 'android_version': '12'},
+        ])
+        conn_id = db.add_connection(first['AAA'], 9090, 8080)
+
+        second = db.upsert_devices([
+            {'serial': 'AAA', 'model': 'Pixel 7', 'android_version': '14'},
+            {'serial': 'CCC', 'model': 'Moto', 'android_version': '11'},
+        ])
+        assert second['AAA'] == first['AAA']
+        assert db.add_device('BBB', 'Galaxy', '12') == first['BBB']
+
+        devices = {d[1]: d for d in db.get_devices()}
+        assert len(devices) == 3
+        assert devices['AAA'][2] == 'Pixel 7'
+
+        connections = db.get_connections()
+        assert connections[0][0] == conn_id
+        assert connections[0][2] == 'AAA'
+        print("✓ upsert_devices() keeps device ids stable")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_update_connection_statuses():
+    """Batch status updates only touch the IP when one is given"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        c1 = db.add_connection(device_id, 9090, 8080)
+        c2 = db.add_connection(device_id, 9091, 8080)
+        db.update_connection_status(c2, 'stopped', '10.0.0.2')
+
+        count = db.update_connection_statuses([
+            (c1, 'active', '10.0.0.1'),
+            (c2, 'active'),
+        ])
+        assert count == 2
+
+        rows = {c[0]: c for c in db.get_connections()}
+        assert rows[c1][5] == 'active' and rows[c1][6] == '10.0.0.1'
+        assert rows[c2][5] == 'active' and rows[c2][6] == '10.0.0.2'
+        assert db.update_connection_statuses([]) == 0
+        print("✓ update_connection_statuses() applies all updates")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_point_lookups():
+    """Lookups by id, serial, port and status return the matching rows"""
+    db = make_db()
+    try:
+        a = db.add_device('AAA', 'Pixel', '13')
+        b = db.add_device('BBB', 'Galaxy', '12')
+        c1 = db.add_connection(a, 9090, 8080)
+        c2 = db.add_connection(a, 9091, 8080)
+        c3 = db.add_connection(b, 9092, 8080)
+        db.update_connection_status(c2, 'active')
+
+        assert db.get_connection(c3)[2] == 'BBB'
+        assert db.get_connection(999) is None
+        assert db.get_connection_by_port(9091)[0] == c2
+        assert db.get_connection_by_port(1) is None
+        assert sorted(c[0] for c in db.get_connections_by_serial('AAA')) == [c1, c2]
+        assert [c[0] for c in db.get_connections_by_status('active')] == [c2]
+        assert db.get_device_by_serial('BBB')[0] == b
+        assert db.get_device_by_serial('ZZZ') is None
+        print("✓ Point lookups return the expected rows")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_device_tags():
+    """Tag selectors match devices carrying every requested tag"""
+    db = make_db()
+    try:
+        ids = db.upsert_devices({'serial': s, 'model': 'Pixel', 'android_version': '13'}
+                                for s in ('AAA', 'BBB', 'CCC'))
+        db.set_device_tags(ids['AAA'], {'carrier': 'tmobile', 'rack': 3})
+        db.set_device_tags(ids['BBB'], {'carrier': 'att', 'rack': '3', 'spare': None})
+        db.set_device_tags(ids['CCC'], {'carrier': 'tmobile', 'rack': '4'})
+        conn_id = db.add_connection(ids['AAA'], 9090, 8080)
+
+        serials = lambda rows: sorted(row[1] for row in rows)
+        assert serials(db.get_devices_by_tags({'rack': '3'})) == ['AAA', 'BBB']
+        assert serials(db.get_devices_by_tags({'carrier': 'tmobile', 'rack': '3'})) == ['AAA']
+        assert serials(db.get_devices_by_tags({'spare': None})) == ['BBB']
+        assert db.get_devices_by_tags({'carrier': 'verizon'}) == []
+        assert [c[0] for c in db.get_connections_by_tags({'carrier': 'tmobile'})] == [conn_id]
+
+        db.set_device_tags(ids['BBB'], {'carrier': 'tmobile'})
+        db.remove_device_tags(ids['BBB'], ['spare'])
+        assert db.get_device_tags(ids['BBB']) == {'carrier': 'tmobile', 'rack': '3'}
+
+        db.delete_device(ids['AAA'])
+        assert ids['AAA'] not in db.get_device_tags()
+        assert parse_selector('carrier=tmobile, spare') == {'carrier': 'tmobile', 'spare': None}
+        try:
+            parse_selector('=x')
+            assert False, "an empty selector key should raise"
+        except ValueError:
+            pass
+        print("✓ Device tags select the expected devices")
+    finally:
+        os.remove(db.db_path)
+
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("  Database Tests")
+    print("=" * 60)
+    print()
+
+    tests = [value for name, value in sorted(globals().items())
+             if name.startswith('test_') and callable(value)]
+    try:
+        for test in tests:
+            test()
+    except AssertionError:
+        import traceback
+        traceback.print_exc()
+        print("\n❌ Some tests failed!")
+        return 1
+
+    print("\n✅ All tests passed!")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
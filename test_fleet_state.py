@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Test FleetState caching and change notifications
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from fleet_state import FleetState
+
+
+def make_db():
+    """Create a Database backed by a fresh temporary file"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    return Database(path)
+
+
+def test_events_and_indexes():
+    """Writes through FleetState update the indexes and publish events"""
+    db = make_db()
+    try:
+        fleet = FleetState(db)
+        events = []
+        fleet.subscribe(events.append)
+
+        ids = fleet.upsert_devices([{'serial': 'AAA', 'model': 'Pixel', 'android_version': '13'}])
+        conn_id = fleet.add_connection(ids['AAA'], 9090, 8080)
+        fleet.update_connection_status(conn_id, 'active', '10.0.0.1')
+        assert [e.type for e in events] == [
+            'device_added', 'connection_added',
+            'connection_status_changed', 'connection_ip_changed',
+        ]
+
+        assert fleet.get_connection_by_port(9090)[0] == conn_id
+        assert fleet.get_connections_by_serial('AAA')[0][6] == '10.0.0.1'
+        assert db.get_connection(conn_id)[5] == 'active'
+
+        # Same status again is not a change
+        del events[:]
+        fleet.update_connection_status(conn_id, 'active')
+        assert events == []
+
+        fleet.delete_device(ids['AAA'])
+        assert [e.type for e in events] == ['connection_removed', 'device_removed']
+        assert fleet.get_connection_by_port(9090) is None
+        print("✓ FleetState indexes rows and publishes deltas")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_refresh_picks_up_external_changes():
+    """refresh() reports only what changed in the database"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        conn_id = db.add_connection(device_id, 9090, 8080)
+        fleet = FleetState(db)
+        events = []
+        fleet.subscribe(events.append, event_types=['connection_status_changed'])
+
+        assert fleet.refresh() == []
+        db.update_connection_status(conn_id, 'active')
+        fleet.refresh()
+        assert len(events) == 1 and events[0].new[5] == 'active'
+        print("✓ FleetState.refresh() publishes external changes")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_events_arrive_in_order():
+    """Concurrent writers and re-entrant subscribers see events in cache order"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        conn_id = db.add_connection(device_id, 9090, 8080)
+        fleet = FleetState(db)
+        statuses = []
+
+        def slow_subscriber(event):
+            time.sleep(0.001)
+            statuses.append(event.new[5])
+
+        fleet.subscribe(slow_subscriber, event_types=['connection_status_changed'])
+
+        def writer(status):
+            for _ in range(20):
+                fleet.update_connection_status(conn_id, status)
+
+        threads = [threading.Thread(target=writer, args=(s,)) for s in ('active', 'error', 'inactive')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The last event delivered describes the row that is in the cache now
+        assert statuses and statuses[-1] == fleet.get_connection(conn_id)[5]
+
+        # A subscriber that writes sees its own event after the current one
+        seen = []
+
+        def echo(event):
+            seen.append(event.new[5])
+            if event.new[5] == 'error':
+                fleet.update_connection_status(conn_id, 'active')
+
+        fleet.unsubscribe(slow_subscriber)
+        fleet.update_connection_status(conn_id, 'stopped')
+        fleet.subscribe(echo, event_types=['connection_status_changed'])
+        fleet.subscribe(lambda event: seen.append('second:' + event.new[5]),
+                        event_types=['connection_status_changed'])
+        fleet.update_connection_status(conn_id, 'inactive')
+        fleet.update_connection_status(conn_id, 'error')
+        assert seen == ['inactive', 'second:inactive', 'error', 'second:error',
+                        'active', 'second:active'], seen
+        print("✓ FleetState delivers events in the order the cache changed")
+    finally:
+        os.remove(db.db_path)
+
+
+if __name__ == '__main__':
+    test_events_and_indexes()
+    test_refresh_picks_up_external_changes()
+    test_events_arrive_in_order()
+    print("\n✅ All tests passed!")
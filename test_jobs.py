@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test background jobs: submission, progress, stored results and following
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from jobs import Job, JobManager, JobStore, JOB_FAILED, JOB_FINISHED, JOB_RUNNING
+
+
+class FakeProxy:
+    """Proxy stand-in whose starts take a little while and fail for one serial"""
+
+    def start_proxy(self, serial, local_port, remote_port):
+        time.sleep(0.1)
+        return serial != 'BAD'
+
+
+def make_db(serials):
+    """Temporary database with one stopped connection per serial"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    db = Database(path)
+    ids = db.upsert_devices({'serial': s, 'model': 'Pixel', 'android_version': '13'} for s in serials)
+    for port, serial in enumerate(serials, 9000):
+        db.add_connection(ids[serial], port, 8080)
+    return db
+
+
+def test_job_lifecycle():
+    """submit() returns at once; results are streamed, stored and readable elsewhere"""
+    db = make_db(['AAA', 'BBB', 'BAD', 'CCC'])
+    manager = JobManager(db, None, FakeProxy(), JobStore(db), max_workers=4)
+    try:
+        started = time.monotonic()
+        job_id = manager.submit('start_all', {'parallel': 2})
+        assert time.monotonic() - started < 0.1, "submit should not wait for the job"
+
+        streamed = []
+        job = manager.follow(job_id, streamed.append)
+        assert job['state'] == JOB_FINISHED
+        assert job['total'] == 4 and job['ok'] == 3
+        assert [r['index'] for r in streamed] == [1, 2, 3, 4]
+
+        # Another process sees the same job through the store
+        store = JobStore(db)
+        assert store.get_job(job_id)['summary']['failed'] == 1
+        stored = store.get_results(job_id)
+        assert sorted(r['item']['serial'] for r in stored) == ['AAA', 'BAD', 'BBB', 'CCC']
+        assert [r['index'] for r in store.get_results(job_id, after=2)] == [3, 4]
+        assert store.list_jobs()[0]['id'] == job_id
+
+        for action, params in [('start_all', {'wait_time': 3}), ('start_all', [1]), (['start_all'], {}),
+                               ('start_all', {'parallel': 0}), ('start_all', {'parallel': 'x'}),
+                               ('stop_all', {'timeout': -1}), ('change_all_ips', {'wait_time': 'abc'}),
+                               ('check_all_ips', {'serials': 'AAA'}), ('start_all', {'selector': {'rack': [3]}})]:
+            try:
+                manager.submit(action, params)
+                assert False, f"{action} {params} should be rejected"
+            except ValueError:
+                pass
+        print("✓ Jobs run in the background and their results are stored")
+    finally:
+        manager.shutdown()
+        os.remove(db.db_path)
+
+
+def test_shutdown_cancels_queued_jobs():
+    """Jobs still queued at shutdown never run and stay marked interrupted"""
+    db = make_db(['AAA', 'BBB'])
+    proxy = FakeProxy()
+    calls = []
+    proxy.start_proxy = lambda serial, local_port, remote_port: calls.append(serial) or time.sleep(0.3) or True
+    manager = JobManager(db, None, proxy, JobStore(db), max_workers=1, max_jobs=1)
+    try:
+        running = manager.submit('start_all', {'parallel': 1})
+        queued = manager.submit('stop_all')
+        time.sleep(0.1)
+        manager.shutdown(wait=False)
+        time.sleep(0.8)
+
+        store = JobStore(db)
+        for job_id in (running, queued):
+            job = store.get_job(job_id)
+            assert job['state'] == JOB_FAILED and job['error'] == 'Interrupted by shutdown', job
+        assert store.get_job(queued)['started_at'] is None
+        assert calls == ['AAA'], calls
+        print("✓ Shutdown cancels queued jobs")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_orphaned_jobs_fail():
+    """Jobs left running by a dead process are failed on startup and when followed"""
+    db = make_db(['AAA'])
+    store = JobStore(db)
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+
+    def stored_job(owner):
+        job = Job('start_all', {})
+        job.state, job.owner = JOB_RUNNING, owner
+        store.save_job(job.to_dict())
+        return job.id
+
+    crashed, alive = stored_job(dead.pid), stored_job(os.getpid())
+    manager = JobManager(db, None, FakeProxy(), store)
+    try:
+        job = store.get_job(crashed)
+        assert job['state'] == JOB_FAILED and job['error'].startswith('Interrupted'), job
+        assert store.get_job(alive)['state'] == JOB_RUNNING
+
+        # A job orphaned after startup no longer makes follow() poll forever
+        killed = stored_job(dead.pid)
+        started = time.monotonic()
+        assert manager.follow(killed, lambda result: None, timeout=10)['state'] == JOB_FAILED
+        assert time.monotonic() - started < 2
+        print("✓ Jobs of a dead process are marked failed")
+    finally:
+        manager.shutdown()
+        os.remove(db.db_path)
+
+
+if __name__ == '__main__':
+    test_job_lifecycle()
+    test_shutdown_cancels_queued_jobs()
+    test_orphaned_jobs_fail()
+    print("\n✅ All tests passed!")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Test the RowList filtering and diff updates behind the GUI lists
+"""
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from list_model import RowList, connection_row
+
+
+class FakeView:
+    """Stands in for a RecycleView; records whole-list assignments"""
+
+    def __init__(self):
+        self._data = []
+        self.assignments = 0
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, rows):
+        self._data = list(rows)
+        self.assignments += 1
+
+
+def make_rows(count):
+    return [connection_row((i, 1, f'SER{i:03d}', 9000 + i, 8080, 'stopped', None, None))
+            for i in range(1, count + 1)]
+
+
+def test_sync_writes_only_changed_rows():
+    """Status/IP changes replace single entries; inserts replace the list"""
+    rows = RowList('connection_id', ('serial', 'current_ip', 'local_port'), status_field='status')
+    rows.replace_all(make_rows(200))
+    view = FakeView()
+
+    assert rows.sync(view) == 200 and view.assignments == 1
+    assert rows.sync(view) == 0
+
+    changed = dict(view.data[9], status='active', current_ip='10.0.0.1')
+    rows.set_row(changed)
+    assert rows.sync(view) == 1 and view.assignments == 1
+    assert view.data[9] == changed
+
+    rows.set_row(make_rows(201)[-1])
+    rows.sync(view)
+    assert view.assignments == 2 and len(view.data) == 201
+    print("✓ RowList.sync only writes changed rows")
+
+
+def test_search_filter_and_overlay():
+    """Search, status filter and overlays shape the visible rows"""
+    rows = RowList('connection_id', ('serial', 'current_ip', 'local_port'), status_field='status')
+    rows.replace_all(make_rows(20))
+    rows.set_row(dict(rows.rows[5], status='active', current_ip='10.1.2.3'))
+
+    rows.set_filter(query='ser01')
+    assert [r['connection_id'] for r in rows.visible_rows()] == list(range(10, 20))
+    rows.set_filter(query='10.1.2')
+    assert [r['connection_id'] for r in rows.visible_rows()] == [5]
+    rows.set_filter(query='', status='stopped')
+    assert rows.count() == (19, 20)
+
+    rows.set_filter(status='all')
+    rows.set_overlay(3, busy=True)
+    assert rows.visible_rows()[2]['busy'] is True
+    assert rows.rows[3]['busy'] is False
+    rows.clear_overlay(3)
+    assert rows.visible_rows()[2]['busy'] is False
+
+    try:
+        rows.set_filter(status='broken')
+        assert False, "unknown status filter accepted"
+    except ValueError:
+        pass
+    print("✓ RowList search, status filter and overlays")
+
+
+if __name__ == '__main__':
+    test_sync_writes_only_changed_rows()
+    test_search_filter_and_overlay()
+    print("\n✅ All tests passed!")
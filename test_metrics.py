@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test the metrics registry and its Prometheus text output
+"""
+import os
+import sys
+import threading
+import urllib.request
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from metrics import Registry, start_http_server
+
+
+def test_counters_sum_across_threads():
+    """Per-thread shards add up to the exact total"""
+    registry = Registry()
+    counter = registry.counter('test_bytes_total', 'Bytes', ['direction'])
+    child = counter.labels(direction='in')
+
+    def work():
+        for _ in range(10000):
+            child.inc(2)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert child.value() == 8 * 10000 * 2
+    assert counter.labels('in') is child
+    assert 'test_bytes_total{direction="in"} 160000' in registry.render()
+    try:
+        counter.labels(side='in')
+        assert False, "unknown label accepted"
+    except KeyError:
+        pass
+    print("✓ Counters sum per-thread shards")
+
+
+def test_histogram_and_gauge_rendering():
+    """Histograms render cumulative buckets; gauges can read a function"""
+    registry = Registry()
+    histogram = registry.histogram('test_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    gauge = registry.gauge('test_devices', 'Devices')
+    gauge.set(3)
+    gauge.inc()
+    status = registry.gauge('test_connections', 'Connections', ['status'])
+    status.labels(status='active').set_function(lambda: 7)
+
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{le="0.1"} 2' in text
+    assert 'test_seconds_bucket{le="1"} 3' in text
+    assert 'test_seconds_bucket{le="+Inf"} 4' in text
+    assert 'test_seconds_sum 3.65' in text and 'test_seconds_count 4' in text
+    assert 'test_devices 4' in text
+    assert 'test_connections{status="active"} 7' in text
+
+    with histogram.time():
+        pass
+    assert histogram.count() == 5
+    print("✓ Histograms and gauges render in the Prometheus format")
+
+
+def test_http_endpoint():
+    """start_http_server serves the registry at /metrics"""
+    registry = Registry()
+    registry.counter('test_requests_total', 'Requests').inc()
+    server = start_http_server(0, registry=registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert 'test_requests_total 1' in response.read().decode()
+        print("✓ /metrics endpoint serves the registry")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    test_counters_sum_across_threads()
+    test_histogram_and_gauge_rendering()
+    test_http_endpoint()
+    print("\n✅ All tests passed!")
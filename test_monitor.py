@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test ConnectionMonitor probes, rotations and snapshot deltas
+"""
+import os
+import socket
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from fleet_state import FleetState
+from monitor import ConnectionMonitor
+from timeseries import TimeSeriesStore
+
+
+class FakeProxy:
+    """Probes succeed with a fixed latency on open ports only"""
+
+    def __init__(self, open_ports):
+        self.open_ports = set(open_ports)
+
+    def probe_connection(self, local_port, timeout=5):
+        return 10.0 if local_port in self.open_ports else None
+
+
+def make_db():
+    """Create a Database backed by a fresh temporary file"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    return Database(path)
+
+
+def test_probes_and_deltas():
+    """Probe results land in the stats and snapshots only return changed rows"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        up = db.add_connection(device_id, 9090, 8080)
+        down = db.add_connection(device_id, 9091, 8080)
+        idle = db.add_connection(device_id, 9092, 8080)
+        db.update_connection_statuses([(up, 'active'), (down, 'active')])
+
+        fleet = FleetState(db)
+        store = TimeSeriesStore(db)
+        monitor = ConnectionMonitor(fleet, FakeProxy([9090]), store)
+
+        first = monitor.snapshot()
+        assert sorted(r['id'] for r in first['rows']) == [up, down, idle]
+
+        assert monitor.probe_all() == 2
+        delta = monitor.snapshot(first['version'])
+        rows = {r['id']: r for r in delta['rows']}
+        assert sorted(rows) == [up, down]
+        assert rows[up]['latency_ewma'] == 10.0
+        assert rows[down]['latency_ewma'] is None and rows[down]['probe_failures'] == 1
+
+        monitor.record_rotation('AAA')
+        fleet.delete_connection(idle)
+        delta = monitor.snapshot(delta['version'])
+        assert delta['removed'] == [idle]
+        assert all(r['last_rotation'] for r in delta['rows'])
+        assert store.get_last_rotations().keys() >= {up, down}
+
+        assert monitor.snapshot(delta['version'])['rows'] == []
+        print("✓ ConnectionMonitor tracks probes, rotations and deltas")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_removed_is_bounded():
+    """Old removals are forgotten; viewers older than them get a full snapshot"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        kept = db.add_connection(device_id, 9090, 8080)
+        doomed = [db.add_connection(device_id, 9100 + i, 8080) for i in range(5)]
+
+        fleet = FleetState(db)
+        monitor = ConnectionMonitor(fleet, FakeProxy([]), max_removed=2)
+        start = monitor.snapshot()['version']
+        for connection_id in doomed[:3]:
+            fleet.delete_connection(connection_id)
+        recent = monitor.snapshot()['version']
+        for connection_id in doomed[3:]:
+            fleet.delete_connection(connection_id)
+        assert sorted(monitor.removed) == doomed[3:]
+
+        delta = monitor.snapshot(start)
+        assert delta['full'] and delta['removed'] == []
+        assert [r['id'] for r in delta['rows']] == [kept]
+
+        delta = monitor.snapshot(recent)
+        assert not delta['full'] and delta['removed'] == doomed[3:]
+        print("✓ ConnectionMonitor bounds removals and resyncs stale viewers")
+    finally:
+        os.remove(db.db_path)
+
+
+if __name__ == '__main__':
+    test_probes_and_deltas()
+    test_removed_is_bounded()
+    print("\n✅ All tests passed!")
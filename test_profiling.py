@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test the cProfile and sampling profile sessions
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import profiling
+import proxy_daemon
+
+
+def spin(seconds):
+    """Busy loop so the function shows up in profiles"""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_cprofile_session():
+    """cprofile mode writes a sorted summary and a pstats dump"""
+    tmp = tempfile.mkdtemp()
+    try:
+        profiling.start(os.path.join(tmp, 'cli.prof'), 'cprofile', at_exit=False)
+        try:
+            profiling.start(os.path.join(tmp, 'other'), 'cprofile', at_exit=False)
+            assert False, "second session started"
+        except RuntimeError:
+            pass
+        spin(0.05)
+        paths = profiling.stop()
+        assert paths == [os.path.join(tmp, 'cli.txt'), os.path.join(tmp, 'cli.prof')]
+        with open(paths[0]) as f:
+            summary = f.read()
+        assert 'Sorted by cumulative time' in summary and 'spin' in summary
+        assert profiling.stop() == []
+        print("✓ cProfile session writes summary and raw dump")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_daemon_sampling_toggle():
+    """The daemon samples every thread between profile_start and profile_stop"""
+    tmp = tempfile.mkdtemp()
+    daemon = proxy_daemon.ProxyDaemon(os.path.join(tmp, 'daemon.sock'),
+                                      db_path=os.path.join(tmp, 'test.db'))
+    try:
+        base = os.path.join(tmp, 'window')
+        response = daemon.handle_request({'id': 1, 'method': 'daemon.profile_start', 'params': [base, 0.002]})
+        assert response['result'] == {'base': base, 'mode': 'sample'}
+
+        worker = threading.Thread(target=spin, args=(0.2,), name='worker-1')
+        worker.start()
+        worker.join()
+
+        paths = daemon.handle_request({'id': 2, 'method': 'daemon.profile_stop'})['result']
+        assert paths == [f'{base}.txt', f'{base}.folded']
+        with open(f'{base}.folded') as f:
+            folded = f.read()
+        assert any(line.startswith('worker;') and 'spin (' in line for line in folded.splitlines())
+        with open(f'{base}.txt') as f:
+            assert 'Own samples' in f.read()
+
+        response = daemon.handle_request({'id': 3, 'method': 'daemon.profile_stop'})
+        assert 'No profile' in response['error']['message']
+        print("✓ Daemon sampling profile can be toggled at runtime")
+    finally:
+        profiling.stop()
+        daemon.jobs.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_cli_profile_bypasses_daemon():
+    """--profile runs the command in the CLI even with a daemon running"""
+    tmp = tempfile.mkdtemp()
+    socket_path = os.path.join(tmp, 'daemon.sock')
+    server = proxy_daemon.ProxyDaemon(socket_path, db_path=os.path.join(tmp, 'daemon.db'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.02)
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+        result = subprocess.run([sys.executable, cli, '--socket', socket_path, '--profile', 'out',
+                                 'list-connections'],
+                                cwd=tmp, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        with open(os.path.join(tmp, 'out.txt')) as f:
+            summary = f.read()
+        assert '(get_connections)' in summary, summary
+        assert '(call)' not in summary, summary
+        print("✓ cli.py --profile bypasses a running daemon")
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_cprofile_session()
+    test_daemon_sampling_toggle()
+    test_cli_profile_bypasses_daemon()
+    print("\n✅ All tests passed!")
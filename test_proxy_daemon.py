@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test the JSON-RPC daemon and its thin client over a UNIX socket
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import proxy_daemon
+
+
+def test_daemon_round_trip():
+    """Clients call db/proxy methods on the daemon's warm instances"""
+    tmp = tempfile.mkdtemp()
+    socket_path = os.path.join(tmp, 'daemon.sock')
+    server = proxy_daemon.ProxyDaemon(socket_path, db_path=os.path.join(tmp, 'test.db'))
+    server.status_buffer.flush_interval = 60
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        client = None
+        for _ in range(100):
+            client = proxy_daemon.connect(socket_path)
+            if client:
+                break
+            threading.Event().wait(0.02)
+        assert client is not None
+
+        assert client.call('daemon.ping')['pid'] == os.getpid()
+        assert os.stat(socket_path).st_mode & 0o777 == 0o600
+
+        db = client.service('db')
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        conn_id = db.add_connection(device_id, 9090, 8080)
+        db.update_connection_status(conn_id, 'active')
+        row = db.get_connection(conn_id)
+        assert row[2] == 'AAA' and row[5] == 'active'
+        status = client.call('daemon.status')
+        assert status['active_connections'] == 1
+
+        # Status writes are batched: readers of the daemon see them at once,
+        # the database once the buffer flushes
+        assert status['pending_status_writes'] == 1
+        assert server.db.get_connection(conn_id)[5] == 'stopped'
+        db.update_connection_statuses([(conn_id, 'active', '10.0.0.1')])
+        assert db.get_connection(conn_id)[6] == '10.0.0.1'
+
+        # Bulk actions stream one notification per item before the summary
+        progress = []
+        summary = client.call('fleet.check_all_ips', 4, 5, on_progress=progress.append)
+        assert summary['total'] == len(progress)
+
+        try:
+            client.call('os.system', 'true')
+            assert False, "unexposed method was callable"
+        except proxy_daemon.DaemonError:
+            pass
+
+        client.call('daemon.shutdown')
+        client.close()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert not os.path.exists(socket_path)
+        # Shutting down flushes what is still buffered
+        assert server.db.get_connection(conn_id)[5:7] == ('active', '10.0.0.1')
+        print("✓ Daemon serves JSON-RPC calls over its UNIX socket")
+    finally:
+        server.shutdown()
+
+
+def test_default_socket_dir_is_private():
+    """The default socket directory is created private and refused when others can write to it"""
+    tmp = tempfile.mkdtemp()
+    saved = {name: os.environ.get(name) for name in ('XDG_RUNTIME_DIR', 'TMPDIR')}
+    try:
+        os.environ.pop('XDG_RUNTIME_DIR', None)
+        os.environ['TMPDIR'] = tmp
+        runtime_dir = proxy_daemon._runtime_dir()
+        assert os.path.dirname(runtime_dir) == tmp
+
+        proxy_daemon._prepare_socket_dir(os.path.join(runtime_dir, 'mobile_proxy.sock'))
+        assert os.stat(runtime_dir).st_mode & 0o777 == 0o700
+
+        os.chmod(runtime_dir, 0o777)
+        try:
+            proxy_daemon._prepare_socket_dir(os.path.join(runtime_dir, 'mobile_proxy.sock'))
+            assert False, "a world-writable socket directory was accepted"
+        except RuntimeError:
+            pass
+        print("✓ Default daemon socket lives in a private per-user directory")
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_daemon_round_trip()
+    test_default_socket_dir_is_private()
+    print("\n✅ All tests passed!")
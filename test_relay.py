@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Test the in-process relay against a local echo server
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from metrics import RELAY_BYTES
+from proxy_manager import ProxyManager
+from relay import create_relay, RELAY_MODES
+
+
+def start_echo_server():
+    """Echo server on a free port; returns (socket, port)"""
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve(conn):
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server, server.getsockname()[1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def echo_through(port, payload):
+    """Send payload through the relay and read the echo back"""
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(payload)
+        sock.shutdown(socket.SHUT_WR)
+        received = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return received
+            received += data
+
+
+class FakeAdb:
+    """adb stand-in whose dynamic forwards point at the echo server"""
+
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.removed = []
+
+    def create_dynamic_forward(self, serial, remote_port):
+        return self.target_port
+
+    def remove_port_forward(self, serial, local_port):
+        self.removed.append(local_port)
+        return True
+
+
+def test_relay_modes():
+    """Both modes relay traffic both ways and report it per key"""
+    echo, echo_port = start_echo_server()
+    try:
+        for mode in RELAY_MODES:
+            reports = []
+            relay = create_relay(mode, flush_interval=0.1,
+                                 on_traffic=lambda *args: reports.append(args))
+            port = free_port()
+            relayed_before = RELAY_BYTES.labels(direction='in').value()
+            try:
+                assert relay.start('conn', port, echo_port)
+                assert not relay.start('conn', port, echo_port)
+
+                payload = os.urandom(300 * 1024)
+                assert echo_through(port, payload) == payload
+                time.sleep(0.3)
+
+                assert relay.stats()['conn']['bytes_in'] == len(payload)
+                assert relay.stats()['conn']['bytes_out'] == len(payload)
+                assert sum(r[1] for r in reports) == len(payload)
+                assert sum(r[2] for r in reports) == len(payload)
+                assert reports[-1][3] == 0
+                assert RELAY_BYTES.labels(direction='in').value() - relayed_before == len(payload)
+
+                assert relay.stop('conn') and not relay.is_relaying('conn')
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    assert False, f"{mode}: port still listening after stop"
+                except OSError:
+                    pass
+            finally:
+                relay.close()
+            print(f"✓ {mode} relay copies and accounts traffic")
+    finally:
+        echo.close()
+
+
+def test_proxy_manager_relays():
+    """With a relay, start_proxy listens on the local port and stop_proxy cleans up"""
+    echo, echo_port = start_echo_server()
+    adb = FakeAdb(echo_port)
+    proxy = ProxyManager(adb, create_relay('thread'))
+    port = free_port()
+    try:
+        assert proxy.start_proxy('AAA', port, 8080)
+        assert proxy.get_active_forwards()[port]['forward_port'] == echo_port
+        assert echo_through(port, b'hello') == b'hello'
+
+        assert proxy.stop_proxy('AAA', port)
+        assert adb.removed == [echo_port]
+        assert port not in proxy.get_active_forwards()
+        print("✓ ProxyManager starts and stops relayed connections")
+    finally:
+        proxy.close()
+        echo.close()
+
+
+def test_proxy_manager_close_stops_relayed():
+    """close() removes the adb forwards of relayed connections and marks them stopped"""
+    echo, echo_port = start_echo_server()
+    adb = FakeAdb(echo_port)
+    proxy = ProxyManager(adb, create_relay('thread'))
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, 'test.db'))
+    port = free_port()
+    try:
+        connection_id = db.add_connection(db.add_device('AAA', 'Pixel', '13'), port, 8080)
+        assert proxy.start_proxy('AAA', port, 8080)
+        db.update_connection_status(connection_id, 'active', '10.0.0.1')
+
+        assert proxy.close(db) == [port]
+        assert adb.removed == [echo_port]
+        assert proxy.get_active_forwards() == {}
+        assert db.get_connection(connection_id)[5] == 'stopped'
+        with socket.socket() as sock:
+            assert sock.connect_ex(('127.0.0.1', port)) != 0
+        print("✓ ProxyManager.close stops relayed connections")
+    finally:
+        echo.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_relay_modes()
+    test_proxy_manager_relays()
+    test_proxy_manager_close_stops_relayed()
+    print("\n✅ All tests passed!")
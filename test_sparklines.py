@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test the ring buffer and series store behind the GUI sparklines
+"""
+import math
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sparklines import RingBuffer, SeriesStore, sparkline_points
+
+
+def test_ring_buffer_wraps():
+    """The buffer keeps the newest samples in order without growing"""
+    buffer = RingBuffer(4)
+    assert len(buffer) == 0 and buffer.last() is None
+    for value in (1, 2, None, 4, 5, 6):
+        buffer.append(value)
+
+    values = list(buffer.values())
+    assert len(buffer) == 4 and len(buffer.data) == 4
+    assert math.isnan(values[0]) and values[1:] == [4, 5, 6]
+    assert buffer.last() == 6 and buffer.peak() == 6
+
+    points = sparkline_points(buffer.values(), 0, 0, 30, 12)
+    assert points == [10, 8, 20, 10, 30, 12]
+    assert sparkline_points(RingBuffer(3).values(), 0, 0, 10, 10) == []
+    print("✓ RingBuffer wraps and scales into sparkline points")
+
+
+def test_series_store_samples_snapshots():
+    """Snapshot deltas become one sample per connection per tick"""
+    def row(connection_id, status='active', rate=None, clients=0, latency=None):
+        return {'id': connection_id, 'status': status, 'bytes_rate': rate,
+                'clients': clients, 'last_latency': latency}
+
+    store = SeriesStore(capacity=10)
+    store.update({'version': 3, 'rows': [row(1, rate=2048, clients=2, latency=12.5),
+                                         row(2, status='stopped')], 'removed': []})
+    store.sample()
+    store.update({'version': 4, 'rows': [row(1, rate=4096, clients=3, latency=None)], 'removed': []})
+    store.sample()
+
+    series = store.get(1)
+    assert list(series.throughput.values()) == [2048, 4096]
+    assert series.clients.last() == 3 and series.latency.last() is None
+    assert store.get(2).throughput.last() is None
+    assert store.version == 4
+
+    store.update({'version': 5, 'rows': [], 'removed': [2]})
+    assert store.get(2) is None
+    print("✓ SeriesStore samples monitor snapshots")
+
+
+if __name__ == '__main__':
+    test_ring_buffer_wraps()
+    test_series_store_samples_snapshots()
+    print("\n✅ All tests passed!")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test the write-behind StatusWriteBuffer against a temporary SQLite file
+"""
+import os
+import sys
+import tempfile
+import threading
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from status_buffer import StatusWriteBuffer
+
+
+def make_db():
+    """Create a Database backed by a fresh temporary file"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    return Database(path)
+
+
+def test_updates_are_coalesced():
+    """Many updates to one connection become a single pending write"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        c1 = db.add_connection(device_id, 9090, 8080)
+        c2 = db.add_connection(device_id, 9091, 8080)
+        buffer = StatusWriteBuffer(db)
+
+        for i in range(100):
+            buffer.update_connection_status(c1, 'active', f'10.0.0.{i}')
+        buffer.update_connection_status(c1, 'degraded')
+        buffer.update_connection_status(c2, 'active')
+        assert buffer.pending_count() == 2
+
+        # Readers see buffered values before anything hits the database
+        assert db.get_connection(c1)[5] == 'stopped'
+        row = buffer.get_connection(c1)
+        assert row[5] == 'degraded' and row[6] == '10.0.0.99'
+        assert [r[0] for r in buffer.get_connections_by_status('active')] == [c2]
+
+        assert buffer.flush() == 2
+        assert buffer.pending_count() == 0
+        row = db.get_connection(c1)
+        assert row[5] == 'degraded' and row[6] == '10.0.0.99'
+        assert db.get_connection(c2)[5] == 'active'
+        print("✓ StatusWriteBuffer coalesces and flushes updates")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_stop_flushes():
+    """Stopping the background flusher writes pending changes"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        c1 = db.add_connection(device_id, 9090, 8080)
+
+        with StatusWriteBuffer(db, flush_interval=60) as buffer:
+            buffer.update_connection_status(c1, 'active', '10.0.0.1')
+        assert db.get_connection(c1)[6] == '10.0.0.1'
+        print("✓ StatusWriteBuffer flushes on shutdown")
+    finally:
+        os.remove(db.db_path)
+
+
+def test_reads_during_flush():
+    """A batch being written stays visible to readers until it commits"""
+    db = make_db()
+    try:
+        device_id = db.add_device('AAA', 'Pixel', '13')
+        c1 = db.add_connection(device_id, 9090, 8080)
+        buffer = StatusWriteBuffer(db)
+        writing, release = threading.Event(), threading.Event()
+        commit = db.update_connection_statuses
+
+        def slow_commit(updates):
+            updates = list(updates)
+            writing.set()
+            release.wait(10)
+            if updates[0][1] == 'broken':
+                raise RuntimeError('disk full')
+            return commit(updates)
+
+        db.update_connection_statuses = slow_commit
+        buffer.update_connection_status(c1, 'active', '10.0.0.1')
+        flusher = threading.Thread(target=buffer.flush)
+        flusher.start()
+        assert writing.wait(10)
+        assert buffer.pending_count() == 0
+        assert buffer.get_connection(c1)[5:7] == ('active', '10.0.0.1')
+        assert [r[0] for r in buffer.get_connections_by_status('active')] == [c1]
+        # A status-only update keeps the IP of the batch in flight
+        buffer.update_connection_status(c1, 'degraded')
+        release.set()
+        flusher.join()
+        assert buffer.inflight == {}
+        assert buffer.get_connection(c1)[5:7] == ('degraded', '10.0.0.1')
+
+        # A failed commit puts the batch back
+        buffer.flush()
+        buffer.update_connection_status(c1, 'broken', '10.0.0.2')
+        try:
+            buffer.flush()
+            assert False, 'flush should re-raise'
+        except RuntimeError:
+            pass
+        assert buffer.inflight == {} and buffer.get_pending(c1)[0] == 'broken'
+        print("✓ StatusWriteBuffer serves reads of a batch being flushed")
+    finally:
+        os.remove(db.db_path)
+
+
+if __name__ == '__main__':
+    test_updates_are_coalesced()
+    test_stop_flushes()
+    test_reads_during_flush()
+    print("\n✅ All tests passed!")
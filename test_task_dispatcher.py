@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test TaskDispatcher coalescing and result hand-off
+"""
+import os
+import sys
+import threading
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from task_dispatcher import TaskDispatcher
+
+
+def test_duplicate_keys_coalesce():
+    """A key submitted while running joins the running task"""
+    scheduled = []
+    dispatcher = TaskDispatcher(max_workers=4, schedule=scheduled.append)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 'ip'
+
+    results = []
+    assert dispatcher.submit(('check_ip', 1), slow, lambda r, e: results.append((r, e)))
+    assert not dispatcher.submit(('check_ip', 1), slow, lambda r, e: results.append((r, e)))
+    assert dispatcher.busy(('check_ip', 1))
+    release.set()
+    dispatcher.shutdown(wait=True)
+
+    # Callbacks went through schedule, not straight from the worker
+    assert results == []
+    for callback in scheduled:
+        callback()
+    assert len(calls) == 1
+    assert results == [('ip', None), ('ip', None)]
+    assert not dispatcher.busy(('check_ip', 1))
+    print("✓ Duplicate submissions coalesce into one task")
+
+
+def test_errors_and_independent_keys():
+    """Exceptions reach on_done; different keys run concurrently"""
+    dispatcher = TaskDispatcher(max_workers=4)
+    done = []
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fail():
+        raise RuntimeError('adb timed out')
+
+    dispatcher.submit(('a',), barrier.wait, lambda r, e: done.append(('a', e)))
+    dispatcher.submit(('b',), barrier.wait, lambda r, e: done.append(('b', e)))
+    dispatcher.submit(('c',), fail, lambda r, e: done.append(('c', str(e))))
+    dispatcher.shutdown(wait=True)
+
+    assert sorted(done) == [('a', None), ('b', None), ('c', 'adb timed out')]
+    assert not dispatcher.submit(('d',), lambda: None)
+    print("✓ Errors are reported and keys run independently")
+
+
+if __name__ == '__main__':
+    test_duplicate_keys_coalesce()
+    test_errors_and_independent_keys()
+    print("\n✅ All tests passed!")
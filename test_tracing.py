@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test tracing spans and the Chrome trace export
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+from tracing import span, traced
+
+
+@traced('work', 'test')
+def work():
+    with span('inner', 'test', step=1):
+        pass
+
+
+def test_spans_and_export():
+    """Spans are recorded only while tracing and export as trace events"""
+    tmp = tempfile.mkdtemp()
+    try:
+        work()
+        tracer = tracing.start(os.path.join(tmp, 'trace.json'))
+        work()
+        worker = threading.Thread(target=work, name='worker')
+        worker.start()
+        worker.join()
+        try:
+            with span('failing', 'test'):
+                raise ValueError('boom')
+        except ValueError:
+            pass
+        assert len(tracer.events) == 5
+        path = tracing.stop()
+        work()
+        assert len(tracer.events) == 5 and tracing.current() is None
+
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        spans = [e for e in events if e['ph'] == 'X']
+        assert [e['name'] for e in spans] == ['inner', 'work', 'inner', 'work', 'failing']
+        inner, outer = spans[0], spans[1]
+        assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+        assert inner['args'] == {'step': 1} and spans[-1]['args'] == {'error': 'ValueError'}
+        assert 'worker' in [e['args']['name'] for e in events if e['ph'] == 'M']
+        print("✓ Spans export as Chrome trace events")
+    finally:
+        tracing.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_cli_trace_flag():
+    """cli.py --trace writes the trace of the command on exit"""
+    tmp = tempfile.mkdtemp()
+    try:
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+        result = subprocess.run([sys.executable, cli, '--no-daemon', '--trace', 'out.json',
+                                 'list-connections'],
+                                cwd=tmp, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        with open(os.path.join(tmp, 'out.json')) as f:
+            names = {e['name'] for e in json.load(f)['traceEvents']}
+        assert 'db.query_connections' in names, names
+        print("✓ cli.py --trace writes a trace file")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def test_cli_trace_bypasses_daemon():
+    """--trace runs the command in the CLI even with a daemon running"""
+    import proxy_daemon
+    tmp = tempfile.mkdtemp()
+    socket_path = os.path.join(tmp, 'daemon.sock')
+    server = proxy_daemon.ProxyDaemon(socket_path, db_path=os.path.join(tmp, 'daemon.db'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            threading.Event().wait(0.02)
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+        result = subprocess.run([sys.executable, cli, '--socket', socket_path, '--trace', 'out.json',
+                                 'list-connections'],
+                                cwd=tmp, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        with open(os.path.join(tmp, 'out.json')) as f:
+            names = {e['name'] for e in json.load(f)['traceEvents']}
+        assert 'db.query_connections' in names, names
+        assert not any(name.startswith('rpc ') for name in names), names
+        print("✓ cli.py --trace bypasses a running daemon")
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_spans_and_export()
+    test_cli_trace_flag()
+    test_cli_trace_bypasses_daemon()
+    print("\n✅ All tests passed!")
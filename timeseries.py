@@ -0,0 +1,372 @@
+"""
+Time-series storage for per-connection latency, throughput and health samples
+"""
+import sqlite3
+import time
+
+
+# Seconds covered by each rollup table
+RESOLUTIONS = {
+    '1m': 60,
+    '1h': 3600,
+}
+
+# Default retention in seconds for each table
+DEFAULT_RETENTION = {
+    'raw': 2 * 86400,
+    '1m': 14 * 86400,
+    '1h': 400 * 86400,
+}
+
+SAMPLE_TABLES = {
+    'raw': 'connection_samples',
+    '1m': 'connection_samples_1m',
+    '1h': 'connection_samples_1h',
+}
+
+# 1-minute buckets that received samples after they were rolled up
+LATE_TABLE = 'connection_samples_late'
+
+# Recomputed buckets replace what the rollup tables held for them
+ROLLUP_CONFLICT = '''
+    ON CONFLICT(connection_id, ts) DO UPDATE SET
+        samples = excluded.samples,
+        latency_count = excluded.latency_count,
+        latency_sum = excluded.latency_sum,
+        latency_min = excluded.latency_min,
+        latency_max = excluded.latency_max,
+        bytes_in = excluded.bytes_in,
+        bytes_out = excluded.bytes_out,
+        errors = excluded.errors,
+        rotations = excluded.rotations
+'''
+
+
+class TimeSeriesStore:
+    """Compact sample history stored next to the main database
+
+    Raw samples are keyed by (connection_id, ts) with integer unix timestamps
+    in WITHOUT ROWID tables. They are downsampled into 1-minute and 1-hour
+    rollups and pruned according to the retention settings; both happen
+    automatically every maintenance_interval seconds while samples are being
+    recorded, or on demand through maintain(). Samples that arrive for
+    buckets already rolled up are noted in LATE_TABLE and re-aggregated by
+    the next rollup.
+    """
+
+    def __init__(self, db, retention=None, maintenance_interval=60):
+        self.db_path = db.db_path
+        self.retention = dict(DEFAULT_RETENTION)
+        if retention:
+            self.retention.update(retention)
+        self.maintenance_interval = maintenance_interval
+        self.last_maintenance = 0
+        self.init_tables()
+
+    def init_tables(self):
+        """Create the sample and rollup tables"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS connection_samples (
+                connection_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                latency_ms REAL,
+                bytes_in INTEGER NOT NULL DEFAULT 0,
+                bytes_out INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                rotations INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (connection_id, ts)
+            ) WITHOUT ROWID
+        ''')
+
+        for table in (SAMPLE_TABLES['1m'], SAMPLE_TABLES['1h']):
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    connection_id INTEGER NOT NULL,
+                    ts INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    latency_count INTEGER NOT NULL,
+                    latency_sum REAL,
+                    latency_min REAL,
+                    latency_max REAL,
+                    bytes_in INTEGER NOT NULL,
+                    bytes_out INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    rotations INTEGER NOT NULL,
+                    PRIMARY KEY (connection_id, ts)
+                ) WITHOUT ROWID
+            ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {LATE_TABLE} (
+                connection_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                PRIMARY KEY (connection_id, ts)
+            ) WITHOUT ROWID
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def record_sample(self, connection_id, latency_ms=None, bytes_in=0, bytes_out=0,
+                      errors=0, rotations=0, ts=None):
+        """Record a single sample for a connection"""
+        self.record_samples([{
+            'connection_id': connection_id,
+            'ts': ts,
+            'latency_ms': latency_ms,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'errors': errors,
+            'rotations': rotations,
+        }])
+
+    def record_samples(self, samples):
+        """Record many samples in one transaction
+
+        Each sample is a dict with connection_id and any of ts, latency_ms,
+        bytes_in, bytes_out, errors and rotations. Two samples for the same
+        connection and second are merged: counters add up and the newest
+        latency wins.
+        """
+        now = int(time.time())
+        rows = [
+            (
+                sample['connection_id'],
+                now if sample.get('ts') is None else int(sample['ts']),
+                sample.get('latency_ms'),
+                sample.get('bytes_in', 0),
+                sample.get('bytes_out', 0),
+                sample.get('errors', 0),
+                sample.get('rotations', 0),
+            )
+            for sample in samples
+        ]
+        if not rows:
+            return 0
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            INSERT INTO connection_samples
+                (connection_id, ts, latency_ms, bytes_in, bytes_out, errors, rotations)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(connection_id, ts) DO UPDATE SET
+                latency_ms = COALESCE(excluded.latency_ms, latency_ms),
+                bytes_in = bytes_in + excluded.bytes_in,
+                bytes_out = bytes_out + excluded.bytes_out,
+                errors = errors + excluded.errors,
+                rotations = rotations + excluded.rotations
+        ''', rows)
+
+        # Minutes that were already rolled up need aggregating again
+        width = RESOLUTIONS['1m']
+        cursor.execute(f"SELECT MAX(ts) FROM {SAMPLE_TABLES['1m']}")
+        rolled = cursor.fetchone()[0]
+        if rolled is not None:
+            late = {(row[0], row[1] - row[1] % width) for row in rows if row[1] - row[1] % width < rolled}
+            cursor.executemany(f'INSERT OR IGNORE INTO {LATE_TABLE} (connection_id, ts) VALUES (?, ?)',
+                               late)
+
+        conn.commit()
+        conn.close()
+
+        if now - self.last_maintenance >= self.maintenance_interval:
+            self.maintain(now)
+
+        return len(rows)
+
+    def get_samples(self, connection_id, start, end=None, resolution=None):
+        """Get samples for a connection between two unix timestamps
+
+        resolution is 'raw', '1m' or '1h'; by default the finest resolution
+        that still covers the range under the retention settings is used.
+        Returns (ts, samples, latency_avg, latency_min, latency_max, bytes_in,
+        bytes_out, errors, rotations) tuples ordered by ts.
+        """
+        end = int(end if end is not None else time.time())
+        start = int(start)
+        if resolution is None:
+            resolution = self.pick_resolution(start, end)
+        table = SAMPLE_TABLES[resolution]
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        if resolution == 'raw':
+            cursor.execute(f'''
+                SELECT ts, 1, latency_ms, latency_ms, latency_ms,
+                       bytes_in, bytes_out, errors, rotations
+                FROM {table}
+                WHERE connection_id = ? AND ts >= ? AND ts < ?
+                ORDER BY ts
+            ''', (connection_id, start, end))
+        else:
+            cursor.execute(f'''
+                SELECT ts, samples,
+                       CASE WHEN latency_count > 0 THEN latency_sum / latency_count END,
+                       latency_min, latency_max, bytes_in, bytes_out, errors, rotations
+                FROM {table}
+                WHERE connection_id = ? AND ts >= ? AND ts < ?
+                ORDER BY ts
+            ''', (connection_id, start, end))
+
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def get_last_rotations(self):
+        """Get {connection_id: unix time of the most recent recorded rotation}"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        last = {}
+        # Coarse tables first so finer (more precise) timestamps win
+        for table in (SAMPLE_TABLES['1h'], SAMPLE_TABLES['1m'], SAMPLE_TABLES['raw']):
+            cursor.execute(f'''
+                SELECT connection_id, MAX(ts) FROM {table}
+                WHERE rotations > 0
+                GROUP BY connection_id
+            ''')
+            for connection_id, ts in cursor.fetchall():
+                if ts >= last.get(connection_id, 0):
+                    last[connection_id] = ts
+
+        conn.close()
+        return last
+
+    def pick_resolution(self, start, end=None):
+        """Choose the finest resolution whose retention still covers start"""
+        end = end if end is not None else time.time()
+        span = end - start
+        age = time.time() - start
+        if age <= self.retention['raw'] and span <= 6 * 3600:
+            return 'raw'
+        if age <= self.retention['1m'] and span <= 7 * 86400:
+            return '1m'
+        return '1h'
+
+    def maintain(self, now=None):
+        """Roll samples up into the 1m/1h tables and prune expired rows"""
+        now = int(now if now is not None else time.time())
+        self.rollup(now)
+        self.prune(now)
+        self.last_maintenance = now
+
+    def rollup(self, now=None):
+        """Aggregate complete buckets into the rollup tables
+
+        Buckets from the newest existing rollup onwards are recomputed, as
+        are the minutes (and their hours) listed in LATE_TABLE, so calling
+        this repeatedly is idempotent.
+        """
+        now = int(now if now is not None else time.time())
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        self._rollup_raw(cursor, now)
+        self._rollup_minutes(cursor, now)
+        cursor.execute(f'DELETE FROM {LATE_TABLE}')
+
+        conn.commit()
+        conn.close()
+
+    def _rollup_raw(self, cursor, now):
+        """Aggregate raw samples into 1-minute buckets"""
+        width = RESOLUTIONS['1m']
+        table = SAMPLE_TABLES['1m']
+        start = self._rollup_start(cursor, table)
+        end = now - now % width
+
+        cursor.execute(f'''
+            INSERT INTO {table}
+            SELECT connection_id, ts - ts % {width}, COUNT(*), COUNT(latency_ms),
+                   SUM(latency_ms), MIN(latency_ms), MAX(latency_ms),
+                   SUM(bytes_in), SUM(bytes_out), SUM(errors), SUM(rotations)
+            FROM connection_samples
+            WHERE ts >= ? AND ts < ?
+            GROUP BY connection_id, ts - ts % {width}
+            {ROLLUP_CONFLICT}
+        ''', (start, end))
+
+        cursor.execute(f'''
+            INSERT INTO {table}
+            SELECT s.connection_id, late.ts, COUNT(*), COUNT(s.latency_ms),
+                   SUM(s.latency_ms), MIN(s.latency_ms), MAX(s.latency_ms),
+                   SUM(s.bytes_in), SUM(s.bytes_out), SUM(s.errors), SUM(s.rotations)
+            FROM {LATE_TABLE} late
+            JOIN connection_samples s
+              ON s.connection_id = late.connection_id AND s.ts >= late.ts AND s.ts < late.ts + {width}
+            WHERE late.ts < ?
+            GROUP BY s.connection_id, late.ts
+            {ROLLUP_CONFLICT}
+        ''', (end,))
+
+    def _rollup_minutes(self, cursor, now):
+        """Aggregate 1-minute buckets into 1-hour buckets"""
+        width = RESOLUTIONS['1h']
+        source = SAMPLE_TABLES['1m']
+        table = SAMPLE_TABLES['1h']
+        start = self._rollup_start(cursor, table)
+        end = now - now % width
+
+        cursor.execute(f'''
+            INSERT INTO {table}
+            SELECT connection_id, ts - ts % {width}, SUM(samples), SUM(latency_count),
+                   SUM(latency_sum), MIN(latency_min), MAX(latency_max),
+                   SUM(bytes_in), SUM(bytes_out), SUM(errors), SUM(rotations)
+            FROM {source}
+            WHERE ts >= ? AND ts < ?
+            GROUP BY connection_id, ts - ts % {width}
+            {ROLLUP_CONFLICT}
+        ''', (start, end))
+
+        # Hours holding late minutes; later hours are covered by the range above
+        cursor.execute(f'''
+            INSERT INTO {table}
+            SELECT m.connection_id, late.hour, SUM(m.samples), SUM(m.latency_count),
+                   SUM(m.latency_sum), MIN(m.latency_min), MAX(m.latency_max),
+                   SUM(m.bytes_in), SUM(m.bytes_out), SUM(m.errors), SUM(m.rotations)
+            FROM (SELECT DISTINCT connection_id, ts - ts % {width} AS hour FROM {LATE_TABLE}) late
+            JOIN {source} m
+              ON m.connection_id = late.connection_id AND m.ts >= late.hour AND m.ts < late.hour + {width}
+            WHERE late.hour < ?
+            GROUP BY m.connection_id, late.hour
+            {ROLLUP_CONFLICT}
+        ''', (end,))
+
+    def _rollup_start(self, cursor, table):
+        """First bucket to (re)compute: the newest one already in the table"""
+        cursor.execute(f'SELECT MAX(ts) FROM {table}')
+        latest = cursor.fetchone()[0]
+        return latest if latest is not None else 0
+
+    def prune(self, now=None):
+        """Delete samples older than each table's retention"""
+        now = int(now if now is not None else time.time())
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        deleted = 0
+        for resolution, table in SAMPLE_TABLES.items():
+            cursor.execute(f'DELETE FROM {table} WHERE ts < ?',
+                           (now - self.retention[resolution],))
+            deleted += cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return deleted
+
+    def delete_connection(self, connection_id):
+        """Delete all history of a connection"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        for table in list(SAMPLE_TABLES.values()) + [LATE_TABLE]:
+            cursor.execute(f'DELETE FROM {table} WHERE connection_id = ?', (connection_id,))
+
+        conn.commit()
+        conn.close()
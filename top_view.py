@@ -0,0 +1,246 @@
+"""
+Live terminal dashboard (`cli.py top`) for headless servers
+"""
+import time
+
+
+SORT_KEYS = {
+    'id': lambda r: r['id'],
+    'status': lambda r: (r['status'] != 'active', r['id']),
+    'latency': lambda r: (r['latency_ewma'] is None, -(r['latency_ewma'] or 0)),
+    'throughput': lambda r: -(r['bytes_rate'] or 0),
+    'rotation': lambda r: (r['last_rotation'] is None, -(r['last_rotation'] or 0)),
+}
+
+COLUMNS = (
+    # (title, width, formatter)
+    ('ID', 6, lambda r, now: str(r['id'])),
+    ('SERIAL', 20, lambda r, now: r['serial']),
+    ('PORT', 6, lambda r, now: str(r['local_port'])),
+    ('STATUS', 8, lambda r, now: r['status']),
+    ('EGRESS IP', 16, lambda r, now: r['current_ip'] or '-'),
+    ('LAT ms', 8, lambda r, now: f"{r['latency_ewma']:.1f}" if r['latency_ewma'] is not None else '-'),
+    ('THROUGHPUT', 11, lambda r, now: format_rate(r['bytes_rate'])),
+    ('CLIENTS', 7, lambda r, now: str(r['clients'])),
+    ('ROTATED', 10, lambda r, now: format_age(r['last_rotation'], now)),
+)
+
+
+def format_rate(bytes_per_second):
+    """Human-readable byte rate"""
+    if bytes_per_second is None:
+        return '-'
+    for unit in ('B/s', 'KB/s', 'MB/s'):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.0f} {unit}"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GB/s"
+
+
+def format_age(timestamp, now):
+    """Time since a unix timestamp, e.g. '3m12s ago'"""
+    if not timestamp:
+        return '-'
+    seconds = max(0, int(now - timestamp))
+    if seconds < 60:
+        return f"{seconds}s ago"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s ago"
+    if seconds < 86400:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m ago"
+    return f"{seconds // 86400}d ago"
+
+
+def format_row(row, now):
+    """Fixed-width text line for a connection"""
+    return ' '.join(fmt(row, now)[:width].ljust(width) for _, width, fmt in COLUMNS)
+
+
+def header_line():
+    """Column titles aligned with format_row()"""
+    return ' '.join(title.ljust(width) for title, width, _ in COLUMNS)
+
+
+class LocalSource:
+    """Snapshots from an in-process monitor, for when no daemon is running"""
+
+    def __init__(self, db, proxy, refresh_interval=5):
+        from fleet_state import FleetState
+        from timeseries import TimeSeriesStore
+        from monitor import ConnectionMonitor
+
+        self.fleet = FleetState(db)
+        self.monitor = ConnectionMonitor(self.fleet, proxy, TimeSeriesStore(db))
+        self.refresh_interval = refresh_interval
+        self.last_refresh = time.monotonic()
+
+    def start(self):
+        """Probe in the background while the view is open"""
+        self.monitor.start()
+
+    def prime(self):
+        """Probe once synchronously so a one-shot snapshot has latencies"""
+        self.monitor.probe_all()
+
+    def fetch(self, since):
+        """Rows changed since version `since`"""
+        now = time.monotonic()
+        if now - self.last_refresh >= self.refresh_interval:
+            self.fleet.refresh()
+            self.last_refresh = now
+        return self.monitor.snapshot(since)
+
+    def close(self):
+        """Stop background probing"""
+        self.monitor.stop()
+
+
+class DaemonSource:
+    """Snapshots from the daemon's monitor"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def start(self):
+        """The daemon probes continuously; nothing to start"""
+
+    def prime(self):
+        """The daemon already has recent probe results"""
+
+    def fetch(self, since):
+        """Rows changed since version `since`"""
+        return self.client.call('monitor.snapshot', since)
+
+    def close(self):
+        """Nothing to release; the daemon keeps running"""
+
+
+class TopView:
+    """Connection table maintained from snapshot deltas"""
+
+    def __init__(self, source):
+        self.source = source
+        self.rows = {}
+        self.version = 0
+        self.sort_key = 'id'
+        self.order = []
+        self.offset = 0
+
+    def update(self):
+        """Apply the delta since the last update; returns True if anything changed"""
+        delta = self.source.fetch(self.version)
+        self.version = delta['version']
+        if delta.get('full'):
+            self.rows = {}
+        for row in delta['rows']:
+            self.rows[row['id']] = row
+        for connection_id in delta['removed']:
+            self.rows.pop(connection_id, None)
+
+        changed = bool(delta['rows'] or delta['removed'] or delta.get('full'))
+        if changed:
+            self.resort()
+        return changed
+
+    def resort(self):
+        """Recompute the display order"""
+        self.order = sorted(self.rows.values(), key=SORT_KEYS[self.sort_key])
+
+    def cycle_sort(self):
+        """Switch to the next sort key"""
+        keys = list(SORT_KEYS)
+        self.sort_key = keys[(keys.index(self.sort_key) + 1) % len(keys)]
+        self.resort()
+
+    def summary(self):
+        """One-line fleet summary for the top of the screen"""
+        active = [r for r in self.rows.values() if r['status'] == 'active']
+        latencies = [r['latency_ewma'] for r in active if r['latency_ewma'] is not None]
+        avg = f"{sum(latencies) / len(latencies):.1f} ms" if latencies else '-'
+        rate = sum(r['bytes_rate'] or 0 for r in active)
+        return (f"{len(self.rows)} connections, {len(active)} active | avg latency {avg} | "
+                f"throughput {format_rate(rate)} | sort: {self.sort_key}")
+
+    def visible_rows(self, height):
+        """Rows for the current scroll window"""
+        self.offset = max(0, min(self.offset, len(self.order) - height))
+        return self.order[self.offset:self.offset + height]
+
+
+def run_once(source):
+    """Print a single plain-text snapshot"""
+    view = TopView(source)
+    view.update()
+    now = time.time()
+    print(view.summary())
+    print(header_line())
+    for row in view.order:
+        print(format_row(row, now))
+    return 0
+
+
+def run_curses(source, interval=1.0):
+    """Interactive full-screen view; q quits, s changes sort, arrows/PgUp/PgDn scroll"""
+    import curses
+
+    def loop(stdscr):
+        curses.curs_set(0)
+        stdscr.timeout(int(interval * 1000))
+        view = TopView(source)
+
+        def draw(y, text, height, width, attr=0):
+            # Tiny or shrinking terminals: skip what does not fit
+            if y >= height or width < 2:
+                return
+            try:
+                stdscr.addnstr(y, 0, text, width - 1, attr)
+            except curses.error:
+                pass
+
+        while True:
+            view.update()
+            height, width = stdscr.getmaxyx()
+            body_height = max(0, height - 3)
+            now = time.time()
+
+            # Redraw in place; curses only sends the characters that changed
+            stdscr.erase()
+            draw(0, view.summary(), height, width, curses.A_BOLD)
+            draw(1, header_line(), height, width, curses.A_REVERSE)
+            for i, row in enumerate(view.visible_rows(body_height)):
+                draw(2 + i, format_row(row, now), height, width)
+            if height >= 3:
+                draw(height - 1, "q: quit  s: sort  arrows/PgUp/PgDn: scroll", height, width)
+            stdscr.refresh()
+
+            key = stdscr.getch()
+            if key in (ord('q'), ord('Q')):
+                return
+            elif key in (ord('s'), ord('S')):
+                view.cycle_sort()
+            elif key in (curses.KEY_DOWN, ord('j')):
+                view.offset += 1
+            elif key in (curses.KEY_UP, ord('k')):
+                view.offset = max(0, view.offset - 1)
+            elif key == curses.KEY_NPAGE:
+                view.offset += body_height
+            elif key == curses.KEY_PPAGE:
+                view.offset = max(0, view.offset - body_height)
+
+    curses.wrapper(loop)
+    return 0
+
+
+def run(db, proxy, client=None, interval=1.0, once=False):
+    """Entry point for `cli.py top`"""
+    source = DaemonSource(client) if client else LocalSource(db, proxy)
+    try:
+        if once:
+            source.prime()
+            return run_once(source)
+        source.start()
+        return run_curses(source, interval)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        source.close()
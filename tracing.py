@@ -0,0 +1,152 @@
+"""
+Lightweight tracing spans exported in the Chrome trace-event format, for
+seeing where the time of an operation goes (open the file in
+https://ui.perfetto.dev or chrome://tracing)
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+# Events kept per trace; later spans are counted but dropped
+MAX_EVENTS = 1000000
+
+# The active Tracer, or None when tracing is off
+_tracer = None
+
+
+class Tracer:
+    """Collects finished spans as trace events
+
+    Events are appended to a plain list (atomic under the GIL), so spans
+    from any thread are recorded without a lock.
+    """
+
+    def __init__(self, path=None, max_events=MAX_EVENTS):
+        self.path = path
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.thread_names = {}
+
+    def complete(self, name, category, start_ns, end_ns, args=None):
+        """Record a span that ran from start_ns to end_ns (time.perf_counter_ns())"""
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        tid = threading.get_native_id()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                 'ts': (start_ns - self.origin) / 1000, 'dur': (end_ns - start_ns) / 1000}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def trace_events(self):
+        """Thread-name metadata followed by the recorded spans"""
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                     'args': {'name': name}} for tid, name in list(self.thread_names.items())]
+        return metadata + list(self.events)
+
+    def write(self, path=None):
+        """Write the trace as JSON; returns the path"""
+        path = path or self.path
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_events': self.dropped}}, f)
+        return path
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        args = self.args
+        if exc_type is not None:
+            args = dict(args or {}, error=exc_type.__name__)
+        self.tracer.complete(self.name, self.category, self.start, time.perf_counter_ns(), args)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current():
+    """The active Tracer, or None"""
+    return _tracer
+
+
+def span(name, category='', **args):
+    """Context manager timing its block as a span; does nothing when tracing is off"""
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def traced(name, category=''):
+    """Decorator recording each call of a function as a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.complete(name, category, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
+
+
+def start(path, max_events=MAX_EVENTS):
+    """Turn tracing on; the trace is written to path by stop() or at exit"""
+    global _tracer
+    _tracer = Tracer(path, max_events)
+    atexit.register(stop)
+    return _tracer
+
+
+def stop():
+    """Turn tracing off and write the trace; returns its path, or None if tracing was off"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    atexit.unregister(stop)
+    try:
+        path = tracer.write()
+    except OSError as e:
+        print(f"Error writing trace to {tracer.path}: {e}")
+        return None
+    print(f"Trace written to {path} ({len(tracer.events)} spans)", file=sys.stderr)
+    return path